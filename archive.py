@@ -0,0 +1,236 @@
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from candle_store import TIMEFRAME_SECONDS
+from candles import CANDLE_DTYPE, Candles
+
+# python archive.py import BTCUSDT 3min klines.csv
+# python archive.py export BTCUSDT 3min --output klines.csv
+# python archive.py info
+
+# ================== Settings ==================
+ARCHIVE_DIR = os.environ.get('CANDLE_ARCHIVE', 'candle_archive')
+RECORD_SIZE = CANDLE_DTYPE.itemsize
+FILE_EXTENSION = '.candles'
+
+# ================== Candle Archive ==================
+
+
+class CandleArchive:
+    # One append-only file of fixed-width CANDLE_DTYPE records per market and
+    # timeframe, sorted by time. Only closed candles are stored, so a candle
+    # time is never written twice
+
+    def __init__(self, root=ARCHIVE_DIR):
+        self.root = root
+        self._last_times = {}
+        self._lock = threading.Lock()
+
+    def path(self, market, timeframe):
+        return os.path.join(self.root, market, timeframe + FILE_EXTENSION)
+
+    def markets(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root)
+                      if os.path.isdir(os.path.join(self.root, name)))
+
+    def timeframes(self, market):
+        directory = os.path.join(self.root, market)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(name[:-len(FILE_EXTENSION)]
+                      for name in os.listdir(directory)
+                      if name.endswith(FILE_EXTENSION))
+
+    def exists(self, market, timeframe):
+        return os.path.exists(self.path(market, timeframe))
+
+    def last_time(self, market, timeframe):
+        key = (market, timeframe)
+        if key not in self._last_times:
+            path = self.path(market, timeframe)
+            last_time = None
+            if _whole_size(path, truncate=True):
+                with open(path, 'rb') as f:
+                    f.seek(-RECORD_SIZE, os.SEEK_END)
+                    last_time = int(
+                        np.frombuffer(f.read(RECORD_SIZE),
+                                      dtype=CANDLE_DTYPE)['time'][0])
+            self._last_times[key] = last_time
+        return self._last_times[key]
+
+    def forget(self, market):
+        # Drops the cached last times of `market`, e.g. after another process
+        # appended to its files
+        with self._lock:
+            for key in list(self._last_times):
+                if key[0] == market:
+                    del self._last_times[key]
+
+    def records(self, market, timeframe):
+        # Read-only memory map of every whole stored record
+        path = self.path(market, timeframe)
+        size = _whole_size(path)
+        if not size:
+            return np.empty(0, dtype=CANDLE_DTYPE)
+        return np.memmap(path,
+                         dtype=CANDLE_DTYPE,
+                         mode='r',
+                         shape=(size // RECORD_SIZE, ))
+
+    def read(self, market, timeframe, start=None, end=None, limit=None):
+        # Candles with start <= time < end as views into the memory map
+        records = self.records(market, timeframe)
+        times = records['time']
+        first = 0 if start is None else int(np.searchsorted(times, start))
+        last = len(records) if end is None else int(
+            np.searchsorted(times, end))
+        if limit:
+            first = max(first, last - limit)
+        return Candles.from_records(records[first:last])
+
+    def append(self, market, timeframe, candles, now=None):
+        # Appends the closed candles newer than the last stored one and
+        # returns how many were written
+        records = _to_records(candles)
+        if not len(records):
+            return 0
+        step = TIMEFRAME_SECONDS[timeframe]
+        now = time.time() if now is None else now
+        with self._lock:
+            last_time = self.last_time(market, timeframe)
+            keep = records['time'] + step <= now
+            if last_time is not None:
+                keep &= records['time'] > last_time
+            records = records[keep]
+            if not len(records):
+                return 0
+            records = records[np.unique(records['time'],
+                                        return_index=True)[1]]
+            path = self.path(market, timeframe)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'ab') as f:
+                f.write(records.tobytes())
+            self._last_times[(market, timeframe)] = int(records['time'][-1])
+            return len(records)
+
+    def merge(self, market, timeframe, candles, now=None):
+        # Merges candles from anywhere in time (e.g. an import of older
+        # history) by rewriting the file; later copies of a time win
+        records = _to_records(candles)
+        step = TIMEFRAME_SECONDS[timeframe]
+        now = time.time() if now is None else now
+        records = records[records['time'] + step <= now]
+        with self._lock:
+            existing = np.array(self.records(market, timeframe))
+            combined = np.concatenate((existing, records))
+            # np.unique keeps the first index, so search the reversed array
+            reverse = combined[::-1]
+            _, index = np.unique(reverse['time'], return_index=True)
+            combined = reverse[index]
+            path = self.path(market, timeframe)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = path + '.tmp'
+            with open(temp_path, 'wb') as f:
+                f.write(combined.tobytes())
+            os.replace(temp_path, path)
+            self._last_times.pop((market, timeframe), None)
+            return len(combined) - len(existing)
+
+
+def _whole_size(path, truncate=False):
+    # Bytes of the whole records in `path`. An append torn by a crash leaves
+    # part of a record at the end, which `truncate` cuts off so later
+    # appends start on a record boundary
+    if not os.path.exists(path):
+        return 0
+    size = os.path.getsize(path)
+    whole = size - size % RECORD_SIZE
+    if truncate and whole != size:
+        with open(path, 'r+b') as f:
+            f.truncate(whole)
+    return whole
+
+
+def _to_records(candles):
+    if isinstance(candles, np.ndarray):
+        return np.asarray(candles, dtype=CANDLE_DTYPE)
+    if not isinstance(candles, Candles):
+        candles = Candles.from_klines(candles)
+    return candles.to_records()
+
+
+# ================== Import / Export ==================
+
+
+def load_file(path):
+    # .npy CANDLE_DTYPE records, .csv with a time,open,close,high,low,volume
+    # header, or .json with CoinEx kline rows (optionally the whole response)
+    if path.endswith('.npy'):
+        return Candles.from_records(np.load(path))
+    if path.endswith('.json'):
+        with open(path) as f:
+            data = json.load(f)
+        rows = data['data'] if isinstance(data, dict) else data
+        return Candles(*zip(*[[float(v) for v in row[:6]] for row in rows]))
+    data = np.loadtxt(path, delimiter=',', skiprows=1, ndmin=2)
+    return Candles(*(data[:, i] for i in range(6)))
+
+
+def save_file(path, candles):
+    if path.endswith('.npy'):
+        np.save(path, candles.to_records())
+        return
+    with open(path, 'w') as f:
+        f.write('time,open,close,high,low,volume\n')
+        for k in candles.to_klines():
+            f.write(f"{k['time']},{k['open']!r},{k['close']!r},"
+                    f"{k['high']!r},{k['low']!r},{k['volume']!r}\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Candle archive tool")
+    parser.add_argument('--root', default=ARCHIVE_DIR)
+    commands = parser.add_subparsers(dest='command', required=True)
+    importer = commands.add_parser('import')
+    importer.add_argument('market')
+    importer.add_argument('timeframe', choices=list(TIMEFRAME_SECONDS))
+    importer.add_argument('files', nargs='+')
+    exporter = commands.add_parser('export')
+    exporter.add_argument('market')
+    exporter.add_argument('timeframe', choices=list(TIMEFRAME_SECONDS))
+    exporter.add_argument('--output', required=True)
+    exporter.add_argument('--start', type=int)
+    exporter.add_argument('--end', type=int)
+    commands.add_parser('info')
+    args = parser.parse_args(argv)
+
+    archive = CandleArchive(args.root)
+    if args.command == 'import':
+        for path in args.files:
+            added = archive.merge(args.market, args.timeframe,
+                                  load_file(path))
+            print(f"{path}: {added} new candles")
+    elif args.command == 'export':
+        candles = archive.read(args.market, args.timeframe, args.start,
+                               args.end)
+        save_file(args.output, candles)
+        print(f"Exported {len(candles)} candles to {args.output}")
+    else:
+        for market in archive.markets():
+            for timeframe in archive.timeframes(market):
+                candles = archive.read(market, timeframe)
+                first = candles.time[0] if len(candles) else '-'
+                last = candles.time[-1] if len(candles) else '-'
+                print(f"{market:<12} {timeframe:<7} {len(candles):>9} "
+                      f"{first} {last}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,377 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import bot_code
+from candle_store import TIMEFRAME_SECONDS
+from archive import CandleArchive
+from candles import Candles, resample, synthetic_candles
+from indicators import atr, volume_zscore
+from swings import apply_pivot, find_pivots, new_swings
+
+# python backtest.py --data history/ --markets BTCUSDT,ETHUSDT
+# python backtest.py --synthetic-days 365 --markets 24
+#
+# The replay sends the signals scan_market sends at the same M3 closes, at
+# the same prices (tests/test_backtest.py), except for the risk, which
+# comes from the H1 trend:
+# - The replay starts from the first candle of the history and sees every
+#   H1 pivot. A live bot starts from empty swings on the last 200 H1
+#   candles, so its H1 trend needs a few swings (a day or more) to warm up.
+# - The live bot only runs the H1 stage for scans that get past algo 4, and
+#   then only searches the last swing_lookback_slow H1 candles, so it can
+#   miss H1 pivots the replay has.
+
+# ================== Settings ==================
+TIMEFRAMES = ['3min', '15min', '1hour']
+# How many M3 candles after a signal are checked for stop/target hits
+OUTCOME_HORIZON = 480
+OUTCOMES = ['stop', 'target1', 'target2', 'target3']
+# STRATEGY keys replay_market honors. The swing lookbacks are left out since
+# the replay feeds every pivot in order
+REPLAY_PARAMS = [
+    'swing_width', 'signal_cooldown', 'stop_offset_divisor', 'min_volume_z',
+    'min_channel_atr'
+]
+
+# ================== History ==================
+
+
+def load_candles(path):
+    # .npy files hold CANDLE_DTYPE records and are memory-mapped; .csv files
+    # have a time,open,close,high,low,volume header
+    if path.endswith('.npy'):
+        return Candles.from_records(np.load(path, mmap_mode='r'))
+    data = np.loadtxt(path, delimiter=',', skiprows=1, ndmin=2)
+    return Candles(*(data[:, i] for i in range(6)))
+
+
+def load_history(directory, market):
+    # Reads a candle archive directory (zero-copy memory maps) or loose
+    # MARKET_TIMEFRAME.npy/.csv files
+    history = {}
+    archive = CandleArchive(directory)
+    for timeframe in TIMEFRAMES:
+        if archive.exists(market, timeframe):
+            history[timeframe] = archive.read(market, timeframe)
+            continue
+        for extension in ('.npy', '.csv'):
+            path = os.path.join(directory, f"{market}_{timeframe}{extension}")
+            if os.path.exists(path):
+                history[timeframe] = load_candles(path)
+                break
+    if '3min' not in history:
+        raise FileNotFoundError(f"No 3min history for {market} in {directory}")
+    for timeframe in TIMEFRAMES[1:]:
+        if timeframe not in history:
+            history[timeframe] = resample(history['3min'],
+                                          TIMEFRAME_SECONDS[timeframe])
+    return history
+
+
+def save_history(directory, market, history):
+    os.makedirs(directory, exist_ok=True)
+    for timeframe, candles in history.items():
+        np.save(os.path.join(directory, f"{market}_{timeframe}.npy"),
+                candles.to_records())
+
+
+def synthetic_history(market, days, seed=0):
+    m3 = synthetic_candles(days * 480, seed)
+    return {
+        '3min': m3,
+        '15min': resample(m3, TIMEFRAME_SECONDS['15min']),
+        '1hour': resample(m3, TIMEFRAME_SECONDS['1hour'])
+    }
+
+
+# ================== Replay ==================
+
+
+class PivotFeed:
+    # Swing state of one timeframe, fed with the pivots found over the whole
+    # history in one vectorized pass; a pivot is released only once the
+    # `width` candles after it have closed, so nothing is seen early
+
+    __slots__ = ('events', 'position', 'swings', 'version')
+
+    def __init__(self, candles, timeframe, width):
+        step = TIMEFRAME_SECONDS[timeframe]
+        high_idx, low_idx = find_pivots(candles.high, candles.low, 0, width)
+        order = np.concatenate((high_idx * 2, low_idx * 2 + 1))
+        order.sort()
+        index = order // 2
+        is_low = (order % 2).astype(bool)
+        confirm = candles.time[index + width] + step
+        price = np.where(is_low, candles.low[index], candles.high[index])
+        self.events = list(
+            zip(confirm.tolist(), is_low.tolist(),
+                candles.time[index].tolist(), price.tolist()))
+        self.position = 0
+        self.swings = new_swings(bot_code.MAX_SWINGS)
+        self.version = 0
+
+    def advance(self, now):
+        events = self.events
+        while (self.position < len(events)
+               and events[self.position][0] <= now):
+            _, is_low, pivot_time, price = events[self.position]
+            if apply_pivot(self.swings, is_low, pivot_time, price):
+                self.version += 1
+            self.position += 1
+
+
+def indicator_at(values, index):
+    # Like bot_code.indicator_value: None before the first value
+    if values is None or index < 0:
+        return None
+    value = values[index]
+    return None if value != value else value
+
+
+def replay_market(market, history, params=None):
+    # Runs the live pipeline at every M3 candle close using only candles
+    # that had closed by then. Stage results are reused until the swings of
+    # their timeframe change. `params` overrides bot_code.STRATEGY entries;
+    # only the REPLAY_PARAMS ones apply.
+    # Indicators are computed once over the whole history, and only for the
+    # filters that are on
+    params = dict(bot_code.STRATEGY, **(params or {}))
+    cooldown = params['signal_cooldown']
+    min_volume_z = params['min_volume_z']
+    min_channel_atr = params['min_channel_atr']
+    m3 = history['3min']
+    m15 = history['15min']
+    step = TIMEFRAME_SECONDS['3min']
+    step_m15 = TIMEFRAME_SECONDS['15min']
+    feeds = {
+        tf: PivotFeed(history[tf], tf, params['swing_width'])
+        for tf in TIMEFRAMES
+    }
+    feed_m15, feed_m3, feed_h1 = feeds['15min'], feeds['3min'], feeds['1hour']
+    times = m3.time.tolist()
+    closes = m3.close.tolist()
+    volume_z = atr_m3 = None
+    if min_volume_z:
+        volume_z = volume_zscore(m15.volume).tolist()
+        times_m15 = m15.time
+    if min_channel_atr:
+        atr_m3 = atr(m3.high, m3.low, m3.close).tolist()
+    index_m15 = -1
+    signals = []
+    last_signal = float('-inf')
+    version_m15 = version_m3 = version_h1 = -1
+    trend_m15 = trend_m3 = None
+    channel_m3 = None
+    range_is_strong = False
+    trend_h1 = 'sideway'
+
+    for j in range(1, len(times)):
+        now = times[j] + step
+        for feed in (feed_m15, feed_m3, feed_h1):
+            feed.advance(now)
+
+        # The volume filter reads the last closed M15 candle, so momentum is
+        # also judged again on every M15 close
+        new_m15 = feed_m15.version != version_m15
+        new_close_m15 = False
+        if volume_z is not None:
+            closed = int(
+                np.searchsorted(times_m15, now - step_m15, side='right')) - 1
+            new_close_m15 = closed != index_m15
+            index_m15 = closed
+        if new_m15:
+            version_m15 = feed_m15.version
+            trend_m15, _, _ = bot_code.detect_trend_and_channel(
+                market, '15min', feed_m15.swings)
+        if new_m15 or new_close_m15:
+            range_is_strong = False
+            if trend_m15 in ('up trend', 'down trend'):
+                range_is_strong, _ = bot_code.calculate_range_momentum(
+                    market, '15min', feed_m15.swings,
+                    indicator_at(volume_z, index_m15), min_volume_z)
+        if trend_m15 not in ('up trend', 'down trend') or not range_is_strong:
+            continue
+
+        if feed_m3.version != version_m3:
+            version_m3 = feed_m3.version
+            trend_m3, channel_m3, _ = bot_code.detect_trend_and_channel(
+                market, '3min', feed_m3.swings)
+        if not trend_m3:
+            continue
+
+        klines = [{
+            'time': times[j - 1],
+            'close': closes[j - 1]
+        }, {
+            'time': times[j],
+            'close': closes[j]
+        }]
+        if bot_code.check_channel_breakout(market, '3min', klines,
+                                           channel_m3, 3):
+            continue
+        hpta_result = bot_code.check_hpta(market, trend_m15, trend_m3)
+        if not hpta_result:
+            continue
+
+        price = closes[j]
+        algo4_pass, zone, new_swing = bot_code.algo4_check(
+            trend_m3, channel_m3, price, feed_m3.swings,
+            indicator_at(atr_m3, j), min_channel_atr)
+        if not algo4_pass:
+            continue
+        if new_swing and hpta_result and new_m15:
+            range_is_strong, _ = bot_code.calculate_range_momentum(
+                market, '15min', feed_m15.swings,
+                indicator_at(volume_z, index_m15), min_volume_z)
+            if not range_is_strong:
+                continue
+
+        if feed_h1.version != version_h1:
+            version_h1 = feed_h1.version
+            trend_h1, _, _ = bot_code.detect_trend_and_channel(
+                market, '1hour', feed_h1.swings)
+            trend_h1 = trend_h1 or 'sideway'
+
+        if trend_m3 == 'up trend':
+            signal = 'Long'
+            risk = 'Very Low' if trend_h1 == 'up trend' else 'Low' if trend_h1 == 'sideway' else 'Medium'
+        else:
+            signal = 'Short'
+            risk = 'Very Low' if trend_h1 == 'down trend' else 'Low' if trend_h1 == 'sideway' else 'Medium'
+
+        if now - last_signal < cooldown:
+            continue
+        last_signal = now
+        diameter = abs(channel_m3['resistance'][1]['price'] -
+                       channel_m3['support'][1]['price'])
+        stop_loss = bot_code.calculate_stop_loss(
+            trend_m3, channel_m3, diameter, params['stop_offset_divisor'])
+        targets = bot_code.calculate_profit_targets(price, trend_m3,
+                                                    diameter, channel_m3)
+        signals.append({
+            'market': market,
+            'index': j,
+            'time': now,
+            'signal': signal,
+            'risk': risk,
+            'zone': zone,
+            'entry': price,
+            'stop': stop_loss,
+            'target1': targets[0],
+            'target2': targets[1],
+            'target3': targets[2]
+        })
+    return signals
+
+
+# ================== Outcomes ==================
+
+
+def first_hit(highs, lows, entry, level):
+    # Index of the first candle that reaches `level` coming from `entry`
+    mask = highs >= level if level >= entry else lows <= level
+    index = int(np.argmax(mask)) if len(mask) else 0
+    return index if len(mask) and mask[index] else None
+
+
+def evaluate_outcomes(signals, m3, horizon=OUTCOME_HORIZON):
+    # A target counts only if it is reached before the stop; a candle that
+    # reaches both is counted as a stop
+    for signal in signals:
+        start = signal['index'] + 1
+        highs = m3.high[start:start + horizon]
+        lows = m3.low[start:start + horizon]
+        stop_at = first_hit(highs, lows, signal['entry'], signal['stop'])
+        signal['stop_hit'] = stop_at is not None
+        for name in OUTCOMES[1:]:
+            hit_at = first_hit(highs, lows, signal['entry'], signal[name])
+            signal[f'{name}_hit'] = (hit_at is not None
+                                     and (stop_at is None or hit_at < stop_at))
+    return signals
+
+
+def summarize(signals):
+    summary = {'signals': len(signals)}
+    for name in OUTCOMES:
+        hits = sum(1 for s in signals if s[f'{name}_hit'])
+        summary[f'{name}_hits'] = hits
+        summary[f'{name}_rate'] = hits / len(signals) if signals else 0.0
+    return summary
+
+
+def run_market(market, data=None, synthetic_days=None, seed=0,
+               horizon=OUTCOME_HORIZON):
+    if synthetic_days:
+        history = synthetic_history(market, synthetic_days, seed)
+    else:
+        history = load_history(data, market)
+    signals = replay_market(market, history)
+    evaluate_outcomes(signals, history['3min'], horizon)
+    return market, len(history['3min']), signals
+
+
+# ================== Main ==================
+
+
+def print_report(results):
+    header = f"{'market':<12} {'candles':>9} {'signals':>8}" + ''.join(
+        f" {name:>8}" for name in OUTCOMES)
+    print(header)
+    all_signals = []
+    for market, candles, signals in results:
+        summary = summarize(signals)
+        all_signals.extend(signals)
+        print(f"{market:<12} {candles:>9} {summary['signals']:>8}" + ''.join(
+            f" {summary[f'{name}_rate']:>8.1%}" for name in OUTCOMES))
+    summary = summarize(all_signals)
+    print(f"{'total':<12} {sum(r[1] for r in results):>9} "
+          f"{summary['signals']:>8}" + ''.join(
+              f" {summary[f'{name}_rate']:>8.1%}" for name in OUTCOMES))
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline signal backtest")
+    parser.add_argument('--data',
+                        help="candle archive or directory with "
+                        "MARKET_TIMEFRAME.npy/.csv files")
+    parser.add_argument('--markets',
+                        default=','.join(bot_code.REQUESTED_MARKETS),
+                        help="comma separated markets, or a count with "
+                        "--synthetic-days")
+    parser.add_argument('--synthetic-days', type=int)
+    parser.add_argument('--horizon', type=int, default=OUTCOME_HORIZON)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--output', help="write all signals to this JSON file")
+    args = parser.parse_args(argv)
+
+    if args.synthetic_days and args.markets.isdigit():
+        markets = [f"SYN{i}USDT" for i in range(int(args.markets))]
+    else:
+        markets = [m for m in args.markets.split(',') if m]
+    if not args.synthetic_days and not args.data:
+        parser.error("--data or --synthetic-days is required")
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [
+            executor.submit(run_market, market, args.data,
+                            args.synthetic_days, seed, args.horizon)
+            for seed, market in enumerate(markets)
+        ]
+        results = [future.result() for future in futures]
+    print_report(results)
+    print(f"Replayed {len(markets)} markets in "
+          f"{time.perf_counter() - start:.1f} seconds")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump([s for r in results for s in r[2]], f)
+
+
+if __name__ == "__main__":
+    main()
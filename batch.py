@@ -0,0 +1,283 @@
+import numpy as np
+
+from swings import apply_pivot
+
+# Analysis of many markets at once. The candles of one timeframe are stacked
+# into 2-D arrays (markets x candles) and the swing, trend, momentum and
+# breakout rules of bot_code run as one NumPy operation over every market,
+# with the same results as the per-market functions:
+#
+#   find_pivots_2d    swings.find_pivots, one row per market
+#   new_pivots        the pivots swings.merge_pivots (detect_swings) adds
+#   classify_trends   detect_trend_and_channel
+#   range_momentum    calculate_range_momentum
+#   channel_breakouts check_channel_breakout
+#
+# Rows are right-aligned: a market with fewer candles is padded on the left
+# with NaN, which never compares true and so never makes a pivot.
+#
+# A SwingBook keeps what these rules need and found for every market of one
+# timeframe in arrays as well, so a cycle only recomputes the rows whose last
+# closed candle changed. The cost of a cycle still grows linearly with the
+# number of markets, as the candles of each have to be read, but per market
+# that is a few array slices; benchmark.py batch measures it.
+
+# ================== Settings ==================
+# Trend codes of classify_trends
+TRENDS = {1: 'up trend', -1: 'down trend', 0: 'sideway'}
+# Columns of the swing point arrays: the two latest highs, then the two
+# latest lows, oldest first (the resistance and support of the channel)
+PREV_HIGH, LAST_HIGH, PREV_LOW, LAST_LOW = range(4)
+
+# ================== Stacking ==================
+
+
+def stack(columns, length, fill=np.nan, dtype=np.float64):
+    # 1-D arrays -> (len(columns), length) array of their last `length`
+    # values, right-aligned and left-padded with `fill`
+    if all(len(values) >= length for values in columns):
+        return np.array([values[len(values) - length:] for values in columns],
+                        dtype=dtype).reshape(len(columns), length)
+    out = np.full((len(columns), length), fill, dtype=dtype)
+    for row, values in enumerate(columns):
+        values = values[-length:]
+        if len(values):
+            out[row, length - len(values):] = values
+    return out
+
+
+def last_closed(candles, step, now, forming=2):
+    # Time of the last closed candle of each market (its key), how many
+    # closed candles it has and how many still open ones follow them. Up to
+    # `forming` open candles are looked for; a market with more has -1
+    # closed candles
+    time = stack([c.time for c in candles], forming + 1, 0, np.int64)
+    # Padding has time 0, so it never counts as open
+    open_count = (time + step > now).sum(axis=1)
+    closed = np.fromiter(map(len, candles), dtype=np.int64,
+                         count=len(candles)) - open_count
+    closed[open_count > forming] = -1
+    open_count = np.minimum(open_count, forming)
+    keys = time[np.arange(len(candles)), forming - open_count]
+    return keys, closed, open_count
+
+
+def stack_closed(candles, length, open_count, forming=2):
+    # (time, high, low, close) arrays of the last `length` closed candles of
+    # each market, given their open candles from last_closed
+    width = length + forming
+    columns = (forming - open_count)[:, None] + np.arange(length)
+    stacked = [stack([c.time for c in candles], width, 0, np.int64)]
+    stacked += [
+        stack([getattr(c, field) for c in candles], width)
+        for field in ('high', 'low', 'close')
+    ]
+    return tuple(
+        np.take_along_axis(values, columns, axis=1) for values in stacked)
+
+
+# ================== Swings ==================
+
+
+def find_pivots_2d(high, low, width=2):
+    # Boolean (markets x candles) masks of the candles whose high (low) is
+    # strictly above (below) the `width` candles on each side
+    is_high = np.zeros(high.shape, dtype=bool)
+    is_low = np.zeros(low.shape, dtype=bool)
+    last = high.shape[1] - width
+    if last <= width:
+        return is_high, is_low
+    center_high = high[:, width:last]
+    center_low = low[:, width:last]
+    highs = np.ones(center_high.shape, dtype=bool)
+    lows = np.ones(center_low.shape, dtype=bool)
+    for k in range(1, width + 1):
+        highs &= center_high > high[:, width - k:last - k]
+        highs &= center_high > high[:, width + k:last + k]
+        lows &= center_low < low[:, width - k:last - k]
+        lows &= center_low < low[:, width + k:last + k]
+    is_high[:, width:last] = highs
+    is_low[:, width:last] = lows
+    return is_high, is_low
+
+
+def _last_times(series):
+    # Time of the newest pivot of every SwingSeries, -1 for empty ones
+    return np.array([s.times[-1] if s else -1 for s in series],
+                    dtype=np.int64)
+
+
+def new_pivots(times, high, low, is_high, is_low, last_high, last_low):
+    # The pivots of each row that swings.merge_pivots would add: pivots not
+    # newer than the row's last high (low) pivot are dropped for all rows in
+    # one step. Returns (rows, is_low, times, prices) in the order they are
+    # applied, by candle and a high before a low on the same candle
+    is_high = is_high & (times > last_high[:, None])
+    is_low = is_low & (times > last_low[:, None])
+    high_cells = np.flatnonzero(is_high)
+    low_cells = np.flatnonzero(is_low)
+    order = np.concatenate((high_cells * 2, low_cells * 2 + 1))
+    order.sort()
+    cells, kinds = np.divmod(order, 2)
+    prices = np.where(kinds, low.ravel()[cells], high.ravel()[cells])
+    return cells // times.shape[1], kinds, times.ravel()[cells], prices
+
+
+def apply_pivots(swings, rows, kinds, times, prices):
+    # apply_pivot for the pivots of new_pivots; `swings` maps their rows to
+    # the swings dict to add them to. Returns the rows that got a new swing
+    changed = set()
+    for row, is_low, pivot_time, price in zip(rows.tolist(), kinds.tolist(),
+                                              times.tolist(),
+                                              prices.tolist()):
+        if apply_pivot(swings[row], is_low, pivot_time, price):
+            changed.add(row)
+    return changed
+
+
+# ================== Trend, Momentum, Breakout ==================
+
+
+def swing_points(swings):
+    # (prices, times) arrays of markets x PREV_HIGH..LAST_LOW, and whether
+    # each market has the two highs and two lows to fill its row
+    prices = np.full((len(swings), 4), np.nan)
+    times = np.zeros((len(swings), 4), dtype=np.int64)
+    valid = np.zeros(len(swings), dtype=bool)
+    for row, s in enumerate(swings):
+        highs, lows = s['highs'], s['lows']
+        if len(highs) >= 2 and len(lows) >= 2:
+            prices[row] = (highs.prices[-2], highs.prices[-1],
+                           lows.prices[-2], lows.prices[-1])
+            times[row] = (highs.times[-2], highs.times[-1], lows.times[-2],
+                          lows.times[-1])
+            valid[row] = True
+    return prices, times, valid
+
+
+def classify_trends(prices):
+    # 1 for higher highs and higher lows, -1 for lower ones, 0 otherwise
+    up = ((prices[:, LAST_LOW] > prices[:, PREV_LOW])
+          & (prices[:, LAST_HIGH] > prices[:, PREV_HIGH]))
+    down = ((prices[:, LAST_LOW] < prices[:, PREV_LOW])
+            & (prices[:, LAST_HIGH] < prices[:, PREV_HIGH]))
+    return np.where(up, 1, np.where(down, -1, 0))
+
+
+def range_momentum(prices):
+    # Whether the last high-low range is at least the one before
+    previous = np.abs(prices[:, PREV_HIGH] - prices[:, PREV_LOW])
+    last = np.abs(prices[:, LAST_HIGH] - prices[:, LAST_LOW])
+    return last >= previous
+
+
+def _slopes(prices, times, first, second, timeframe_minutes):
+    # calculate_slope between two columns, 0 for points on the same candle
+    delta_price = prices[:, second] - prices[:, first]
+    delta_time = (times[:, second] - times[:, first]) / (60 *
+                                                         timeframe_minutes)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(delta_time != 0, delta_price / delta_time, 0.0)
+
+
+def channel_breakouts(prices, times, last_time, last_close, prev_close,
+                      timeframe_minutes):
+    # Whether the last close crossed the channel lines, projected to the
+    # last candle, while the close before did not
+    support_slope = _slopes(prices, times, PREV_LOW, LAST_LOW,
+                            timeframe_minutes)
+    resistance_slope = _slopes(prices, times, PREV_HIGH, LAST_HIGH,
+                               timeframe_minutes)
+    time_diff = (last_time - times[:, LAST_LOW]) / (60 * timeframe_minutes)
+    support = prices[:, LAST_LOW] + support_slope * time_diff
+    resistance = prices[:, LAST_HIGH] + resistance_slope * time_diff
+    return (((last_close > resistance) & (prev_close <= resistance))
+            | ((last_close < support) & (prev_close >= support)))
+
+
+# ================== Swing Book ==================
+
+# Swings of a market without any yet, for SwingBook.load
+NO_SWINGS = {'highs': (), 'lows': ()}
+# SwingBook.series of a new row, never the swings of a market
+UNLOADED = object()
+
+
+class SwingBook:
+    # Batch-mode results of one timeframe, a row per market. `keys` is the
+    # time of the last closed candle a row was analyzed for, -1 for none;
+    # the other columns hold the newest high and low pivot times, the
+    # swing_points of the market and the trend, momentum and breakout found
+    # for that key, with the last two closes they were judged on. `series`
+    # holds the swings dict of the market's state a row was built from, so
+    # a row whose state was replaced elsewhere (scan_market, restore_state)
+    # can be rebuilt
+
+    # name: (fill, dtype, columns)
+    COLUMNS = {
+        'keys': (-1, np.int64, None),
+        'last_high': (-1, np.int64, None),
+        'last_low': (-1, np.int64, None),
+        'prices': (np.nan, np.float64, 4),
+        'times': (0, np.int64, 4),
+        'valid': (False, bool, None),
+        'trend': (0, np.int8, None),
+        'strong': (False, bool, None),
+        'volume_z': (np.nan, np.float64, None),
+        'breakout': (False, bool, None),
+        'last_close': (np.nan, np.float64, None),
+        'prev_close': (np.nan, np.float64, None),
+    }
+
+    def __init__(self, capacity=64):
+        self.rows = {}
+        self.markets = []
+        self.series = []
+        self.capacity = 0
+        self._grow(capacity)
+
+    def __len__(self):
+        return len(self.markets)
+
+    def _grow(self, capacity):
+        for name, (fill, dtype, columns) in self.COLUMNS.items():
+            shape = (capacity, ) if columns is None else (capacity, columns)
+            values = np.full(shape, fill, dtype=dtype)
+            if self.capacity:
+                values[:self.capacity] = getattr(self, name)
+            setattr(self, name, values)
+        self.capacity = capacity
+
+    def index(self, markets):
+        # Rows of `markets`, adding a row for each market not seen before
+        rows = self.rows
+        for market in markets:
+            if market not in rows:
+                if len(self.markets) == self.capacity:
+                    self._grow(2 * self.capacity)
+                rows[market] = len(self.markets)
+                self.markets.append(market)
+                self.series.append(UNLOADED)
+        return np.fromiter(map(rows.__getitem__, markets),
+                           dtype=np.intp,
+                           count=len(markets))
+
+    def load(self, rows, swings):
+        # Rebuilds `rows` from the swings dicts (None for none) of their
+        # markets; their results are recomputed by the next pass
+        filled = [market_swings or NO_SWINGS for market_swings in swings]
+        self.prices[rows], self.times[rows], self.valid[rows] = swing_points(
+            filled)
+        self.last_high[rows] = _last_times([s['highs'] for s in filled])
+        self.last_low[rows] = _last_times([s['lows'] for s in filled])
+        self.keys[rows] = -1
+        for row, market_swings in zip(rows.tolist(), swings):
+            self.series[row] = market_swings
+
+    def channel(self, row):
+        # The channel of detect_trend_and_channel for a valid row
+        swings = self.series[row]
+        return {
+            'support': (swings['lows'][-2], swings['lows'][-1]),
+            'resistance': (swings['highs'][-2], swings['highs'][-1])
+        }
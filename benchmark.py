@@ -0,0 +1,712 @@
+import argparse
+import contextlib
+import copy
+import io
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import requests
+
+import bot_code
+import indicators
+import logs
+import metrics
+from candle_store import TIMEFRAME_SECONDS
+from candles import synthetic_candles
+from pipeline import StageCache, closed_klines
+from fake_servers import (FakeCoinexServer, FakeTelegramServer,
+                          aggregate_rows, generate_rows)
+
+# python benchmark.py swings --sizes 200,10000,1000000
+# python benchmark.py indicators --sizes 200,10000,1000000
+# python benchmark.py analysis [--fixtures fixtures/]
+# python benchmark.py batch --sizes 10,100,1000
+# python benchmark.py cycle --sizes 10,100,1000 [--mode concurrent]
+# python benchmark.py startup [--repeat 3]
+# python benchmark.py record --markets BTCUSDT,ETHUSDT --fixtures fixtures/
+#
+# tests/test_swings.py checks the columnar swing detector against the dict
+# loop and tests/test_indicators.py the indicators against the pandas
+# reference in tests/pandas_reference.py; the swings and indicators suites
+# only time them.
+#
+# analysis and cycle compare their results with BASELINE_FILE (committed,
+# one entry per suite and scan mode) and exit with status 1 on a regression
+# or a missing baseline; --save-baseline stores them instead. Latencies and
+# throughputs are compared in units of a calibration loop timed in the same
+# process, so the baseline holds on machines slower or faster than the one
+# it was saved on.
+# startup exits with status 1 when main.py's web port takes longer than
+# STARTUP_PORT_BUDGET to answer
+
+# ================== Settings ==================
+# The per-candle dict loop is only timed up to this many candles
+REFERENCE_MAX_CANDLES = 1000000
+FIXTURE_TIMEFRAMES = ('15min', '3min', '1hour')
+# Synthetic fixtures are this many random walks of FIXTURE_CANDLES M3
+# candles (200 H1 candles), shared round-robin by the benchmark markets
+FIXTURE_SERIES = 20
+FIXTURE_CANDLES = 4000
+KLINE_LIMIT = 200
+# Each analysis function is called for about this many seconds
+MEASURE_SECONDS = 1.0
+CYCLE_SIZES = [10, 100, 1000]
+BATCH_SIZES = [10, 100, 1000, 5000]
+BASELINE_FILE = 'benchmark_baseline.json'
+# Slower p50 latency or lower throughput than the baseline by more than
+# this fraction is a regression
+REGRESSION_TOLERANCE = 0.25
+# Iterations of the calibration loop, and best of how many runs of it
+CALIBRATION_SIZE = 200000
+CALIBRATION_REPEAT = 20
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+# Seconds main.py may take to answer on its web port, and to become ready
+STARTUP_PORT_BUDGET = 1.0
+STARTUP_TIMEOUT = 60
+STARTUP_POLL = 0.01
+
+# ================== Helpers ==================
+
+
+def best_of(repeat, func, *args):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def latency_stats(latencies, peak_mb):
+    return {
+        'calls': len(latencies),
+        'throughput': len(latencies) / sum(latencies),
+        'p50': float(np.percentile(latencies, 50)),
+        'p99': float(np.percentile(latencies, 99)),
+        'peak_mb': peak_mb
+    }
+
+
+def measure(func, inputs, seconds=MEASURE_SECONDS):
+    # Calls func(*args) for every args of `inputs` in turn for about
+    # `seconds`; the peak memory is traced over one extra pass
+    latencies = []
+    started = time.perf_counter()
+    while not latencies or time.perf_counter() - started < seconds:
+        for args in inputs:
+            start = time.perf_counter()
+            func(*args)
+            latencies.append(time.perf_counter() - start)
+    tracemalloc.start()
+    for args in inputs:
+        func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return latency_stats(latencies, peak / 2**20)
+
+
+def peak_rss_mb():
+    # Peak resident memory of this process, None where it cannot be read
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def format_mb(value):
+    return f"{value:.2f}" if value is not None else '-'
+
+
+# ================== Fixtures ==================
+
+
+def synthetic_fixtures(count=FIXTURE_SERIES, end_time=None):
+    # {name: {timeframe: CoinEx kline rows}}; M15 and H1 are aggregated
+    # from the M3 rows like on the exchange
+    end_time = int(time.time()) if end_time is None else end_time
+    fixtures = {}
+    for i in range(count):
+        rows = generate_rows(f'SERIES{i}', FIXTURE_CANDLES, end_time,
+                             TIMEFRAME_SECONDS['3min'])
+        fixtures[f'SERIES{i}'] = {
+            timeframe: (rows if timeframe == '3min' else aggregate_rows(
+                rows, TIMEFRAME_SECONDS[timeframe]))
+            for timeframe in FIXTURE_TIMEFRAMES
+        }
+    return fixtures
+
+
+def record_fixtures(markets, directory, limit=KLINE_LIMIT):
+    # Saves the /market/kline responses the bot asks for, as they came, to
+    # MARKET_TIMEFRAME.json
+    os.makedirs(directory, exist_ok=True)
+    for market in markets:
+        for timeframe in FIXTURE_TIMEFRAMES:
+            url = (f"{bot_code.COINEX_BASE_URL}/perpetual/v1/market/kline"
+                   f"?market={market}&type={timeframe}&limit={limit}")
+            response = bot_code.api_client.get(url)
+            response.raise_for_status()
+            path = os.path.join(directory, f"{market}_{timeframe}.json")
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(response.text)
+            print(f"Recorded {path}")
+
+
+def load_fixtures(directory, now=None):
+    # Recorded responses in the format of synthetic_fixtures, moved forward
+    # by whole hours so their newest candles are the current ones
+    now = time.time() if now is None else now
+    fixtures = {}
+    for name in sorted(os.listdir(directory)):
+        market, _, timeframe = name[:-len('.json')].rpartition('_')
+        if not name.endswith('.json') or timeframe not in FIXTURE_TIMEFRAMES:
+            continue
+        with open(os.path.join(directory, name), encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('code') != 0 or not data.get('data'):
+            raise ValueError(f"{name} is not a kline response")
+        fixtures.setdefault(market, {})[timeframe] = data['data']
+    if not fixtures:
+        raise ValueError(f"No kline fixtures in {directory}")
+    step = TIMEFRAME_SECONDS['1hour']
+    for market, timeframes in fixtures.items():
+        missing = set(FIXTURE_TIMEFRAMES) - set(timeframes)
+        if missing:
+            raise ValueError(f"Fixtures of {market} lack {sorted(missing)}")
+        shift = int(now - timeframes['3min'][-1][0]) // step * step
+        for timeframe, rows in timeframes.items():
+            timeframes[timeframe] = [[row[0] + shift] + row[1:]
+                                     for row in rows]
+    return fixtures
+
+
+def bench_markets(count):
+    return [f"BENCH{i:04d}USDT" for i in range(count)]
+
+
+# ================== Swing Detection ==================
+
+
+def bench_swings(sizes, repeat=3):
+    print(f"{'candles':>10} {'dict loop (s)':>14} {'columnar (s)':>13} "
+          f"{'speedup':>8}")
+    for size in sizes:
+        candles = synthetic_candles(size)
+        klines = candles.to_klines()
+        columnar, _ = best_of(repeat, bot_code.detect_swings, 'BENCH',
+                              '3min', candles, None, size)
+        reference = None
+        if size <= REFERENCE_MAX_CANDLES:
+            reference, _ = best_of(repeat, bot_code.detect_swings, 'BENCH',
+                                   '3min', klines, None, size)
+        if reference is None:
+            print(f"{size:>10} {'skipped':>14} {columnar:>13.6f} {'-':>8}")
+        else:
+            print(f"{size:>10} {reference:>14.6f} {columnar:>13.6f} "
+                  f"{reference / columnar:>7.1f}x")
+
+
+# ================== Indicators ==================
+
+
+def bench_indicators(sizes, repeat=3):
+    from tests.pandas_reference import pandas_indicators
+
+    print(f"{'candles':>10} {'pandas (s)':>11} {'batch (s)':>10} "
+          f"{'per candle (us)':>16}")
+    for size in sizes:
+        candles = synthetic_candles(size)
+        reference, _ = best_of(repeat, pandas_indicators, candles)
+        batch, _ = best_of(repeat, indicators.compute, candles)
+        klines = candles.to_klines()[:min(size, 100000)]
+
+        def feed():
+            indicator_set = indicators.IndicatorSet()
+            for candle in klines:
+                indicator_set.update(candle)
+
+        incremental, _ = best_of(repeat, feed)
+        print(f"{size:>10} {reference:>11.6f} {batch:>10.6f} "
+              f"{incremental / len(klines) * 1e6:>16.2f}")
+
+
+# ================== Analysis ==================
+
+
+def parse_response(body):
+    # What get_klines does with a kline response
+    return bot_code.parse_klines(json.loads(body)['data'])
+
+
+def analysis_inputs(fixtures, market='BENCH', timeframe='3min'):
+    # Arguments of every benchmarked function, one set per fixture series
+    inputs = {
+        'parse_klines': [],
+        'detect_swings': [],
+        'detect_trend_and_channel': [],
+        'check_channel_breakout': []
+    }
+    for timeframes in fixtures.values():
+        rows = timeframes[timeframe][-KLINE_LIMIT:]
+        body = json.dumps({'code': 0, 'data': rows}).encode('utf-8')
+        klines = bot_code.parse_klines(rows)
+        swings, _ = bot_code.detect_swings(market, timeframe, klines, None)
+        _, channel, _ = bot_code.detect_trend_and_channel(
+            market, timeframe, swings)
+        inputs['parse_klines'].append((body, ))
+        inputs['detect_swings'].append((market, timeframe, klines, None))
+        inputs['detect_trend_and_channel'].append((market, timeframe, swings))
+        inputs['check_channel_breakout'].append(
+            (market, timeframe, klines, channel, 3))
+    return inputs
+
+
+def bench_analysis(fixtures):
+    functions = {
+        'parse_klines': parse_response,
+        'detect_swings': bot_code.detect_swings,
+        'detect_trend_and_channel': bot_code.detect_trend_and_channel,
+        'check_channel_breakout': bot_code.check_channel_breakout
+    }
+    inputs = analysis_inputs(fixtures)
+    print(f"{'function':<26} {'calls/s':>10} {'p50 (ms)':>9} "
+          f"{'p99 (ms)':>9} {'peak (MB)':>10}")
+    results = {}
+    for name, func in functions.items():
+        stats = results[name] = measure(func, inputs[name])
+        print(f"{name:<26} {stats['throughput']:>10.0f} "
+              f"{stats['p50'] * 1000:>9.3f} {stats['p99'] * 1000:>9.3f} "
+              f"{format_mb(stats['peak_mb']):>10}")
+    return results
+
+
+# ================== Batch Analysis ==================
+
+
+def batch_inputs(fixtures, count, timeframe='15min'):
+    # Candles of `count` markets (the fixture series round-robin) and swing
+    # state from the candles up to one candle earlier, as a cycle right
+    # after a close sees them
+    series = list(fixtures)
+    klines, state = {}, {}
+    for i, market in enumerate(bench_markets(count)):
+        rows = fixtures[series[i % len(series)]][timeframe]
+        klines[market] = bot_code.parse_klines(rows[-KLINE_LIMIT:])
+        swings, _ = bot_code.detect_swings(
+            market, timeframe, bot_code.parse_klines(rows[-KLINE_LIMIT -
+                                                          1:-1]), None)
+        state[market] = {'swings_m15': swings}
+    now = max(int(k.time[-1]) for k in klines.values())
+    return klines, state, now + TIMEFRAME_SECONDS[timeframe]
+
+
+def analyze_per_market(klines, state, now):
+    # Swing, trend, momentum and breakout stages, one market at a time
+    results = {}
+    for market, candles in klines.items():
+        closed = closed_klines(candles, '15min', now)
+        swings, _ = bot_code.detect_swings(market, '15min', closed,
+                                           state[market]['swings_m15'])
+        trend, channel, _ = bot_code.detect_trend_and_channel(
+            market, '15min', swings)
+        strong = breakout = None
+        if trend in ['up trend', 'down trend']:
+            strong, _ = bot_code.calculate_range_momentum(
+                market, '15min', swings)
+        if trend:
+            breakout = bot_code.check_channel_breakout(
+                market, '15min', closed, channel, 3)
+        results[market] = (trend, strong, breakout)
+    return results
+
+
+def analyze_together(klines, state, now):
+    # The same stages for all markets at once, through the batch mode
+    markets, rows, stale, _ = bot_code.batch_swings(list(klines), '15min',
+                                                    klines, state, now)
+    book = bot_code.batch_book('15min')
+    stale_markets = [m for m, s in zip(markets, stale) if s]
+    bot_code.batch_trends(book, stale_markets, rows[stale], '15min')
+    trending = book.valid[rows] & (book.trend[rows] != 0)
+    todo = trending & stale
+    bot_code.batch_momentum(book, [m for m, t in zip(markets, todo) if t],
+                            rows[todo], klines, now)
+    bot_code.batch_breakouts(book, rows[stale], 3)
+    return book_results(book, markets, rows)
+
+
+def book_results(book, markets, rows):
+    # analyze_per_market's results, read from the batch book
+    from batch import TRENDS
+
+    results = {}
+    for market, row in zip(markets, rows.tolist()):
+        trend = TRENDS[int(book.trend[row])] if book.valid[row] else None
+        results[market] = (trend, bool(book.strong[row]) if trend
+                           in ['up trend', 'down trend'] else None,
+                           bool(book.breakout[row]) if trend else None)
+    return results
+
+
+def bench_batch(sizes, fixtures, repeat=3):
+    # Per-cycle CPU of the analysis stages by market count, per market and
+    # batched; both must leave the same swings and results. The batch book
+    # is first filled by a cycle one candle earlier, as the previous cycle
+    # leaves it. 'unchanged' is the batch pass of a cycle in which no
+    # candle closed
+    print(f"{'markets':>8} {'per market (ms)':>16} {'batch (ms)':>11} "
+          f"{'speedup':>8} {'batch/market (us)':>18} "
+          f"{'unchanged (ms)':>15}")
+    for size in sizes:
+        klines, state, now = batch_inputs(fixtures, size)
+        step = TIMEFRAME_SECONDS['15min']
+        previous = {market: candles[:-1] for market, candles in klines.items()}
+        timings = {}
+        outcomes = {}
+        for name, analyze in (('per_market', analyze_per_market),
+                              ('batch', analyze_together)):
+            best = float('inf')
+            for _ in range(repeat):
+                cycle_state = copy.deepcopy(state)
+                bot_code.stage_cache = StageCache()
+                bot_code.batch_books = {}
+                if name == 'batch':
+                    analyze(previous, cycle_state, now - step)
+                start = time.perf_counter()
+                results = analyze(klines, cycle_state, now)
+                best = min(best, time.perf_counter() - start)
+            timings[name] = best
+            outcomes[name] = (results, cycle_state)
+        # A cycle before the next candle closes finds every row current
+        start = time.perf_counter()
+        analyze_together(klines, cycle_state, now)
+        timings['unchanged'] = time.perf_counter() - start
+        if outcomes['batch'] != outcomes['per_market']:
+            raise AssertionError(
+                f"Batch analysis differs from the per-market one for {size} markets")
+        print(f"{size:>8} {timings['per_market'] * 1000:>16.3f} "
+              f"{timings['batch'] * 1000:>11.3f} "
+              f"{timings['per_market'] / timings['batch']:>7.1f}x "
+              f"{timings['batch'] / size * 1e6:>18.2f} "
+              f"{timings['unchanged'] * 1000:>15.3f}")
+
+
+# ================== Full Cycle ==================
+
+
+def run_cycle(count, rest_url, telegram_url, mode):
+    # One main() cycle over `count` markets of the mock API, run in a fresh
+    # process; state, archive and logs go to a temporary directory
+    bot_code.COINEX_BASE_URL = rest_url
+    bot_code.TELEGRAM_BASE_URL = telegram_url
+    bot_code.REQUESTED_MARKETS = bench_markets(count)
+    latencies = []
+    scan_market = bot_code.scan_market
+
+    def timed_scan(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return scan_market(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    bot_code.scan_market = timed_scan
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                bot_code.main(mode, cycles=1)
+            total = time.perf_counter() - started
+        finally:
+            logs.stop_logging()
+            os.chdir(cwd)
+    _, seconds = metrics.cycle_latency.value()
+    stats = latency_stats(latencies, peak_rss_mb())
+    # Batch mode does not call scan_market for the markets it stopped
+    stats.update(throughput=count / seconds,
+                 seconds=seconds,
+                 startup=total - seconds,
+                 requests=sum(endpoint['requests'] for endpoint in
+                              bot_code.api_client.stats().values()))
+    return stats
+
+
+def bench_cycle(sizes, fixtures, mode):
+    markets = bench_markets(max(sizes))
+    series = list(fixtures)
+    server = FakeCoinexServer(markets,
+                              recorded={
+                                  market: fixtures[series[i % len(series)]]
+                                  for i, market in enumerate(markets)
+                              }).start()
+    telegram = FakeTelegramServer(bot_code.TELEGRAM_TOKEN).start()
+    print(f"{'markets':>8} {'cycle (s)':>10} {'startup (s)':>12} "
+          f"{'markets/s':>10} {'p50 (ms)':>9} {'p99 (ms)':>9} "
+          f"{'peak (MB)':>10}")
+    results = {}
+    try:
+        for size in sizes:
+            # A new process per size, so nothing is cached from the last one
+            with ProcessPoolExecutor(
+                    max_workers=1,
+                    mp_context=multiprocessing.get_context(
+                        'spawn')) as executor:
+                stats = executor.submit(run_cycle, size, server.rest_url,
+                                        telegram.url, mode).result()
+            results[str(size)] = stats
+            print(f"{size:>8} {stats['seconds']:>10.3f} "
+                  f"{stats['startup']:>12.3f} {stats['throughput']:>10.1f} "
+                  f"{stats['p50'] * 1000:>9.3f} {stats['p99'] * 1000:>9.3f} "
+                  f"{format_mb(stats['peak_mb']):>10}")
+    finally:
+        server.stop()
+        telegram.stop()
+    return results
+
+
+# ================== Startup ==================
+
+
+def import_seconds(module):
+    # Time to import `module` in a fresh interpreter
+    code = ("import time; start = time.perf_counter(); "
+            f"import {module}; print(time.perf_counter() - start)")
+    result = subprocess.run([sys.executable, '-c', code],
+                            cwd=REPO_DIR,
+                            capture_output=True,
+                            text=True,
+                            check=True)
+    return float(result.stdout)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url, started, timeout=STARTUP_TIMEOUT):
+    # Seconds from `started` until `url` answers 200, None on timeout
+    while time.perf_counter() - started < timeout:
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return time.perf_counter() - started
+        except requests.RequestException:
+            pass
+        time.sleep(STARTUP_POLL)
+    return None
+
+
+def launch_main(rest_url, telegram_url):
+    # Runs main.py against the mock API in a temporary directory; returns
+    # the seconds until its web port answers and until /ready does
+    port = free_port()
+    env = dict(os.environ,
+               PORT=str(port),
+               COINEX_BASE_URL=rest_url,
+               TELEGRAM_BASE_URL=telegram_url)
+    with tempfile.TemporaryDirectory() as directory:
+        started = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(REPO_DIR, 'main.py')],
+            cwd=directory,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL)
+        try:
+            bound = wait_for(f"http://127.0.0.1:{port}/", started)
+            ready = wait_for(f"http://127.0.0.1:{port}/ready", started)
+        finally:
+            process.terminate()
+            process.wait()
+    return bound, ready
+
+
+def fastest(seconds):
+    # Lowest of the times that did not time out, None if all did
+    seconds = [value for value in seconds if value is not None]
+    return min(seconds) if seconds else None
+
+
+def bench_startup(repeat=3):
+    # Best of `repeat` fresh processes for each step
+    server = FakeCoinexServer(bot_code.REQUESTED_MARKETS).start()
+    telegram = FakeTelegramServer(bot_code.TELEGRAM_TOKEN).start()
+    try:
+        launches = [
+            launch_main(server.rest_url, telegram.url) for _ in range(repeat)
+        ]
+    finally:
+        server.stop()
+        telegram.stop()
+    results = {
+        'import flask': min(import_seconds('flask') for _ in range(repeat)),
+        'import bot_code':
+        min(import_seconds('bot_code') for _ in range(repeat)),
+        'web port answers': fastest(bound for bound, _ in launches),
+        'ready': fastest(ready for _, ready in launches)
+    }
+    print(f"{'step':<18} {'seconds':>8}")
+    for name, seconds in results.items():
+        print(f"{name:<18} "
+              f"{'timeout' if seconds is None else f'{seconds:.3f}':>8}")
+    return results
+
+
+# ================== Baseline ==================
+
+
+def calibration_loop(size=CALIBRATION_SIZE):
+    # Fixed mix of interpreter and NumPy work, like the analysis functions
+    total = 0
+    for i in range(size):
+        total += i * i % 7
+    values = np.sin(np.arange(size, dtype=float))
+    return total + float(np.sort(values)[size // 2])
+
+
+def calibrate(repeat=CALIBRATION_REPEAT):
+    # Seconds the calibration loop takes on this machine right now
+    seconds, _ = best_of(repeat, calibration_loop)
+    return seconds
+
+
+def load_baseline(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(suite, results, calibration, path=BASELINE_FILE):
+    baseline = load_baseline(path)
+    baseline[suite] = {'calibration': calibration, 'results': results}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+    print(f"Baseline for {suite} saved to {path}")
+
+
+def compare_baseline(suite,
+                     results,
+                     calibration,
+                     path=BASELINE_FILE,
+                     tolerance=REGRESSION_TOLERANCE):
+    # Prints every result against the stored one, both in units of their
+    # calibration loop; returns the regressions, or None without a stored
+    # baseline
+    baseline = load_baseline(path).get(suite)
+    if not baseline:
+        return None
+    speed = baseline['calibration'] / calibration
+    print(f"Against the baseline in {path} (tolerance {tolerance:.0%}, "
+          f"this machine {speed:.2f}x as fast):")
+    regressions = []
+    for name, stats in results.items():
+        base = baseline['results'].get(name)
+        if not base:
+            continue
+        latency = stats['p50'] * speed / base['p50']
+        throughput = stats['throughput'] / speed / base['throughput']
+        regressed = latency > 1 + tolerance or throughput < 1 / (1 +
+                                                                 tolerance)
+        if regressed:
+            regressions.append(name)
+        print(f"  {name:<26} p50 {latency:>5.2f}x  throughput "
+              f"{throughput:>5.2f}x{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+# ================== Main ==================
+
+
+def parse_sizes(value):
+    return [int(size) for size in value.split(',') if size]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analysis benchmarks")
+    parser.add_argument(
+        'suite',
+        choices=[
+            'swings', 'indicators', 'analysis', 'batch', 'cycle', 'startup',
+            'record'
+        ])
+    parser.add_argument('--sizes',
+                        type=parse_sizes,
+                        help="candle counts, or market counts for cycle")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--fixtures',
+                        help="directory of recorded MARKET_TIMEFRAME.json "
+                        "kline responses (synthetic ones by default)")
+    parser.add_argument('--markets',
+                        default=','.join(bot_code.REQUESTED_MARKETS),
+                        help="comma separated markets to record")
+    parser.add_argument('--mode',
+                        choices=['serial', 'concurrent', 'batch'],
+                        default='serial')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance',
+                        type=float,
+                        default=REGRESSION_TOLERANCE)
+    args = parser.parse_args(argv)
+    if args.suite == 'swings':
+        bench_swings(args.sizes or [200, 10000, 1000000], args.repeat)
+        return
+    if args.suite == 'indicators':
+        bench_indicators(args.sizes or [200, 10000, 1000000], args.repeat)
+        return
+    if args.suite == 'startup':
+        bound = bench_startup(args.repeat)['web port answers']
+        if bound is None or bound > STARTUP_PORT_BUDGET:
+            raise SystemExit(f"The web port answered after {bound} seconds, "
+                             f"the budget is {STARTUP_PORT_BUDGET}")
+        return
+    if args.suite == 'record':
+        record_fixtures(args.markets.split(','), args.fixtures or 'fixtures')
+        return
+
+    fixtures = (load_fixtures(args.fixtures)
+                if args.fixtures else synthetic_fixtures())
+    suite = args.suite
+    if suite == 'batch':
+        bench_batch(args.sizes or BATCH_SIZES, fixtures, args.repeat)
+        return
+    # Timed before and after the suite, the faster run is the least
+    # disturbed one
+    calibration = calibrate()
+    if suite == 'analysis':
+        results = bench_analysis(fixtures)
+    else:
+        results = bench_cycle(args.sizes or CYCLE_SIZES, fixtures, args.mode)
+        # Every scan mode has its own cycle baseline
+        suite = f"cycle_{args.mode}"
+    calibration = min(calibration, calibrate())
+    if args.save_baseline:
+        save_baseline(suite, results, calibration, args.baseline)
+        return
+    regressions = compare_baseline(suite, results, calibration,
+                                   args.baseline, args.tolerance)
+    if regressions is None:
+        raise SystemExit(f"No {suite} baseline in {args.baseline}; store "
+                         "one with --save-baseline")
+    if regressions:
+        raise SystemExit(f"Regressions: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
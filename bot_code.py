@@ -1,35 +1,141 @@
-﻿import requests
+﻿import logging
+import os
 import time
-import numpy as np
 from datetime import datetime
-import json
-import pandas as pd
+import argparse
+import threading
+
+import metrics
+import scan_engine
+from concurrent.futures import ThreadPoolExecutor
+from http_client import (HttpClient, ServerClock, COINEX_BASE_URL,
+                         TELEGRAM_BASE_URL, decode_json)
+from candle_store import (CandleStore, KLINE_WINDOW, TIMEFRAME_SECONDS,
+                          has_gap)
+from candles import Candles, as_candles
+from indicators import IndicatorStore
+from archive import CandleArchive, ARCHIVE_DIR
+from swings import (MAX_SWINGS, copy_swings, detect_swings_columnar,
+                    new_swings)
+from pipeline import StageCache, closed_klines, last_closed_time
+from notifier import Notifier
+from subscriptions import SubscriptionRegistry, SUBSCRIBERS_FILE
+from tracker import SignalTracker, TARGET_LEVELS
+from logs import ERROR_LOG, dropped_records, setup_logging
+import scheduler as scheduler_settings
+from scheduler import (MarketScheduler, market_stats, top_markets,
+                       zone_distance, UNIVERSE_REFRESH, UNIVERSE_SIZE)
+import snapshot
 
 # ================== Settings ==================
-TELEGRAM_TOKEN = '7613935901:AAEKb1Gx4eTbl2ebhDTDqw0XHSdoZNrpZLE'
-CHAT_ID = '146323300'
+TELEGRAM_TOKEN = os.environ.get(
+    'TELEGRAM_TOKEN', '7613935901:AAEKb1Gx4eTbl2ebhDTDqw0XHSdoZNrpZLE')
+# Admin chat: gets the startup message, and every signal while there is no
+# subscribers file (see subscriptions.py)
+CHAT_ID = os.environ.get('TELEGRAM_CHAT_ID', '146323300')
 
 REQUESTED_MARKETS = [
     'ETHUSDT', 'BTCUSDT', 'SOLUSDT', 'ADAUSDT', 'DOGEUSDT', 'XRPUSDT',
     'BNBUSDT', 'LINKUSDT', 'SHIBUSDT'
 ]
 
-ERROR_LOG = 'error_log.txt'
-
-MAX_SWINGS = 50
 MAX_ERRORS = 5
 SLEEP_SECONDS = 180
 
+# Strategy parameters (tuned with sweep.py)
+STRATEGY = {
+    # Candles on each side a swing high/low has to exceed
+    'swing_width': 2,
+    # Latest candles scanned for new swings on M3/M15 and on other timeframes
+    'swing_lookback_fast': 50,
+    'swing_lookback_slow': 10,
+    # Minimum seconds between two signals for the same market
+    'signal_cooldown': 180,
+    # Stop loss is placed diameter / divisor beyond the channel
+    'stop_offset_divisor': 4,
+    # Momentum also needs the M15 volume z-score to reach this (0 = off)
+    'min_volume_z': 0.0,
+    # Algo 4 also needs the M3 channel to be this many M3 ATRs wide (0 = off)
+    'min_channel_atr': 0.0,
+}
+
+# 'serial' scans markets one after another, 'concurrent' scans them on a
+# bounded thread pool (see scan_engine.py),
+# 'stream' keeps candles updated over websockets and scans a market when
+# its M3 candle closes (see streaming.py), 'batch' runs the swing, trend,
+# momentum and breakout stages for all due markets at once before scanning
+# them one after another (see batch.py)
+SCAN_MODES = ['serial', 'concurrent', 'stream', 'batch']
+SCAN_MODE = 'serial'
+
+# Send the signals of a cycle as one digest message instead of one by one
+DIGEST_MODE = False
+
 last_signal_time = {market: 0 for market in REQUESTED_MARKETS}
 
+# Records go through a queue to a background writer once main() has called
+# setup_logging(); per-candle and per-stage details are DEBUG
+logger = logging.getLogger('bot')
+logger.addHandler(logging.NullHandler())
+
+# Shared keep-alive sessions, rate limits and request counters for
+# all CoinEx and Telegram calls
+# Exchange time; candle closes are judged by this clock
+server_clock = ServerClock()
+api_client = HttpClient(clock=server_clock)
+
+# Rolling candles per (market, timeframe); seeded once, then only the
+# candles newer than the last stored one are fetched
+candle_store = CandleStore(KLINE_WINDOW)
+
+# Results of the scan_market stages, reused until a new candle of their
+# input timeframe closes
+stage_cache = StageCache()
+# (market, swings stage) of the swings the batch pass found new, reported as
+# new by the next cached_swings call
+fresh_swings = set()
+# Batch mode's swings and stage results per timeframe (batch.SwingBook)
+batch_books = {}
+
+# ATR, EMA, RSI, volume z-score and channel width per (market, timeframe),
+# fed the closed candles of candle_store as they appear
+indicator_store = IndicatorStore()
+
+# Sent signals, followed against live prices until their stop loss or last
+# profit target is reached (see tracker.py)
+signal_tracker = SignalTracker()
+
+# Background Telegram delivery with retries and per-chat dedup, started by
+# main()
+notifier = None
+# Chats signals are sent to, filtered by market and risk
+subscriptions = None
+# When set (sharded workers), signals are handed to
+# signal_sink(market, signal, risk, message) instead of the notifier
+signal_sink = None
+
+# Run state shown on /status: main()'s state dicts, cycle counters and the
+# outcome of the last scan of every market
+runtime = {}
+market_status = {}
+# Guards what the scan threads share: market_status, last_signal_time,
+# fresh_swings and main()'s state, error_counts and active_markets
+state_lock = threading.Lock()
+
+# Closed candles kept on disk across restarts
+candle_archive = CandleArchive(ARCHIVE_DIR)
+
+# Set while running in stream mode
+stream_manager = None
+
 # ================== Helper Functions ==================
 
 
 def check_available_markets():
-    url = "https://api.coinex.com/perpetual/v1/market/list"
+    url = f"{COINEX_BASE_URL}/perpetual/v1/market/list"
     try:
-        response = requests.get(url, timeout=10)
-        data = response.json()
+        response = api_client.get(url)
+        data = decode_json(response)
         if data['code'] == 0:
             available_markets = [m['name'] for m in data['data']]
             valid_markets = [
@@ -40,135 +146,323 @@ def check_available_markets():
                 market for market in REQUESTED_MARKETS
                 if market not in available_markets
             ]
-            print("Available markets:", valid_markets)
+            logger.info("Available markets: %s", valid_markets)
             if invalid_markets:
-                print("Unavailable markets:", invalid_markets)
                 log_error(f"Unavailable markets: {invalid_markets}")
             return valid_markets
         else:
             error_msg = f"Error getting market list: {data['message']}"
-            print(error_msg)
             log_error(error_msg)
             return REQUESTED_MARKETS
     except Exception as e:
         error_msg = f"Error checking markets: {str(e)}"
-        print(error_msg)
         log_error(error_msg)
         return REQUESTED_MARKETS
 
 
-def log_error(message):
-    try:
-        with open(ERROR_LOG, 'a') as f:
-            f.write(f"{datetime.now()}: {message}\n")
-    except Exception as e:
-        print(f"Error logging: {str(e)}")
+def log_error(message, **fields):
+    # Written to ERROR_LOG, the JSON log and the console by the log writer
+    logger.error(message, extra=fields)
+
+
+def post_telegram_message(chat_id, message):
+    url = f"{TELEGRAM_BASE_URL}/bot{TELEGRAM_TOKEN}/sendMessage"
+    params = {'chat_id': chat_id, 'text': message, 'parse_mode': 'HTML'}
+    return api_client.post(url, params=params, endpoint='/sendMessage')
 
 
 def send_telegram_message(message):
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
-    params = {'chat_id': CHAT_ID, 'text': message, 'parse_mode': 'HTML'}
     try:
-        response = requests.post(url, params=params, timeout=10)
+        response = post_telegram_message(CHAT_ID, message)
         if response.status_code != 200:
             error_msg = f"Error sending to Telegram: {response.text}"
-            print(error_msg)
             log_error(error_msg)
             return False
         return True
     except Exception as e:
         error_msg = f"Error sending to Telegram: {str(e)}"
-        print(error_msg)
         log_error(error_msg)
         return False
 
 
-def get_klines(market, timeframe='15min', limit=200, retries=5, delay=20):
-    url = f"https://api.coinex.com/perpetual/v1/market/kline?market={market}&type={timeframe}&limit={limit}"
+def parse_klines(rows):
+    # CoinEx kline rows [time, open, close, high, low, volume, amount] ->
+    # columnar Candles, without a dict per candle
+    return Candles.from_rows(rows)
+
+
+def get_klines(market,
+               timeframe='15min',
+               limit=200,
+               retries=5,
+               delay=1,
+               min_candles=10):
+    endpoint = '/perpetual/v1/market/kline'
+    url = f"{COINEX_BASE_URL}{endpoint}?market={market}&type={timeframe}&limit={limit}"
     for attempt in range(retries):
         try:
-            response = requests.get(url, timeout=10)
-            data = response.json()
+            response = api_client.get(url)
+            data = decode_json(response)
             if data['code'] == 0 and data['data'] and isinstance(
                     data['data'], list):
-                klines = [{
-                    'time': int(k[0]),
-                    'open': float(k[1]),
-                    'close': float(k[2]),
-                    'high': float(k[3]),
-                    'low': float(k[4]),
-                    'volume': float(k[5])
-                } for k in data['data']]
-                print(
-                    f"Candles count for {market} ({timeframe}): {len(klines)}")
-                if len(klines) >= 10:
+                with metrics.parse_latency.time(timeframe=timeframe):
+                    klines = parse_klines(data['data'])
+                logger.debug("Candles count for %s (%s): %d",
+                             market,
+                             timeframe,
+                             len(klines),
+                             extra={
+                                 'market': market,
+                                 'timeframe': timeframe
+                             })
+                if len(klines) >= min_candles:
                     return klines
                 else:
-                    error_msg = f"Candles count for {market} ({timeframe}) less than 10: {len(klines)}"
-                    print(error_msg)
-                    log_error(error_msg)
+                    error_msg = f"Candles count for {market} ({timeframe}) less than {min_candles}: {len(klines)}"
+                    log_error(error_msg, market=market, timeframe=timeframe)
             else:
                 error_msg = f"Coinex API error ({market}, {timeframe}): {data.get('message', 'Invalid data')}"
-                print(error_msg)
-                log_error(error_msg)
+                log_error(error_msg, market=market, timeframe=timeframe)
         except Exception as e:
             error_msg = f"API request error for {market} ({timeframe}): {str(e)}"
-            print(error_msg)
-            log_error(error_msg)
+            log_error(error_msg, market=market, timeframe=timeframe)
         if attempt < retries - 1:
-            print(
-                f"Retrying for {market} ({timeframe}) after {delay} seconds..."
-            )
-            time.sleep(delay)
+            logger.warning("Retrying for %s (%s)...",
+                           market,
+                           timeframe,
+                           extra={
+                               'market': market,
+                               'timeframe': timeframe
+                           })
+            api_client.backoff(attempt, endpoint, base=delay)
     return None
 
 
-def get_ticker(market, retries=5, delay=20):
-    url = f"https://api.coinex.com/perpetual/v1/market/ticker?market={market}"
+def get_klines_cached(market, timeframe='15min', limit=200):
+    klines = None
+    now = server_clock.now()
+    # Streamed candles are always current; polled ones only need fetching
+    # once a candle has closed since the last fetch
+    if (candle_store.is_live(market, timeframe)
+            or candle_store.is_current(market, timeframe, now)):
+        klines = candle_store.get(market, timeframe, limit)
+    if not klines:
+        delta = candle_store.delta_limit(market, timeframe, limit, now)
+        if delta is not None:
+            fresh = get_klines(market,
+                               timeframe,
+                               delta,
+                               retries=1,
+                               min_candles=1)
+            if fresh and candle_store.merge(market, timeframe, fresh):
+                klines = candle_store.get(market, timeframe, limit)
+            else:
+                logger.warning("Delta fetch for %s (%s) failed. Reseeding...",
+                               market,
+                               timeframe,
+                               extra={
+                                   'market': market,
+                                   'timeframe': timeframe
+                               })
+    if not klines:
+        klines = get_klines(market, timeframe, limit)
+        if klines:
+            candle_store.seed(market, timeframe, klines)
+    if klines:
+        archive_klines(market, timeframe, klines)
+    return klines
+
+
+def archive_klines(market, timeframe, klines):
+    # Appends the candles that closed since the last archived one
+    try:
+        last_time = candle_archive.last_time(market, timeframe)
+        first = len(klines)
+        while first > 0 and (last_time is None
+                             or klines[first - 1]['time'] > last_time):
+            first -= 1
+        if first < len(klines):
+            candle_archive.append(market, timeframe, klines[first:],
+                                  now=server_clock.now())
+    except Exception as e:
+        error_msg = f"Error archiving candles for {market} ({timeframe}): {str(e)}"
+        log_error(error_msg, market=market, timeframe=timeframe)
+
+
+def warm_start(markets, timeframes=('15min', '3min', '1hour')):
+    # Seeds candle_store from the archive so the first cycle only needs
+    # delta fetches. The archive only appends candles newer than its last
+    # one, so a downtime longer than the window leaves a hole in it; a
+    # window with a hole is left for the first cycle to fetch in full
+    for market in markets:
+        for timeframe in timeframes:
+            try:
+                candles = candle_archive.read(market,
+                                              timeframe,
+                                              limit=KLINE_WINDOW)
+                if has_gap(candles, timeframe):
+                    logger.info("Archive of %s (%s) has a gap, refetching",
+                                market,
+                                timeframe,
+                                extra={
+                                    'market': market,
+                                    'timeframe': timeframe
+                                })
+                elif len(candles):
+                    candle_store.seed(market,
+                                      timeframe,
+                                      candles,
+                                      fetched=False)
+            except Exception as e:
+                error_msg = f"Error reading archive for {market} ({timeframe}): {str(e)}"
+                log_error(error_msg, market=market, timeframe=timeframe)
+
+
+def restore_state(state,
+                  error_counts,
+                  active_markets,
+                  path=snapshot.SNAPSHOT_FILE):
+    # Loads the last snapshot into the fresh state of main(). Swings are only
+    # reused if the snapshot is recent enough for the swing lookbacks to
+    # cover the downtime; cooldowns and error counts are always restored
+    try:
+        saved = snapshot.load_snapshot(path)
+    except Exception as e:
+        error_msg = f"Error loading state snapshot: {str(e)}"
+        log_error(error_msg)
+        return False
+    if not saved:
+        return False
+    age = time.time() - saved['saved_at']
+    if age <= snapshot.SNAPSHOT_MAX_AGE:
+        for market, swings in saved['state'].items():
+            if market in state:
+                state[market].update(swings)
+    for market, count in saved['error_counts'].items():
+        if market in error_counts:
+            error_counts[market] = count
+    for market, signal_time in saved['last_signal_time'].items():
+        if signal_time > last_signal_time.get(market, 0):
+            last_signal_time[market] = signal_time
+    # Open signals are followed again whatever the age; the ones past
+    # SIGNAL_MAX_AGE expire in the first cycle
+    signal_tracker.restore(saved.get('signals'))
+    # Markets dropped after too many errors stay dropped; markets that were
+    # not in the snapshot are scanned as usual
+    removed = set(saved['state']) - set(saved['active_markets'])
+    active_markets[:] = [m for m in active_markets if m not in removed]
+    logger.info("Restored state snapshot from %.0f seconds ago", age)
+    return True
+
+
+def save_state(state,
+               error_counts,
+               active_markets,
+               path=snapshot.SNAPSHOT_FILE):
+    try:
+        with state_lock:
+            snapshot.save_snapshot(state,
+                                   error_counts,
+                                   active_markets,
+                                   last_signal_time,
+                                   path=path,
+                                   extra={'signals': signal_tracker.to_dict()})
+        return True
+    except Exception as e:
+        error_msg = f"Error saving state snapshot: {str(e)}"
+        log_error(error_msg)
+        return False
+
+
+def get_market_stats():
+    # 24h turnover and range of every perpetual market in one request
+    url = f"{COINEX_BASE_URL}/perpetual/v1/market/ticker/all"
+    try:
+        response = api_client.get(url)
+        data = decode_json(response)
+        if data['code'] == 0:
+            return market_stats(data['data']['ticker'])
+        error_msg = f"Error getting market tickers: {data['message']}"
+        log_error(error_msg)
+    except Exception as e:
+        error_msg = f"Error getting market tickers: {str(e)}"
+        log_error(error_msg)
+    return {}
+
+
+def get_ticker(market, retries=5, delay=1):
+    if stream_manager:
+        price = stream_manager.last_price(market)
+        if price is not None:
+            return price
+    endpoint = '/perpetual/v1/market/ticker'
+    url = f"{COINEX_BASE_URL}{endpoint}?market={market}"
     for attempt in range(retries):
         try:
-            response = requests.get(url, timeout=10)
-            data = response.json()
+            response = api_client.get(url)
+            data = decode_json(response)
             if data['code'] == 0 and 'ticker' in data['data']:
                 return float(data['data']['ticker']['last'])
             elif data['code'] == 0 and 'last' in data['data']:
                 return float(data['data']['last'])
             else:
                 error_msg = f"Unknown ticker structure for {market}: {data}"
-                print(error_msg)
-                log_error(error_msg)
+                log_error(error_msg, market=market)
         except Exception as e:
             error_msg = f"Error getting ticker for {market}: {str(e)}"
-            print(error_msg)
-            log_error(error_msg)
+            log_error(error_msg, market=market)
         if attempt < retries - 1:
-            print(f"Retrying for {market} after {delay} seconds...")
-            time.sleep(delay)
+            logger.warning("Retrying for %s...",
+                           market,
+                           extra={'market': market})
+            api_client.backoff(attempt, endpoint, base=delay)
     return None
 
 
 # ================== Analysis Algorithm ==================
 
 
-def detect_swings(market, timeframe, klines, prev_swings=None):
+def detect_swings(market,
+                  timeframe,
+                  klines,
+                  prev_swings=None,
+                  lookback=None,
+                  width=None):
+    # `klines` is a list of candle dicts or a columnar Candles object;
+    # `lookback` and `width` default to the STRATEGY parameters
     if not klines or len(klines) < 5:
         error_msg = f"Insufficient data to detect swings in {market} ({timeframe}): {len(klines) if klines else 0} candles"
-        print(error_msg)
-        log_error(error_msg)
-        return prev_swings or {'highs': [], 'lows': []}, False
-    swings = prev_swings or {'highs': [], 'lows': []}
-    start_idx = max(0,
-                    len(klines) -
-                    50) if timeframe in ['3min', '15min'] else max(
-                        0,
-                        len(klines) - 10)
+        log_error(error_msg, market=market, timeframe=timeframe)
+        return prev_swings or new_swings(MAX_SWINGS), False
+    swings = prev_swings or new_swings(MAX_SWINGS)
+    if lookback is None:
+        fast = timeframe in ['3min', '15min']
+        lookback = STRATEGY['swing_lookback_fast'
+                            if fast else 'swing_lookback_slow']
+    if width is None:
+        width = STRATEGY['swing_width']
+    start_idx = max(0, len(klines) - lookback)
     new_swing_detected = False
     try:
-        for i in range(start_idx + 2, len(klines) - 2):
-            if (klines[i]['high'] > klines[i - 1]['high']
-                    and klines[i]['high'] > klines[i - 2]['high']
-                    and klines[i]['high'] > klines[i + 1]['high']
-                    and klines[i]['high'] > klines[i + 2]['high']):
+        if isinstance(klines, Candles):
+            new_swing_detected = detect_swings_columnar(
+                klines, start_idx, swings, width)
+            logger.debug("Detected swings for %s (%s): highs=%d, lows=%d",
+                         market,
+                         timeframe,
+                         len(swings['highs']),
+                         len(swings['lows']),
+                         extra={
+                             'market': market,
+                             'timeframe': timeframe,
+                             'stage': 'swings'
+                         })
+            return swings, new_swing_detected
+        sides = range(1, width + 1)
+        for i in range(start_idx + width, len(klines) - width):
+            if all(klines[i]['high'] > klines[i - k]['high']
+                   and klines[i]['high'] > klines[i + k]['high']
+                   for k in sides):
                 if not swings['highs'] or klines[i]['time'] > swings['highs'][
                         -1]['time']:
                     new_high = {
@@ -177,18 +471,15 @@ def detect_swings(market, timeframe, klines, prev_swings=None):
                     }
                     if swings['highs']:
                         last_high = swings['highs'][-1]
-                        has_low_between = any(
-                            low['time'] > last_high['time']
-                            and low['time'] < new_high['time']
-                            for low in swings['lows'])
+                        has_low_between = swings['lows'].has_between(
+                            last_high['time'], new_high['time'])
                         if not has_low_between:
                             swings['highs'].pop()
                     swings['highs'].append(new_high)
                     new_swing_detected = True
-            if (klines[i]['low'] < klines[i - 1]['low']
-                    and klines[i]['low'] < klines[i - 2]['low']
-                    and klines[i]['low'] < klines[i + 1]['low']
-                    and klines[i]['low'] < klines[i + 2]['low']):
+            if all(klines[i]['low'] < klines[i - k]['low']
+                   and klines[i]['low'] < klines[i + k]['low']
+                   for k in sides):
                 if not swings['lows'] or klines[i]['time'] > swings['lows'][
                         -1]['time']:
                     new_low = {
@@ -197,22 +488,26 @@ def detect_swings(market, timeframe, klines, prev_swings=None):
                     }
                     if swings['lows']:
                         last_low = swings['lows'][-1]
-                        has_high_between = any(
-                            high['time'] > last_low['time']
-                            and high['time'] < new_low['time']
-                            for high in swings['highs'])
+                        has_high_between = swings['highs'].has_between(
+                            last_low['time'], new_low['time'])
                         if not has_high_between:
                             swings['lows'].pop()
                     swings['lows'].append(new_low)
                     new_swing_detected = True
-        print(
-            f"Detected swings for {market} ({timeframe}): highs={len(swings['highs'])}, lows={len(swings['lows'])}"
-        )
+        logger.debug("Detected swings for %s (%s): highs=%d, lows=%d",
+                     market,
+                     timeframe,
+                     len(swings['highs']),
+                     len(swings['lows']),
+                     extra={
+                         'market': market,
+                         'timeframe': timeframe,
+                         'stage': 'swings'
+                     })
         return swings, new_swing_detected
     except Exception as e:
         error_msg = f"Error detecting swings for {market} ({timeframe}): {str(e)}"
-        print(error_msg)
-        log_error(error_msg)
+        log_error(error_msg, market=market, timeframe=timeframe)
         return swings, False
 
 
@@ -224,7 +519,6 @@ def calculate_slope(point1, point2, timeframe_minutes):
         return delta_price / delta_time if delta_time != 0 else 0
     except Exception as e:
         error_msg = f"Error calculating slope: {str(e)}"
-        print(error_msg)
         log_error(error_msg)
         return 0
 
@@ -233,8 +527,7 @@ def detect_trend_and_channel(market, timeframe, swings):
     try:
         if len(swings['highs']) < 2 or len(swings['lows']) < 2:
             error_msg = f"Insufficient swings to detect trend in {market} ({timeframe}): highs={len(swings['highs'])}, lows={len(swings['lows'])}"
-            print(error_msg)
-            log_error(error_msg)
+            log_error(error_msg, market=market, timeframe=timeframe)
             return None, None, None
 
         last_high = swings['highs'][-1]['price']
@@ -253,12 +546,19 @@ def detect_trend_and_channel(market, timeframe, swings):
             'support': (swings['lows'][-2], swings['lows'][-1]),
             'resistance': (swings['highs'][-2], swings['highs'][-1])
         }
-        print(f"Detected trend for {market} ({timeframe}): {trend}")
+        logger.debug("Detected trend for %s (%s): %s",
+                     market,
+                     timeframe,
+                     trend,
+                     extra={
+                         'market': market,
+                         'timeframe': timeframe,
+                         'stage': 'trend'
+                     })
         return trend, channel, trend
     except Exception as e:
         error_msg = f"Error detecting trend and channel for {market} ({timeframe}): {str(e)}"
-        print(error_msg)
-        log_error(error_msg)
+        log_error(error_msg, market=market, timeframe=timeframe)
         return None, None, None
 
 
@@ -266,12 +566,24 @@ def check_channel_breakout(market, timeframe, klines, channel,
                            timeframe_minutes):
     try:
         if not channel or not klines:
-            print(
-                f"{market} ({timeframe}): Invalid channel or candles. Stuck at breakout"
-            )
+            logger.debug("%s (%s): Invalid channel or candles. Stuck at breakout",
+                         market,
+                         timeframe,
+                         extra={
+                             'market': market,
+                             'timeframe': timeframe,
+                             'stage': 'breakout'
+                         })
             return False
-        last_candle = klines[-1]
-        prev_candle = klines[-2]
+        # Candles are read column-wise, without building candle dicts
+        if isinstance(klines, Candles):
+            last_time = int(klines.time[-1])
+            last_close = float(klines.close[-1])
+            prev_close = float(klines.close[-2])
+        else:
+            last_time = klines[-1]['time']
+            last_close = klines[-1]['close']
+            prev_close = klines[-2]['close']
 
         support_slope = calculate_slope(channel['support'][0],
                                         channel['support'][1],
@@ -280,51 +592,75 @@ def check_channel_breakout(market, timeframe, klines, channel,
                                            channel['resistance'][1],
                                            timeframe_minutes)
 
-        time_diff = (last_candle['time'] -
+        time_diff = (last_time -
                      channel['support'][1]['time']) / (60 * timeframe_minutes)
         support_price = channel['support'][1][
             'price'] + support_slope * time_diff
         resistance_price = channel['resistance'][1][
             'price'] + resistance_slope * time_diff
 
-        if last_candle['close'] > resistance_price and prev_candle[
-                'close'] <= resistance_price:
-            print(
-                f"{market} ({timeframe}): Channel breakout upward. Stuck at breakout"
-            )
+        if last_close > resistance_price and prev_close <= resistance_price:
+            logger.debug("%s (%s): Channel breakout upward. Stuck at breakout",
+                         market,
+                         timeframe,
+                         extra={
+                             'market': market,
+                             'timeframe': timeframe,
+                             'stage': 'breakout'
+                         })
             return True
-        if last_candle['close'] < support_price and prev_candle[
-                'close'] >= support_price:
-            print(
-                f"{market} ({timeframe}): Channel breakout downward. Stuck at breakout"
-            )
+        if last_close < support_price and prev_close >= support_price:
+            logger.debug("%s (%s): Channel breakout downward. Stuck at breakout",
+                         market,
+                         timeframe,
+                         extra={
+                             'market': market,
+                             'timeframe': timeframe,
+                             'stage': 'breakout'
+                         })
             return True
         return False
     except Exception as e:
         error_msg = f"Error checking channel breakout for {market} ({timeframe}): {str(e)}"
-        print(error_msg)
-        log_error(error_msg)
+        log_error(error_msg, market=market, timeframe=timeframe)
         return False
 
 
-def calculate_range_momentum(market, timeframe, swings):
+def calculate_range_momentum(market,
+                              timeframe,
+                              swings,
+                              volume_z=None,
+                              min_volume_z=None):
+    # With min_volume_z (default STRATEGY['min_volume_z']) set, the last
+    # closed candle's volume z-score has to reach it as well
+    if min_volume_z is None:
+        min_volume_z = STRATEGY['min_volume_z']
     try:
         if len(swings['highs']) < 2 or len(swings['lows']) < 2:
             error_msg = f"Insufficient swings for range momentum in {market} ({timeframe}): highs={len(swings['highs'])}, lows={len(swings['lows'])}"
-            print(error_msg)
-            log_error(error_msg)
+            log_error(error_msg, market=market, timeframe=timeframe)
             return False, 'Unknown'
         action1_range = abs(swings['highs'][-2]['price'] -
                             swings['lows'][-2]['price'])
         action2_range = abs(swings['highs'][-1]['price'] -
                             swings['lows'][-1]['price'])
-        strength = 'Strong' if action2_range >= action1_range else 'Weak'
-        print(f"Range momentum for {market} ({timeframe}): {strength}")
-        return action2_range >= action1_range, strength
+        strong = action2_range >= action1_range
+        if min_volume_z and (volume_z is None or volume_z < min_volume_z):
+            strong = False
+        strength = 'Strong' if strong else 'Weak'
+        logger.debug("Range momentum for %s (%s): %s",
+                     market,
+                     timeframe,
+                     strength,
+                     extra={
+                         'market': market,
+                         'timeframe': timeframe,
+                         'stage': 'momentum'
+                     })
+        return strong, strength
     except Exception as e:
         error_msg = f"Error calculating range momentum for {market} ({timeframe}): {str(e)}"
-        print(error_msg)
-        log_error(error_msg)
+        log_error(error_msg, market=market, timeframe=timeframe)
         return False, 'Unknown'
 
 
@@ -333,20 +669,32 @@ def check_hpta(market, trend_m15, trend_m3):
         result = (trend_m15 == 'up trend'
                   and trend_m3 == 'up trend') or (trend_m15 == 'down trend'
                                                   and trend_m3 == 'down trend')
-        print(
-            f"HPTA checked for {market}: M15={trend_m15}, M3={trend_m3}, Result={result}"
-        )
-        if not result:
-            print(f"{market}: Stuck at HPTA")
+        logger.debug("HPTA checked for %s: M15=%s, M3=%s, Result=%s",
+                     market,
+                     trend_m15,
+                     trend_m3,
+                     result,
+                     extra={
+                         'market': market,
+                         'stage': 'hpta'
+                     })
         return result
     except Exception as e:
         error_msg = f"Error checking HPTA for {market}: {str(e)}"
-        print(error_msg)
-        log_error(error_msg)
+        log_error(error_msg, market=market)
         return False
 
 
-def algo4_check(trend_m3, channel_m3, current_price, prev_swings_m3):
+def algo4_check(trend_m3,
+                channel_m3,
+                current_price,
+                prev_swings_m3,
+                atr=None,
+                min_channel_atr=None):
+    # With min_channel_atr (default STRATEGY['min_channel_atr']) set, a
+    # channel narrower than that many ATRs is never a zone
+    if min_channel_atr is None:
+        min_channel_atr = STRATEGY['min_channel_atr']
     if not channel_m3:
         return False, 'Neutral', False
 
@@ -354,6 +702,8 @@ def algo4_check(trend_m3, channel_m3, current_price, prev_swings_m3):
     resistance = channel_m3['resistance'][1]['price']
     diameter = abs(resistance - support)
     mid = (support + resistance) / 2
+    too_narrow = min_channel_atr and (atr is None
+                                      or diameter < min_channel_atr * atr)
 
     ob = mid + (diameter / 2)
     os = mid - (diameter / 2)
@@ -363,6 +713,8 @@ def algo4_check(trend_m3, channel_m3, current_price, prev_swings_m3):
                  or len(prev_swings_m3.get('lows', [])) < len(
                      channel_m3['support'][1].get('lows', [])))
 
+    if too_narrow:
+        return False, 'Narrow', new_swing
     if trend_m3 == 'up trend' and current_price <= os:
         return True, 'Oversold', new_swing
     elif trend_m3 == 'down trend' and current_price >= ob:
@@ -370,11 +722,14 @@ def algo4_check(trend_m3, channel_m3, current_price, prev_swings_m3):
     return False, 'Neutral', new_swing
 
 
-def calculate_stop_loss(trend_m3, channel_m3, diameter):
+def calculate_stop_loss(trend_m3, channel_m3, diameter, offset_divisor=None):
+    if offset_divisor is None:
+        offset_divisor = STRATEGY['stop_offset_divisor']
     if trend_m3 == 'up trend':
-        return channel_m3['support'][1]['price'] - (diameter / 4)
+        return channel_m3['support'][1]['price'] - (diameter / offset_divisor)
     elif trend_m3 == 'down trend':
-        return channel_m3['resistance'][1]['price'] + (diameter / 4)
+        return channel_m3['resistance'][1]['price'] + (diameter /
+                                                       offset_divisor)
     return None
 
 
@@ -392,208 +747,1106 @@ def calculate_profit_targets(current_price, trend_m3, diameter, channel_m3):
 # ================== Main Loop ==================
 
 
-def main():
-    print("Starting Coinex futures monitoring...")
-    if not send_telegram_message("🚀 نظارت بر ارزهای فیوچرز کوینکس شروع شد!"):
-        print(
-            "Error sending initial message to Telegram. Check token or chat ID."
-        )
+def cached_swings(market, timeframe, klines, state, now):
+    # Swings are detected on closed candles only, once per closed candle;
+    # returns the swings, whether new ones were found and the stage key
+    stage = 'swings_' + {'15min': 'm15', '3min': 'm3', '1hour': 'h1'}[timeframe]
+    klines = closed_klines(klines, timeframe, now)
+    key = klines[-1]['time'] if klines else None
+    found, swings = stage_cache.lookup(market, stage, key)
+    with state_lock:
+        fresh = (market, stage) in fresh_swings
+        fresh_swings.discard((market, stage))
+        previous = state[market][stage]
+    if found:
+        return swings, fresh, key
+    # Pivots are added to a copy that replaces the state's swings under the
+    # lock, so save_state and status() never see them half updated
+    with metrics.stage_latency.time(stage=stage):
+        swings, new_swings_found = detect_swings(
+            market, timeframe, klines, previous and copy_swings(previous))
+    if new_swings_found:
+        with state_lock:
+            state[market][stage] = swings
+    stage_cache.store(market, stage, key, swings)
+    return swings, new_swings_found or fresh, key
+
+
+def cached_indicators(market, timeframe, klines, now):
+    # Indicator values of the last closed candle ({} without candles); the
+    # store is fed once per closed candle
+    stage = 'indicators_' + {
+        '15min': 'm15',
+        '3min': 'm3',
+        '1hour': 'h1'
+    }[timeframe]
+    klines = closed_klines(klines, timeframe, now)
+    key = klines[-1]['time'] if klines else None
+    return stage_cache.run(market, stage, key, indicator_store.update, market,
+                           timeframe, klines) or {}
+
+
+def indicator_value(values, name):
+    # None while the indicator has not seen enough candles
+    value = values.get(name)
+    return None if value is None or value != value else value
+
+
+def record_stage(market, stage, message=None, **fields):
+    # Where the last scan of `market` stopped ('signal' if it got through)
+    with state_lock:
+        market_status[market] = dict(fields, stage=stage)
+    metrics.market_stuck.inc(stage=stage)
+    if message:
+        logger.debug(message, extra={'market': market, 'stage': stage})
+
+
+def prefetched_klines(market, timeframe, prefetched):
+    # Candles the batch pass already fetched (None if that failed), else
+    # fetched now
+    if prefetched and timeframe in prefetched:
+        return prefetched[timeframe]
+    return get_klines_cached(market, timeframe, 200)
+
+
+def scan_market(market, state, error_counts, active_markets,
+                max_errors=MAX_ERRORS,
+                prefetched=None):
+    # `prefetched` is {timeframe: candles} from analyze_batch
+    state_changed = False
+    started = time.perf_counter()
+    try:
+        logger.debug("Scanning %s", market, extra={'market': market})
+
+        klines_m15 = prefetched_klines(market, '15min', prefetched)
+        if not klines_m15:
+            with state_lock:
+                error_counts[market] += 1
+                errors = error_counts[market]
+                if errors >= max_errors and market in active_markets:
+                    active_markets.remove(market)
+            error_msg = f"M15 data for {market} not received. Error number {errors}."
+            log_error(error_msg, market=market)
+            if errors >= max_errors:
+                logger.warning(
+                    "%s temporarily removed from list due to repeated errors.",
+                    market,
+                    extra={'market': market})
+            record_stage(market, 'm15_data')
+            return state_changed
+        else:
+            with state_lock:
+                error_counts[market] = 0
+
+        # Open signals of the market are checked against the live price
+        if signal_tracker.has_open(market):
+            track_price(market, get_ticker(market, retries=1))
+
+        now = server_clock.now()
+        swings_m15, new_m15, key_m15 = cached_swings(market, '15min',
+                                                     klines_m15, state, now)
+        trend_m15, channel_m15, pattern_m15 = stage_cache.run(
+            market, 'trend_m15', key_m15, detect_trend_and_channel, market,
+            '15min', swings_m15)
+        if new_m15:
+            state_changed = True
+
+        if not trend_m15 or trend_m15 not in ['up trend', 'down trend']:
+            record_stage(
+                market,
+                'trend_m15',
+                f"M15 trend for {market} not detected or non-trending ({trend_m15}). Stuck at trend_m15",
+                trend_m15=trend_m15)
+            return state_changed
+
+        volume_z = indicator_value(
+            cached_indicators(market, '15min', klines_m15, now), 'volume_z')
+        range_is_strong, range_strength = stage_cache.run(
+            market, 'momentum_m15', key_m15, calculate_range_momentum, market,
+            '15min', swings_m15, volume_z)
+        if not range_is_strong:
+            record_stage(market,
+                         'momentum',
+                         "Weak momentum. Stuck at momentum",
+                         trend_m15=trend_m15,
+                         volume_z=volume_z)
+            return state_changed
+
+        klines_m3 = prefetched_klines(market, '3min', prefetched)
+        if not klines_m3:
+            record_stage(market,
+                         'm3_data',
+                         "M3 data not received. Continuing...",
+                         trend_m15=trend_m15)
+            return state_changed
+
+        swings_m3, new_m3, key_m3 = cached_swings(market, '3min', klines_m3,
+                                                  state, now)
+        trend_m3, channel_m3, pattern_m3 = stage_cache.run(
+            market, 'trend_m3', key_m3, detect_trend_and_channel, market,
+            '3min', swings_m3)
+        if new_m3:
+            state_changed = True
+
+        if not trend_m3:
+            record_stage(market,
+                         'trend_m3',
+                         "M3 trend not detected. Stuck at trend_m3",
+                         trend_m15=trend_m15,
+                         trend_m3=trend_m3)
+            return state_changed
+
+        # Breakouts are judged on closed candles; algo 4 reads the live price
+        if stage_cache.run(market, 'breakout_m3', key_m3,
+                           check_channel_breakout, market, '3min',
+                           closed_klines(klines_m3, '3min', now), channel_m3,
+                           3):
+            record_stage(market,
+                         'breakout',
+                         "Channel breakout in M3. Stuck at breakout",
+                         trend_m15=trend_m15,
+                         trend_m3=trend_m3)
+            return state_changed
+
+        hpta_key = (key_m15, key_m3)
+        hpta_result = stage_cache.run(market, 'hpta', hpta_key, check_hpta,
+                                      market, trend_m15, trend_m3)
+        if not hpta_result:
+            record_stage(market,
+                         'hpta',
+                         "HPTA not aligned. Stuck at HPTA",
+                         trend_m15=trend_m15,
+                         trend_m3=trend_m3)
+            return state_changed
+
+        current_price = get_ticker(market)
+        atr_m3 = indicator_value(
+            cached_indicators(market, '3min', klines_m3, now), 'atr')
+        algo4_pass, zone, new_swing = stage_cache.run(
+            market, 'algo4', (key_m3, current_price), algo4_check, trend_m3,
+            channel_m3, current_price, state[market]['swings_m3'], atr_m3)
+        if not algo4_pass:
+            record_stage(market,
+                         'algo4',
+                         "Algo 4 condition not passed. Waiting to reach suitable zone.",
+                         trend_m15=trend_m15,
+                         trend_m3=trend_m3,
+                         zone=zone,
+                         atr_m3=atr_m3,
+                         zone_distance=zone_distance(trend_m3, channel_m3,
+                                                     current_price))
+            return state_changed
+
+        if new_swing:
+            logger.debug("New SH/SL detected. Re-checking algorithms...",
+                         extra={'market': market})
+            hpta_result = stage_cache.run(market, 'hpta', hpta_key,
+                                          check_hpta, market, trend_m15,
+                                          trend_m3)
+            if hpta_result and new_m15:
+                _, channel_m15, _ = stage_cache.run(
+                    market, 'trend_m15', key_m15, detect_trend_and_channel,
+                    market, '15min', swings_m15)
+                range_is_strong, _ = stage_cache.run(
+                    market, 'momentum_m15', key_m15, calculate_range_momentum,
+                    market, '15min', swings_m15, volume_z)
+                if not range_is_strong:
+                    record_stage(market,
+                                 'momentum',
+                                 "Weak momentum in M15. Not continuing.",
+                                 trend_m15=trend_m15,
+                                 trend_m3=trend_m3)
+                    return state_changed
+
+        # H1 klines are only fetched once a new H1 candle has closed
+        found, trend_h1 = stage_cache.lookup(
+            market, 'trend_h1', last_closed_time('1hour', now))
+        if not found:
+            klines_h1 = get_klines_cached(market, '1hour', 200)
+            trend_h1 = 'sideway'
+            if klines_h1:
+                swings_h1, new_h1, key_h1 = cached_swings(
+                    market, '1hour', klines_h1, state, now)
+                with metrics.stage_latency.time(stage='trend_h1'):
+                    trend_h1_temp, channel_h1, _ = detect_trend_and_channel(
+                        market, '1hour', swings_h1)
+                if new_h1:
+                    state_changed = True
+                if trend_h1_temp:
+                    trend_h1 = trend_h1_temp
+                stage_cache.store(market, 'trend_h1', key_h1, trend_h1)
+
+        signal, risk = None, None
+        if trend_m15 == 'up trend' and trend_m3 == 'up trend':
+            signal = 'Long'
+            risk = 'Very Low' if trend_h1 == 'up trend' else 'Low' if trend_h1 == 'sideway' else 'Medium'
+        elif trend_m15 == 'down trend' and trend_m3 == 'down trend':
+            signal = 'Short'
+            risk = 'Very Low' if trend_h1 == 'down trend' else 'Low' if trend_h1 == 'sideway' else 'Medium'
+
+        if signal:
+            current_time = time.time()
+            if current_time - last_signal_time.get(market, 0) >= STRATEGY[
+                    'signal_cooldown']:
+                current_price = get_ticker(market)
+                diameter = abs(channel_m3['resistance'][1]['price'] -
+                               channel_m3['support'][1]['price'])
+                stop_loss = calculate_stop_loss(trend_m3, channel_m3,
+                                                diameter)
+                target1, target2, target3 = calculate_profit_targets(
+                    current_price, trend_m3, diameter, channel_m3)
+                price_str = f"${current_price:.4f}" if current_price else "نامشخص"
+                message = (
+                    f"🔔 <b>سیگنال {signal} برای {market}</b>\n"
+                    f"{datetime.now().strftime('%H:%M:%S')} - {market}\n"
+                    f"1H = {trend_h1} ->\n"
+                    f"M15 = {trend_m15} ->\n"
+                    f"M3 = {trend_m3} ->\n"
+                    f"مومنتوم = {'✓' if range_is_strong else '✗'}\n"
+                    f"HPTA = {'✓' if hpta_result else '✗'}\n"
+                    f"ناحیه: {zone}\n"
+                    f"Stop Loss: {stop_loss:.4f}\n"
+                    f"Profit Target 1: {target1:.4f}\n"
+                    f"Profit Target 2: {target2:.4f}\n"
+                    f"Profit Target 3: {target3:.4f}\n"
+                    f"قیمت فعلی: {price_str}\n"
+                    f"زمان: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+                queued = publish_signal(market, signal, risk, message)
+                if queued:
+                    logger.info("Signal %s for %s queued for %d chats!",
+                                signal,
+                                market,
+                                queued,
+                                extra={
+                                    'market': market,
+                                    'stage': 'signal',
+                                    'signal': signal,
+                                    'risk': risk
+                                })
+                    with state_lock:
+                        last_signal_time[market] = current_time
+                    metrics.signals.inc(signal=signal, risk=risk)
+                    signal_tracker.open(market, signal, risk, current_price,
+                                        stop_loss,
+                                        (target1, target2, target3))
+                else:
+                    logger.info(
+                        "Signal %s for %s not queued (duplicate or no subscribed chats).",
+                        signal,
+                        market,
+                        extra={
+                            'market': market,
+                            'stage': 'signal',
+                            'signal': signal,
+                            'risk': risk
+                        })
+                stage = 'signal'
+            else:
+                logger.info(
+                    "Signal for %s rejected due to less than %s second "
+                    "interval.",
+                    market,
+                    STRATEGY['signal_cooldown'],
+                    extra={
+                        'market': market,
+                        'stage': 'cooldown'
+                    })
+                stage = 'cooldown'
+        else:
+            stage = 'no_signal'
+        record_stage(market,
+                     stage,
+                     trend_m15=trend_m15,
+                     trend_m3=trend_m3,
+                     trend_h1=trend_h1,
+                     zone=zone,
+                     signal=signal,
+                     risk=risk)
+
+    except Exception as e:
+        error_msg = f"Error processing {market}: {str(e)}"
+        log_error(error_msg, market=market)
+        record_stage(market, 'error', error=str(e))
+    finally:
+        duration = time.perf_counter() - started
+        metrics.market_latency.observe(duration)
+        with state_lock:
+            status = market_status.setdefault(market, {})
+            status['last_scan'] = time.time()
+            status['scan_seconds'] = round(duration, 6)
+    return state_changed
+
+
+def publish_signal(market, signal, risk, message):
+    # Returns how many chats the signal was queued for
+    if signal_sink:
+        return signal_sink(market, signal, risk, message)
+    chats = subscriptions.route(market, risk)
+    return notifier.fan_out(market, signal, message, chats)
+
+
+# ================== Signal Outcomes ==================
+
+
+def follow_up_message(event):
+    signal = event['signal']
+    level = event['level']
+    if level is None:
+        icon, title, price = '⌛', 'Expired', None
+    elif level == 'stop':
+        icon, title, price = '🛑', 'Stop Loss', signal['stop']
+    else:
+        icon, title = '🎯', f"Profit Target {TARGET_LEVELS.index(level) + 1}"
+        price = signal['targets'][TARGET_LEVELS.index(level)]
+    lines = [
+        f"{icon} <b>{title}: {signal['signal']} {signal['market']}</b>",
+        f"Entry: {signal['entry']:.4f}"
+    ]
+    if price is not None:
+        lines.append(f"{title}: {price:.4f}")
+    if event['price'] is not None:
+        lines.append(f"قیمت فعلی: ${event['price']:.4f}")
+    lines.append(f"Targets hit: {len(signal['hit'])}/{len(signal['targets'])}")
+    lines.append(f"زمان: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    return '\n'.join(lines)
+
+
+def report_outcomes(events):
+    # Sends a follow-up to the chats of the signal for every stop loss,
+    # profit target or expiry the tracker reports
+    for event in events:
+        signal = event['signal']
+        level = event['level'] or event['outcome']
+        metrics.signal_levels.inc(level=level, risk=signal['risk'])
+        # The signal id keeps follow-ups of two signals apart in dedup
+        publish_signal(signal['market'],
+                       f"{signal['signal']} {level} {signal['id']}",
+                       signal['risk'], follow_up_message(event))
+        logger.info("%s signal for %s reached %s",
+                    signal['signal'],
+                    signal['market'],
+                    level,
+                    extra={
+                        'market': signal['market'],
+                        'stage': 'outcome',
+                        'signal': signal['signal'],
+                        'risk': signal['risk'],
+                        'level': level,
+                        'outcome': event['outcome']
+                    })
+
+
+def track_price(market, price):
+    # Feeds a price tick of `market` to the signal tracker
+    if price and signal_tracker.has_open(market):
+        report_outcomes(signal_tracker.update(market, price))
+
+
+# ================== Batch Mode ==================
+
+
+def batch_book(timeframe):
+    # The SwingBook of `timeframe`, created on first use
+    import batch
+
+    book = batch_books.get(timeframe)
+    if book is None:
+        book = batch_books[timeframe] = batch.SwingBook()
+    return book
+
+
+def batch_swings(markets, timeframe, klines, state, now):
+    # cached_swings for many markets. Their closed candles are stacked and
+    # the rows of the timeframe's book whose last closed candle changed are
+    # searched for pivots together; the markets that got new swings have
+    # them copied into their state. Returns the markets handled, their book
+    # rows, which rows were stale and the markets with new swings. Markets
+    # with too few candles are left to scan_market, which reports them
+    import numpy as np
+
+    import batch
+
+    stage = 'swings_' + {'15min': 'm15', '3min': 'm3'}[timeframe]
+    book = batch_book(timeframe)
+    if not markets:
+        return [], np.empty(0, dtype=np.intp), np.empty(0, dtype=bool), []
+    candles = [as_candles(klines[market]) for market in markets]
+    keys, closed, open_count = batch.last_closed(candles,
+                                                 TIMEFRAME_SECONDS[timeframe],
+                                                 now)
+    handled = closed >= 5
+    if not handled.all():
+        markets = [m for m, ok in zip(markets, handled.tolist()) if ok]
+        candles = [c for c, ok in zip(candles, handled.tolist()) if ok]
+        keys, closed, open_count = (keys[handled], closed[handled],
+                                    open_count[handled])
+    rows = book.index(markets)
+    # Rows whose market's swings were replaced since the book last saw them
+    with state_lock:
+        swings = [state[market][stage] for market in markets]
+    moved = np.fromiter(
+        (market_swings is not book.series[row]
+         for row, market_swings in zip(rows.tolist(), swings)),
+        dtype=bool,
+        count=len(markets))
+    if moved.any():
+        book.load(rows[moved], [s for s, m in zip(swings, moved) if m])
+    stale = book.keys[rows] != keys
+    stale_rows = rows[stale]
+    new = []
+    if len(stale_rows):
+        # The last `lookback` closed candles, as detect_swings searches them
+        candles = [c for c, s in zip(candles, stale.tolist()) if s]
+        length = min(STRATEGY['swing_lookback_fast'], int(closed[stale].max()))
+        times, high, low, close = batch.stack_closed(candles, length,
+                                                     open_count[stale])
+        is_high, is_low = batch.find_pivots_2d(high, low,
+                                               STRATEGY['swing_width'])
+        pivot_rows, kinds, pivot_times, prices = batch.new_pivots(
+            times, high, low, is_high, is_low, book.last_high[stale_rows],
+            book.last_low[stale_rows])
+        pivot_rows = stale_rows[pivot_rows]
+        # Pivots go into copies that replace the state's swings under the
+        # lock, as in cached_swings
+        copies = {
+            row: copy_swings(book.series[row])
+            if book.series[row] else new_swings(MAX_SWINGS)
+            for row in set(pivot_rows.tolist())
+        }
+        changed = sorted(
+            batch.apply_pivots(copies, pivot_rows, kinds, pivot_times,
+                               prices))
+        if changed:
+            new = [book.markets[row] for row in changed]
+            with state_lock:
+                for market, row in zip(new, changed):
+                    state[market][stage] = copies[row]
+            book.load(np.array(changed, dtype=np.intp),
+                      [copies[row] for row in changed])
+        book.keys[stale_rows] = keys[stale]
+        book.last_close[stale_rows] = close[:, -1]
+        book.prev_close[stale_rows] = close[:, -2]
+    return markets, rows, stale, new
+
+
+def batch_trends(book, markets, rows, timeframe):
+    # detect_trend_and_channel for the book `rows` of `markets`, whose last
+    # closed candle changed
+    import batch
+
+    book.trend[rows] = batch.classify_trends(book.prices[rows])
+    for market, row in zip(markets, rows.tolist()):
+        if not book.valid[row]:
+            swings = book.series[row] or batch.NO_SWINGS
+            error_msg = f"Insufficient swings to detect trend in {market} ({timeframe}): highs={len(swings['highs'])}, lows={len(swings['lows'])}"
+            log_error(error_msg, market=market, timeframe=timeframe)
+
+
+def batch_momentum(book, markets, rows, klines, now):
+    # calculate_range_momentum for the book `rows` of the trending M15
+    # `markets`, whose last closed candle changed
+    import numpy as np
+
+    import batch
+
+    strong = batch.range_momentum(book.prices[rows])
+    min_volume_z = STRATEGY['min_volume_z']
+    # The volume z-score decides with min_volume_z set and is reported for
+    # weak markets; scan_market reads it itself for the others. None (not
+    # enough candles yet) becomes NaN, which never passes
+    wanted = np.ones(len(rows), dtype=bool) if min_volume_z else ~strong
+    volume_z = np.full(len(rows), np.nan)
+    volume_z[wanted] = [
+        indicator_value(cached_indicators(m, '15min', klines[m], now),
+                        'volume_z')
+        for m, w in zip(markets, wanted.tolist()) if w
+    ]
+    if min_volume_z:
+        strong &= volume_z >= min_volume_z
+    book.strong[rows] = strong
+    book.volume_z[rows] = volume_z
+
+
+def batch_breakouts(book, rows, timeframe_minutes):
+    # check_channel_breakout on the last two closed candles of the book
+    # `rows` with a channel
+    import batch
+
+    book.breakout[rows] = batch.channel_breakouts(book.prices[rows],
+                                                  book.times[rows],
+                                                  book.keys[rows],
+                                                  book.last_close[rows],
+                                                  book.prev_close[rows],
+                                                  timeframe_minutes)
+
+
+def fill_stage_cache(book, markets, rows, suffix, results):
+    # Leaves the book's swings and trend of `markets`, and `results`
+    # ([(stage, result)]), in the stage cache for scan_market
+    import batch
+
+    for market, row in zip(markets, rows.tolist()):
+        key = int(book.keys[row])
+        trend = batch.TRENDS[int(book.trend[row])]
+        for stage, result in [('swings_' + suffix, book.series[row]),
+                              ('trend_' + suffix,
+                               (trend, book.channel(row), trend))] + results:
+            if not stage_cache.peek(market, stage, key)[0]:
+                stage_cache.fill(market, stage, key, result)
+
+
+def record_batch_stages(stopped, error_counts, seconds):
+    # What scan_market does for the markets the batch pass stopped, [(market,
+    # stage, fields)]: resets their error count, follows their open signals
+    # and records their stage. `seconds` is shared out among them
+    if not stopped:
+        return
+    for market, _, _ in stopped:
+        if signal_tracker.has_open(market):
+            track_price(market, get_ticker(market, retries=1))
+    now = time.time()
+    share = round(seconds / len(stopped), 6)
+    counts = {}
+    with state_lock:
+        for market, stage, fields in stopped:
+            error_counts[market] = 0
+            market_status[market] = dict(fields,
+                                         stage=stage,
+                                         last_scan=now,
+                                         scan_seconds=share)
+            counts[stage] = counts.get(stage, 0) + 1
+    for stage, count in counts.items():
+        metrics.market_stuck.inc(count, stage=stage)
+        logger.debug("Batch pass: %d markets stuck at %s", count, stage)
+
+
+def analyze_batch(markets, state, error_counts):
+    # Batch mode: fetches the candles of all `markets` and runs the swing,
+    # trend, momentum and breakout stages of scan_market for them in one
+    # pass per timeframe (see batch.py). Results stay in the timeframe's
+    # SwingBook and are only recomputed for markets whose last closed candle
+    # changed. Markets that stop at one of these stages are recorded like
+    # scan_market records them; the others get their results in the stage
+    # cache. Returns ({market: {timeframe: candles}} of the markets
+    # scan_market still has to scan, so nothing is fetched twice, and whether
+    # the swings of the stopped ones changed)
+    import numpy as np
+
+    import batch
+
+    prefetched = {market: {} for market in markets}
+    stopped = []
+    # (market, swings stage) of the new swings
+    new_swings_found = []
+    started = time.perf_counter()
+    try:
+        klines_m15 = {}
+        for market in markets:
+            klines_m15[market] = prefetched[market]['15min'] = (
+                get_klines_cached(market, '15min', 200))
+        now = server_clock.now()
+        book = batch_book('15min')
+        handled, rows, stale, new = batch_swings(
+            [m for m in markets if klines_m15[m]], '15min', klines_m15, state,
+            now)
+        new_swings_found += [(market, 'swings_m15') for market in new]
+        batch_trends(book, [m for m, s in zip(handled, stale) if s],
+                     rows[stale], '15min')
+        valid = book.valid[rows]
+        trend = book.trend[rows]
+        trending = valid & (trend != 0)
+        todo = trending & stale
+        batch_momentum(book, [m for m, t in zip(handled, todo) if t],
+                       rows[todo], klines_m15, now)
+        strong = trending & book.strong[rows]
+        volume_z = book.volume_z[rows]
+        for i in np.flatnonzero(~strong).tolist():
+            market = handled[i]
+            trend_m15 = batch.TRENDS[int(trend[i])] if valid[i] else None
+            if not trending[i]:
+                stopped.append((market, 'trend_m15', {'trend_m15': trend_m15}))
+            else:
+                stopped.append((market, 'momentum', {
+                    'trend_m15': trend_m15,
+                    'volume_z':
+                    None if np.isnan(volume_z[i]) else float(volume_z[i])
+                }))
+        strong_markets = [m for m, s in zip(handled, strong) if s]
+        fill_stage_cache(book, strong_markets, rows[strong], 'm15',
+                         [('momentum_m15', (True, 'Strong'))])
+
+        klines_m3 = {}
+        for market in strong_markets:
+            klines_m3[market] = prefetched[market]['3min'] = (
+                get_klines_cached(market, '3min', 200))
+        book_m3 = batch_book('3min')
+        handled_m3, rows_m3, stale_m3, new = batch_swings(
+            [m for m in strong_markets if klines_m3[m]], '3min', klines_m3,
+            state, now)
+        new_swings_found += [(market, 'swings_m3') for market in new]
+        batch_trends(book_m3, [m for m, s in zip(handled_m3, stale_m3) if s],
+                     rows_m3[stale_m3], '3min')
+        batch_breakouts(book_m3, rows_m3[stale_m3], 3)
+        valid = book_m3.valid[rows_m3]
+        breakout = valid & book_m3.breakout[rows_m3]
+        for i in np.flatnonzero(~valid | breakout).tolist():
+            market = handled_m3[i]
+            trend_m3 = (batch.TRENDS[int(book_m3.trend[rows_m3[i]])]
+                        if valid[i] else None)
+            stopped.append((market, 'breakout' if valid[i] else 'trend_m3', {
+                'trend_m15': batch.TRENDS[int(book.trend[book.rows[market]])],
+                'trend_m3': trend_m3
+            }))
+        passed = valid & ~breakout
+        fill_stage_cache(book_m3,
+                         [m for m, p in zip(handled_m3, passed) if p],
+                         rows_m3[passed], 'm3', [('breakout_m3', False)])
+        logger.debug("Batch analysis of %d markets (%d M15 strong, %d "
+                     "stopped) in %.3f seconds", len(markets),
+                     len(strong_markets), len(stopped),
+                     time.perf_counter() - started)
+    except Exception as e:
+        error_msg = f"Error in batch analysis: {str(e)}"
+        log_error(error_msg)
+        # Rows may be half updated; scan_market scans every market
+        batch_books.clear()
+        stopped = []
+    for market, _, _ in stopped:
+        del prefetched[market]
+    record_batch_stages(stopped, error_counts, time.perf_counter() - started)
+    state_changed = False
+    with state_lock:
+        for market, stage in new_swings_found:
+            if market in prefetched:
+                fresh_swings.add((market, stage))
+            else:
+                state_changed = True
+    return prefetched, state_changed
+
+
+def scan_markets_serial(markets, scan):
+    state_changed = False
+    for market in markets:
+        if scan(market):
+            state_changed = True
+    return state_changed
+
+
+def scan_markets_concurrent(markets, scan, max_concurrency):
+    state_changed = False
+    for market, result in scan_engine.run_scan_cycle(markets, scan,
+                                                     max_concurrency):
+        if isinstance(result, BaseException):
+            error_msg = f"Error processing {market}: {str(result)}"
+            log_error(error_msg, market=market)
+        elif result:
+            state_changed = True
+    return state_changed
+
+
+def scan_cycle(mode, markets, scan, max_concurrency, analyze=None):
+    # One pass over `markets`; returns whether any swing state changed. In
+    # batch mode `analyze` gets all of them first and returns the ones left
+    # to scan and whether it changed swings itself
+    with metrics.cycle_latency.time():
+        if mode == 'batch' and analyze:
+            markets, state_changed = analyze(markets)
+            return scan_markets_serial(markets, scan) or state_changed
+        if mode == 'concurrent':
+            return scan_markets_concurrent(markets, scan, max_concurrency)
+        return scan_markets_serial(markets, scan)
+
+
+def new_market_state():
+    return {'swings_h1': None, 'swings_m15': None, 'swings_m3': None}
+
+
+def start_notifier(digest=DIGEST_MODE):
+    # Loads the subscribers and starts the Telegram delivery workers
+    global notifier, subscriptions
+    try:
+        subscriptions = SubscriptionRegistry.load(SUBSCRIBERS_FILE, CHAT_ID)
+    except Exception as e:
+        error_msg = f"Error loading subscribers: {str(e)}. Sending signals to {CHAT_ID} only."
+        log_error(error_msg)
+        subscriptions = SubscriptionRegistry()
+        subscriptions.add(CHAT_ID)
+    notifier = Notifier(post_telegram_message,
+                        CHAT_ID,
+                        log=log_error,
+                        digest=digest,
+                        dedup_seconds=STRATEGY['signal_cooldown']).start()
+    return notifier
+
+
+def select_markets(scheduler, markets=None):
+    # The available REQUESTED_MARKETS plus the UNIVERSE_SIZE most traded
+    # markets; re-ranks the markets of `scheduler` on the way
+    if markets is None:
+        markets = check_available_markets()
+    markets = list(markets)
+    stats = get_market_stats()
+    if stats:
+        scheduler.rank(stats)
+    if UNIVERSE_SIZE:
+        if stats:
+            extra = top_markets(stats, UNIVERSE_SIZE)
+        else:
+            # Keep the current picks until the tickers can be read again
+            extra = [m for m in scheduler.markets() if m not in markets]
+        markets += [m for m in extra if m not in markets]
+    return markets
+
+
+def refresh_markets(scheduler, state, error_counts, active_markets,
+                    markets=None):
+    # Re-reads the market list and 24h tickers and adds or drops the markets
+    # that were listed or delisted; returns (added, removed)
+    added, removed = scheduler.set_markets(select_markets(scheduler, markets))
+    for market in removed:
+        with state_lock:
+            state.pop(market, None)
+            error_counts.pop(market, None)
+            if market in active_markets:
+                active_markets.remove(market)
+        stage_cache.drop(market)
+        candle_store.drop(market)
+        indicator_store.drop(market)
+    with state_lock:
+        added = [m for m in added if m not in state]
+        for market in added:
+            state[market] = new_market_state()
+            error_counts[market] = 0
+            active_markets.append(market)
+    if added:
+        warm_start(added)
+    if added or removed:
+        logger.info("Markets added: %s, removed: %s", added, removed)
+    return added, removed
+
+
+def readmit_markets(scheduler, error_counts, active_markets, now):
+    # Scans the markets dropped after MAX_ERRORS again once their backoff
+    # is over
+    readmitted = scheduler.readmit(active_markets, now)
+    for market in readmitted:
+        with state_lock:
+            error_counts[market] = 0
+            active_markets.append(market)
+        logger.info("%s re-admitted after repeated errors.",
+                    market,
+                    extra={'market': market})
+    return readmitted
+
+
+def resync_market(market):
+    import streaming
+
+    for timeframe in [streaming.STREAM_TIMEFRAME
+                      ] + streaming.DERIVED_TIMEFRAMES:
+        get_klines_cached(market, timeframe, KLINE_WINDOW)
+
+
+def start_stream(active_markets, scan, max_concurrency):
+    global stream_manager
+    import streaming
+
+    executor = ThreadPoolExecutor(max_workers=max_concurrency,
+                                  thread_name_prefix='scan')
+    running = set()
+
+    def run_scan(market):
+        try:
+            scan(market)
+        finally:
+            running.discard(market)
+
+    def on_candle_close(market, timeframe):
+        # M3 is the fastest timeframe in the pipeline, so its close is the
+        # earliest point where a new signal can appear
+        if timeframe != streaming.STREAM_TIMEFRAME:
+            return
+        if market not in active_markets or market in running:
+            return
+        running.add(market)
+        executor.submit(run_scan, market)
+
+    stream_manager = streaming.StreamManager(active_markets,
+                                             candle_store,
+                                             resync_market,
+                                             on_candle_close,
+                                             log=log_error,
+                                             on_price=track_price,
+                                             executor=executor)
+    stream_manager.start()
+    return executor
+
+
+def stop_stream(executor):
+    global stream_manager
+    if stream_manager:
+        stream_manager.stop()
+        stream_manager = None
+    executor.shutdown(wait=False)
+
+
+def announce_start():
+    # From a thread, so a slow Telegram API does not hold up the startup
+    def send():
+        if not send_telegram_message("🚀 نظارت بر ارزهای فیوچرز کوینکس شروع شد!"):
+            logger.warning(
+                "Error sending initial message to Telegram. Check token or chat ID."
+            )
+
+    threading.Thread(target=send, name='announce', daemon=True).start()
+
+
+def mark_ready(booted_at):
+    # The markets are known and the first scan can start; main.py's /ready
+    # answers 200 from here on
+    runtime.update(ready=True, ready_seconds=round(time.time() - booted_at,
+                                                   3))
+    logger.info("Ready after %.2f seconds", runtime['ready_seconds'])
+
+
+def main(mode=SCAN_MODE,
+         max_concurrency=scan_engine.MAX_CONCURRENT_MARKETS,
+         digest=DIGEST_MODE,
+         cycles=None):
+    # `cycles` stops the polling loop after that many cycles (benchmark.py)
+    setup_logging(error_log=ERROR_LOG)
+    logger.info("Starting Coinex futures monitoring (%s mode)...", mode)
+    booted_at = time.time()
+    announce_start()
 
     global MARKETS
     MARKETS = check_available_markets()
     if not MARKETS:
-        print("No valid markets found. Stopping program.")
+        logger.error("No valid markets found. Stopping program.")
         return
 
-    state = {
-        market: {
-            'swings_h1': None,
-            'swings_m15': None,
-            'swings_m3': None
-        }
-        for market in MARKETS
-    }
+    state = {market: new_market_state() for market in MARKETS}
     error_counts = {market: 0 for market in MARKETS}
-    max_errors = 5
     active_markets = MARKETS.copy()
     cycle_count = 0
+    start_notifier(digest)
+    warm_start(MARKETS)
+    restore_state(state, error_counts, active_markets)
+    # In stream mode candle closes decide when markets are scanned; the
+    # scheduler still keeps the market list current
+    scheduler = MarketScheduler(
+        adaptive=scheduler_settings.ADAPTIVE_POLLING and mode != 'stream',
+        budget=scheduler_settings.REQUEST_BUDGET)
+    refresh_markets(scheduler, state, error_counts, active_markets, MARKETS)
+    last_refresh = last_snapshot = time.time()
+    runtime.update(mode=mode,
+                   started_at=time.time(),
+                   cycles=0,
+                   state=state,
+                   error_counts=error_counts,
+                   active_markets=active_markets,
+                   scheduler=scheduler)
+    mark_ready(booted_at)
+
+    prefetched = {}
+
+    def scan(market):
+        return scan_market(market, state, error_counts, active_markets,
+                           MAX_ERRORS, prefetched.pop(market, None))
+
+    def analyze(markets):
+        prefetched.clear()
+        batched, state_changed = analyze_batch(markets, state, error_counts)
+        prefetched.update(batched)
+        return list(batched), state_changed
+
+    if mode == 'stream':
+        executor = start_stream(active_markets, scan, max_concurrency)
+        try:
+            while True:
+                time.sleep(SLEEP_SECONDS)
+                now = time.time()
+                if now - last_refresh >= UNIVERSE_REFRESH:
+                    refresh_markets(scheduler, state, error_counts,
+                                    active_markets)
+                    last_refresh = now
+                readmit_markets(scheduler, error_counts, active_markets, now)
+                report_outcomes(signal_tracker.expire())
+                with state_lock:
+                    active = list(active_markets)
+                for market in list(stream_manager.streams):
+                    if market not in active:
+                        stream_manager.remove(market)
+                for market in active:
+                    if market not in stream_manager.streams:
+                        stream_manager.add(market)
+                save_state(state, error_counts, active_markets)
+                logger.info(stage_cache.report())
+        except KeyboardInterrupt:
+            logger.info("Program stopped by user.")
+        finally:
+            stop_stream(executor)
+            save_state(state, error_counts, active_markets)
+            notifier.stop()
+        return
 
+    # Each cycle scans the markets the scheduler says are due
     while True:
         state_changed = False
         cycle_count += 1
         try:
-            for market in active_markets[:]:
-                try:
-                    print(
-                        f"\n{datetime.now().strftime('%H:%M:%S')} - {market}")
-
-                    klines_m15 = get_klines(market, '15min', 200)
-                    if not klines_m15:
-                        error_counts[market] += 1
-                        error_msg = f"M15 data for {market} not received. Error number {error_counts[market]}."
-                        print(error_msg)
-                        log_error(error_msg)
-                        if error_counts[market] >= max_errors:
-                            print(
-                                f"{market} temporarily removed from list due to repeated errors."
-                            )
-                            active_markets.remove(market)
-                        continue
-                    else:
-                        error_counts[market] = 0
-
-                    swings_m15, new_m15 = detect_swings(
-                        market, '15min', klines_m15,
-                        state[market]['swings_m15'])
-                    trend_m15, channel_m15, pattern_m15 = detect_trend_and_channel(
-                        market, '15min', swings_m15)
-                    if new_m15:
-                        state[market]['swings_m15'] = swings_m15
-                        state_changed = True
-
-                    if not trend_m15 or trend_m15 not in [
-                            'up trend', 'down trend'
-                    ]:
-                        print(
-                            f"M15 trend for {market} not detected or non-trending ({trend_m15}). Stuck at trend_m15"
-                        )
-                        continue
-
-                    range_is_strong, range_strength = calculate_range_momentum(
-                        market, '15min', swings_m15)
-                    if not range_is_strong:
-                        print("Weak momentum. Stuck at momentum")
-                        continue
-
-                    klines_m3 = get_klines(market, '3min', 200)
-                    if not klines_m3:
-                        print("M3 data not received. Continuing...")
-                        continue
-
-                    swings_m3, new_m3 = detect_swings(
-                        market, '3min', klines_m3, state[market]['swings_m3'])
-                    trend_m3, channel_m3, pattern_m3 = detect_trend_and_channel(
-                        market, '3min', swings_m3)
-                    if new_m3:
-                        state[market]['swings_m3'] = swings_m3
-                        state_changed = True
-
-                    if not trend_m3:
-                        print("M3 trend not detected. Stuck at trend_m3")
-                        continue
-
-                    if check_channel_breakout(market, '3min', klines_m3,
-                                              channel_m3, 3):
-                        print("Channel breakout in M3. Stuck at breakout")
-                        continue
-
-                    hpta_result = check_hpta(market, trend_m15, trend_m3)
-                    if not hpta_result:
-                        print("HPTA not aligned. Stuck at HPTA")
-                        continue
-
-                    current_price = get_ticker(market)
-                    algo4_pass, zone, new_swing = algo4_check(
-                        trend_m3, channel_m3, current_price,
-                        state[market]['swings_m3'])
-                    if not algo4_pass:
-                        print(
-                            f"{market}: Algo 4 condition not passed. Waiting to reach suitable zone."
-                        )
-                        continue
-
-                    if new_swing:
-                        print(
-                            f"{market}: New SH/SL detected. Re-checking algorithms..."
-                        )
-                        hpta_result = check_hpta(market, trend_m15, trend_m3)
-                        if hpta_result and new_m15:
-                            _, channel_m15, _ = detect_trend_and_channel(
-                                market, '15min', swings_m15)
-                            range_is_strong, _ = calculate_range_momentum(
-                                market, '15min', swings_m15)
-                            if not range_is_strong:
-                                print(
-                                    f"{market}: Weak momentum in M15. Not continuing."
-                                )
-                                continue
-
-                    klines_h1 = get_klines(market, '1hour', 200)
-                    trend_h1 = 'sideway'
-                    if klines_h1:
-                        swings_h1, new_h1 = detect_swings(
-                            market, '1hour', klines_h1,
-                            state[market]['swings_h1'])
-                        trend_h1_temp, channel_h1, _ = detect_trend_and_channel(
-                            market, '1hour', swings_h1)
-                        if new_h1:
-                            state[market]['swings_h1'] = swings_h1
-                            state_changed = True
-                        if trend_h1_temp:
-                            trend_h1 = trend_h1_temp
-
-                    signal, risk = None, None
-                    if trend_m15 == 'up trend' and trend_m3 == 'up trend':
-                        signal = 'Long'
-                        risk = 'Very Low' if trend_h1 == 'up trend' else 'Low' if trend_h1 == 'sideway' else 'Medium'
-                    elif trend_m15 == 'down trend' and trend_m3 == 'down trend':
-                        signal = 'Short'
-                        risk = 'Very Low' if trend_h1 == 'down trend' else 'Low' if trend_h1 == 'sideway' else 'Medium'
-
-                    if signal:
-                        current_time = time.time()
-                        if current_time - last_signal_time[market] >= 180:
-                            current_price = get_ticker(market)
-                            diameter = abs(
-                                channel_m3['resistance'][1]['price'] -
-                                channel_m3['support'][1]['price'])
-                            stop_loss = calculate_stop_loss(
-                                trend_m3, channel_m3, diameter)
-                            target1, target2, target3 = calculate_profit_targets(
-                                current_price, trend_m3, diameter, channel_m3)
-                            price_str = f"${current_price:.4f}" if current_price else "نامشخص"
-                            message = (
-                                f"🔔 <b>سیگنال {signal} برای {market}</b>\n"
-                                f"{datetime.now().strftime('%H:%M:%S')} - {market}\n"
-                                f"1H = {trend_h1} ->\n"
-                                f"M15 = {trend_m15} ->\n"
-                                f"M3 = {trend_m3} ->\n"
-                                f"مومنتوم = {'✓' if range_is_strong else '✗'}\n"
-                                f"HPTA = {'✓' if hpta_result else '✗'}\n"
-                                f"ناحیه: {zone}\n"
-                                f"Stop Loss: {stop_loss:.4f}\n"
-                                f"Profit Target 1: {target1:.4f}\n"
-                                f"Profit Target 2: {target2:.4f}\n"
-                                f"Profit Target 3: {target3:.4f}\n"
-                                f"قیمت فعلی: {price_str}\n"
-                                f"زمان: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-                            )
-                            if send_telegram_message(message):
-                                print(f"Signal {signal} for {market} sent!")
-                                last_signal_time[market] = current_time
-                            else:
-                                print(
-                                    f"Sending signal {signal} for {market} was unsuccessful."
-                                )
-                        else:
-                            print(
-                                f"Signal for {market} rejected due to less than 3 minute interval."
-                            )
-
-                except Exception as e:
-                    error_msg = f"Error processing {market}: {str(e)}"
-                    print(error_msg)
-                    log_error(error_msg)
-
-            print(f"\nWaiting {SLEEP_SECONDS} seconds until next cycle...")
-            time.sleep(SLEEP_SECONDS)
+            if time.time() - last_refresh >= UNIVERSE_REFRESH:
+                refresh_markets(scheduler, state, error_counts,
+                                active_markets)
+                last_refresh = time.time()
+            now = server_clock.now()
+            readmit_markets(scheduler, error_counts, active_markets, now)
+            due = scheduler.due(now, active_markets)
+            state_changed = scan_cycle(mode, due, scan, max_concurrency,
+                                       analyze)
+            scheduler.scanned(due, now)
+            for market in due:
+                scheduler.hint(
+                    market,
+                    market_status.get(market, {}).get('zone_distance'))
+            runtime['cycles'] = cycle_count
+            report_outcomes(signal_tracker.expire())
+            notifier.flush()
+
+            if (state_changed or time.time() - last_snapshot >=
+                    snapshot.SNAPSHOT_INTERVAL):
+                save_state(state, error_counts, active_markets)
+                last_snapshot = time.time()
+            logger.debug(stage_cache.report())
+            if cycles and cycle_count >= cycles:
+                save_state(state, error_counts, active_markets)
+                notifier.stop()
+                break
+
+            wait = scheduler.wait(server_clock.now(), active_markets)
+            logger.info("Scanned %d markets. Waiting %d seconds until next "
+                        "cycle...", len(due), wait)
+            time.sleep(wait)
 
         except KeyboardInterrupt:
-            print("\nProgram stopped by user.")
+            logger.info("Program stopped by user.")
+            save_state(state, error_counts, active_markets)
+            notifier.stop()
             break
         except Exception as e:
             error_msg = f"General error in main loop: {str(e)}"
-            print(error_msg)
             log_error(error_msg)
-            print(f"Waiting {SLEEP_SECONDS} seconds before retry...")
+            logger.info("Waiting %d seconds before retry...", SLEEP_SECONDS)
             time.sleep(SLEEP_SECONDS)
+
+
+# ================== Status ==================
+
+
+def status():
+    # JSON view of the bot for /status
+    state = runtime.get('state', {})
+    error_counts = runtime.get('error_counts', {})
+    active_markets = runtime.get('active_markets', [])
+    markets = {}
+    with state_lock:
+        for market in state:
+            swings = state[market]
+            markets[market] = dict(
+                market_status.get(market, {}),
+                active=market in active_markets,
+                errors=error_counts.get(market, 0),
+                last_signal_time=last_signal_time.get(market, 0),
+                swings={
+                    key: [len(value['highs']), len(value['lows'])]
+                    for key, value in swings.items() if value
+                })
+        active_count = len(active_markets)
+    return {
+        'mode': runtime.get('mode'),
+        'ready': runtime.get('ready', False),
+        'shards': runtime['coordinator'].status()
+        if runtime.get('coordinator') else None,
+        'started_at': runtime.get('started_at'),
+        'cycles': runtime.get('cycles', 0),
+        'active_markets': active_count,
+        'markets': markets,
+        'notifier': dict(notifier.stats, pending=notifier.pending())
+        if notifier else None,
+        'scheduler': runtime['scheduler'].stats()
+        if runtime.get('scheduler') else None,
+        'stage_cache': stage_cache.stats(),
+        'signals': signal_tracker.stats(),
+        'candle_store': dict(candle_store.stats),
+        'log_records_dropped': dropped_records(),
+        'server_clock_offset': round(server_clock.offset, 3),
+        'api': api_client.stats()
+    }
+
+
+@metrics.REGISTRY.collector
+def collect_metrics():
+    # Values other modules already count, exported at scrape time
+    active = metrics.Gauge('active_markets', 'Markets being scanned')
+    active.set(len(runtime.get('active_markets', [])))
+    cache = metrics.Counter('stage_cache_total', 'Stage cache lookups',
+                            ['stage', 'result'])
+    for stage, stat in stage_cache.stats().items():
+        cache.inc(stat['hits'], stage=stage, result='hit')
+        cache.inc(stat['misses'], stage=stage, result='miss')
+    open_signals = metrics.Gauge('open_signals',
+                                 'Sent signals still followed by the tracker')
+    open_signals.set(len(signal_tracker))
+    dropped = metrics.Counter(
+        'log_records_dropped_total',
+        'Log records dropped because the log writer fell behind')
+    dropped.inc(dropped_records())
+    collected = [active, cache, open_signals, dropped]
+    if notifier:
+        delivery = metrics.Counter('telegram_messages_total',
+                                   'Telegram deliveries by outcome',
+                                   ['outcome'])
+        for outcome, value in notifier.stats.items():
+            delivery.inc(value, outcome=outcome)
+        pending = metrics.Gauge('telegram_queue_size',
+                                'Telegram messages waiting to be sent')
+        pending.set(notifier.pending())
+        collected += [delivery, pending]
+    return collected
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Coinex futures signal bot")
+    parser.add_argument('--mode',
+                        choices=SCAN_MODES,
+                        default=SCAN_MODE,
+                        help="scan markets one by one, concurrently, on "
+                        "streamed candle closes or analyzed together")
+    parser.add_argument('--max-concurrency',
+                        type=int,
+                        default=scan_engine.MAX_CONCURRENT_MARKETS,
+                        help="maximum number of markets scanned at once")
+    parser.add_argument('--digest',
+                        action='store_true',
+                        default=DIGEST_MODE,
+                        help="send the signals of a cycle as one message")
+    # Sharding (see sharding.py)
+    parser.add_argument('--workers',
+                        type=int,
+                        default=0,
+                        help="spread the markets over this many local worker "
+                        "processes")
+    parser.add_argument('--listen',
+                        metavar='HOST:PORT',
+                        help="accept shard workers from other hosts here")
+    parser.add_argument('--coordinator',
+                        metavar='HOST:PORT',
+                        help="run as a shard worker of this coordinator")
+    parser.add_argument('--worker-id', help="name of this shard worker")
+    return parser.parse_known_args(argv)[0]
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args.mode, args.max_concurrency, args.digest)
@@ -0,0 +1,188 @@
+import threading
+import time
+
+import numpy as np
+
+from candles import Candles, as_candles
+
+# ================== Settings ==================
+TIMEFRAME_SECONDS = {
+    '1min': 60,
+    '3min': 180,
+    '5min': 300,
+    '15min': 900,
+    '30min': 1800,
+    '1hour': 3600,
+    '2hour': 7200,
+    '4hour': 14400,
+    '6hour': 21600,
+    '12hour': 43200,
+    '1day': 86400,
+    '3day': 259200,
+    '1week': 604800,
+}
+
+# Number of candles kept per (market, timeframe)
+KLINE_WINDOW = 200
+
+# Extra candles requested on a delta fetch so the last stored (still open)
+# candle is always part of the response and can be replaced in place
+DELTA_OVERLAP = 2
+
+# ================== Candle Store ==================
+
+
+def has_gap(candles, timeframe):
+    # Whether two consecutive candles are more than one timeframe apart
+    step = TIMEFRAME_SECONDS.get(timeframe)
+    if step is None or len(candles) < 2:
+        return False
+    return bool((np.diff(candles.time) > step).any())
+
+
+class CandleStore:
+    # Candles are kept columnar (see candles.py) and never changed in place:
+    # every change builds new arrays, so what get() returned stays valid
+
+    def __init__(self, window=KLINE_WINDOW):
+        self.window = window
+        self._candles = {}
+        self._live = set()
+        self._lock = threading.Lock()
+        self.stats = {'seeds': 0, 'deltas': 0, 'candles_fetched': 0}
+
+    def get(self, market, timeframe, limit=None):
+        with self._lock:
+            candles = self._candles.get((market, timeframe))
+            if not candles:
+                return None
+            return candles[-limit:] if limit else candles
+
+    def last_time(self, market, timeframe):
+        with self._lock:
+            candles = self._candles.get((market, timeframe))
+            return int(candles.time[-1]) if candles else None
+
+    def delta_limit(self, market, timeframe, limit, now=None):
+        # Number of candles to request to bring the store up to date, or
+        # None if the key has to be (re)seeded with a full fetch
+        last_time = self.last_time(market, timeframe)
+        step = TIMEFRAME_SECONDS.get(timeframe)
+        if last_time is None or step is None:
+            return None
+        with self._lock:
+            stored = len(self._candles[(market, timeframe)])
+        if stored < limit:
+            return None
+        now = time.time() if now is None else now
+        elapsed = max(0, int(now - last_time) // step)
+        delta = elapsed + DELTA_OVERLAP
+        if delta >= limit:
+            return None
+        return delta
+
+    def is_current(self, market, timeframe, now=None):
+        # True while the newest stored candle is still open, so every closed
+        # candle is stored in its final form and nothing new can be fetched
+        last_time = self.last_time(market, timeframe)
+        step = TIMEFRAME_SECONDS.get(timeframe)
+        if last_time is None or step is None:
+            return False
+        now = time.time() if now is None else now
+        return last_time + step > now
+
+    def seed(self, market, timeframe, klines, fetched=True):
+        # Copied, since `klines` may be views of memory-mapped archive files
+        candles = as_candles(klines)[-self.window:].copy()
+        with self._lock:
+            self._candles[(market, timeframe)] = candles
+            if fetched:
+                self.stats['seeds'] += 1
+                self.stats['candles_fetched'] += len(klines)
+
+    def merge(self, market, timeframe, klines):
+        # Merges candles newer than the last stored one; the last stored
+        # candle is replaced in place since it may still have been open.
+        # Returns False when the fetched candles leave a gap after the stored
+        # ones, in which case the caller has to reseed
+        if not len(klines):
+            return False
+        fresh = as_candles(klines)
+        step = TIMEFRAME_SECONDS.get(timeframe)
+        with self._lock:
+            candles = self._candles.get((market, timeframe))
+            if not candles or step is None:
+                return False
+            if fresh.time[0] > candles.time[-1] + step:
+                return False
+            self._append(market, timeframe, candles, fresh)
+            self.stats['deltas'] += 1
+            self.stats['candles_fetched'] += len(fresh)
+            return True
+
+    def _append(self, market, timeframe, candles, fresh):
+        # Stores `candles` followed by the `fresh` ones from the time of the
+        # last stored candle on, which replace it
+        last_time = candles.time[-1]
+        first = int(np.searchsorted(fresh.time, last_time))
+        fresh = fresh[first:]
+        if not len(fresh):
+            return
+        if fresh.time[0] == last_time:
+            candles = candles[:-1]
+        self._candles[(market, timeframe)] = Candles.concat(
+            (candles, fresh))[-self.window:]
+
+    def update(self, market, timeframe, kline):
+        # Applies one streamed candle. Returns the time of the candle that
+        # closed because `kline` opened a new one, otherwise None
+        with self._lock:
+            candles = self._candles.get((market, timeframe))
+            if not candles or kline['time'] < candles.time[-1]:
+                return None
+            closed_time = int(candles.time[-1])
+            self._append(market, timeframe, candles,
+                         Candles.from_klines([kline]))
+            return closed_time if kline['time'] > closed_time else None
+
+    def rebuild_bucket(self, market, source_timeframe, timeframe,
+                       bucket_time):
+        # Rebuilds the `timeframe` candle starting at `bucket_time` from the
+        # smaller `source_timeframe` candles and applies it with update()
+        step = TIMEFRAME_SECONDS[timeframe]
+        with self._lock:
+            source = self._candles.get((market, source_timeframe))
+            if not source or source.time[0] > bucket_time:
+                return None
+        first, end = np.searchsorted(source.time,
+                                     (bucket_time, bucket_time + step))
+        if first == end:
+            return None
+        return self.update(
+            market, timeframe, {
+                'time': bucket_time,
+                'open': float(source.open[first]),
+                'close': float(source.close[end - 1]),
+                'high': float(source.high[first:end].max()),
+                'low': float(source.low[first:end].min()),
+                'volume': float(source.volume[first:end].sum())
+            })
+
+    def set_live(self, market, timeframe, live=True):
+        # Live keys are kept up to date by a stream and need no REST fetch
+        with self._lock:
+            if live:
+                self._live.add((market, timeframe))
+            else:
+                self._live.discard((market, timeframe))
+
+    def is_live(self, market, timeframe):
+        return (market, timeframe) in self._live
+
+    def drop(self, market, timeframe=None):
+        with self._lock:
+            for key in list(self._candles):
+                if key[0] == market and (timeframe is None
+                                         or key[1] == timeframe):
+                    del self._candles[key]
+                    self._live.discard(key)
@@ -0,0 +1,118 @@
+import numpy as np
+
+# ================== Columnar Candles ==================
+
+# Same field order as the CoinEx kline rows
+CANDLE_FIELDS = ('time', 'open', 'close', 'high', 'low', 'volume')
+CANDLE_DTYPE = np.dtype([('time', '<i8'), ('open', '<f8'), ('close', '<f8'),
+                         ('high', '<f8'), ('low', '<f8'), ('volume', '<f8')])
+
+
+class Candles:
+    # One NumPy array per candle field instead of one dict per candle
+
+    __slots__ = CANDLE_FIELDS
+
+    def __init__(self, time, open, close, high, low, volume):
+        self.time = np.asarray(time, dtype=np.int64)
+        self.open = np.asarray(open, dtype=np.float64)
+        self.close = np.asarray(close, dtype=np.float64)
+        self.high = np.asarray(high, dtype=np.float64)
+        self.low = np.asarray(low, dtype=np.float64)
+        self.volume = np.asarray(volume, dtype=np.float64)
+
+    @classmethod
+    def from_klines(cls, klines):
+        return cls(*([k[field] for k in klines] for field in CANDLE_FIELDS))
+
+    @classmethod
+    def from_rows(cls, rows):
+        # CoinEx kline rows [time, open, close, high, low, volume, amount]
+        # with numeric strings, converted a column at a time instead of into
+        # one dict per candle
+        if not len(rows):
+            return cls(*([] for _ in CANDLE_FIELDS))
+        columns = list(zip(*rows))[:len(CANDLE_FIELDS)]
+        if len(columns) < len(CANDLE_FIELDS):
+            raise ValueError("Kline rows need time, open, close, high, low "
+                             "and volume")
+        count = len(columns[0])
+        return cls(
+            np.fromiter(map(int, columns[0]), np.int64, count),
+            *(np.fromiter(map(float, column), np.float64, count)
+              for column in columns[1:]))
+
+    @classmethod
+    def concat(cls, parts):
+        return cls(*(np.concatenate([getattr(part, field) for part in parts])
+                     for field in CANDLE_FIELDS))
+
+    @classmethod
+    def from_records(cls, records):
+        # Field views into a CANDLE_DTYPE structured array, no copy
+        return cls(*(records[field] for field in CANDLE_FIELDS))
+
+    def to_records(self):
+        records = np.empty(len(self), dtype=CANDLE_DTYPE)
+        for field in CANDLE_FIELDS:
+            records[field] = getattr(self, field)
+        return records
+
+    def copy(self):
+        return Candles(*(getattr(self, field).copy()
+                         for field in CANDLE_FIELDS))
+
+    def to_klines(self):
+        return [{
+            'time': int(t),
+            'open': float(o),
+            'close': float(c),
+            'high': float(h),
+            'low': float(l),
+            'volume': float(v)
+        } for t, o, c, h, l, v in zip(self.time, self.open, self.close,
+                                      self.high, self.low, self.volume)]
+
+    def __len__(self):
+        return len(self.time)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return Candles(*(getattr(self, field)[index]
+                             for field in CANDLE_FIELDS))
+        return {
+            field: getattr(self, field)[index].item()
+            for field in CANDLE_FIELDS
+        }
+
+
+def as_candles(klines):
+    # Candles as they are, a list of candle dicts converted
+    if isinstance(klines, Candles):
+        return klines
+    return Candles.from_klines(klines)
+
+
+def resample(candles, step):
+    # Aggregates candles into `step`-second buckets (e.g. M3 into M15)
+    if not len(candles):
+        return candles
+    buckets = candles.time - candles.time % step
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(candles)] - 1
+    return Candles(buckets[starts], candles.open[starts], candles.close[ends],
+                   np.maximum.reduceat(candles.high, starts),
+                   np.minimum.reduceat(candles.low, starts),
+                   np.add.reduceat(candles.volume, starts))
+
+
+def synthetic_candles(count, seed=0, step=180, start_time=1700000000):
+    # Random-walk candles for benchmarks and offline backtests
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.002, count)))
+    open_ = np.concatenate((close[:1], close[:-1]))
+    high = np.maximum(open_, close) * (1 + rng.random(count) * 0.001)
+    low = np.minimum(open_, close) * (1 - rng.random(count) * 0.001)
+    volume = rng.random(count) * 1000
+    times = start_time + step * np.arange(count, dtype=np.int64)
+    return Candles(times, open_, close, high, low, volume)
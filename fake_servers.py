@@ -0,0 +1,532 @@
+import base64
+import hashlib
+import json
+import math
+import random
+import socket
+import socketserver
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from candle_store import TIMEFRAME_SECONDS
+
+# Local stand-ins for the CoinEx REST/websocket APIs and the Telegram Bot
+# API so the bot can be run and exercised offline:
+#
+#   server = FakeCoinexServer(['BTCUSDT', 'ETHUSDT']).start()
+#   bot_code.COINEX_BASE_URL = server.rest_url
+#   streaming.COINEX_WS_URL = server.ws_url
+#   telegram = FakeTelegramServer(bot_code.TELEGRAM_TOKEN).start()
+#   bot_code.TELEGRAM_BASE_URL = telegram.url
+
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+BASE_TIMEFRAME = '3min'
+
+# ================== Candle Data ==================
+
+
+def generate_rows(market, count, end_time, step=180, seed=None):
+    # Deterministic random walk in CoinEx kline row format:
+    # [time, open, close, high, low, volume, amount]
+    rng = random.Random(seed if seed is not None else market)
+    price = 10 + rng.random() * 100
+    start = end_time - end_time % step - step * (count - 1)
+    rows = []
+    for i in range(count):
+        wave = math.sin(i / (5 + rng.random())) * price * 0.002
+        open_price = price
+        close_price = max(0.0001,
+                          price + wave + rng.gauss(0, price * 0.0015))
+        high = max(open_price, close_price) * (1 + rng.random() * 0.001)
+        low = min(open_price, close_price) * (1 - rng.random() * 0.001)
+        volume = rng.random() * 1000
+        rows.append([
+            start + i * step,
+            f"{open_price:.6f}", f"{close_price:.6f}", f"{high:.6f}",
+            f"{low:.6f}", f"{volume:.4f}", f"{volume * close_price:.4f}"
+        ])
+        price = close_price
+    return rows
+
+
+def aggregate_rows(rows, step):
+    buckets = {}
+    for row in rows:
+        bucket = row[0] - row[0] % step
+        candle = buckets.get(bucket)
+        if candle is None:
+            buckets[bucket] = [
+                bucket, row[1], row[2], row[3], row[4],
+                float(row[5]),
+                float(row[6])
+            ]
+        else:
+            candle[2] = row[2]
+            candle[3] = max(candle[3], row[3], key=float)
+            candle[4] = min(candle[4], row[4], key=float)
+            candle[5] += float(row[5])
+            candle[6] += float(row[6])
+    return [[c[0], c[1], c[2], c[3], c[4],
+             str(c[5]), str(c[6])] for c in sorted(buckets.values())]
+
+
+# ================== WebSocket Framing ==================
+
+
+def _recv_exact(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('connection closed')
+        data += chunk
+    return data
+
+
+def read_frame(sock):
+    first, second = _recv_exact(sock, 2)
+    opcode = first & 0x0F
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack('>H', _recv_exact(sock, 2))[0]
+    elif length == 127:
+        length = struct.unpack('>Q', _recv_exact(sock, 8))[0]
+    mask = _recv_exact(sock, 4) if second & 0x80 else None
+    payload = _recv_exact(sock, length)
+    if mask:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return opcode, payload
+
+
+def write_frame(sock, payload, opcode=0x1):
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    header = bytes([0x80 | opcode])
+    if len(payload) < 126:
+        header += bytes([len(payload)])
+    elif len(payload) < 65536:
+        header += bytes([126]) + struct.pack('>H', len(payload))
+    else:
+        header += bytes([127]) + struct.pack('>Q', len(payload))
+    sock.sendall(header + payload)
+
+
+# ================== Fake CoinEx ==================
+
+
+class _RestHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        fake = self.server.fake
+        parts = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        fake.requests.append((parts.path, query))
+        if parts.path.endswith('/market/list'):
+            body = {
+                'code': 0,
+                'data': [{
+                    'name': market
+                } for market in fake.markets]
+            }
+        elif parts.path.endswith('/market/kline'):
+            rows = fake.klines(query.get('market'), query.get('type'),
+                               int(query.get('limit', 200)))
+            body = ({
+                'code': 0,
+                'data': rows
+            } if rows is not None else {
+                'code': 2,
+                'message': 'invalid argument'
+            })
+        elif parts.path.endswith('/market/ticker/all'):
+            body = {
+                'code': 0,
+                'data': {
+                    'date': int(time.time() * 1000),
+                    'ticker': fake.tickers()
+                }
+            }
+        elif parts.path.endswith('/market/ticker'):
+            price = fake.last_price(query.get('market'))
+            body = ({
+                'code': 0,
+                'data': {
+                    'date': int(time.time() * 1000),
+                    'ticker': {
+                        'last': str(price)
+                    }
+                }
+            } if price is not None else {
+                'code': 2,
+                'message': 'invalid argument'
+            })
+        else:
+            self.send_error(404)
+            return
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class _WsHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        fake = self.server.fake
+        sock = self.request
+        request = b''
+        while b'\r\n\r\n' not in request:
+            chunk = sock.recv(4096)
+            if not chunk:
+                return
+            request += chunk
+        headers = {}
+        for line in request.decode('latin-1').split('\r\n')[1:]:
+            if ':' in line:
+                key, value = line.split(':', 1)
+                headers[key.strip().lower()] = value.strip()
+        accept = base64.b64encode(
+            hashlib.sha1((headers.get('sec-websocket-key', '') +
+                          WS_GUID).encode()).digest()).decode()
+        sock.sendall(('HTTP/1.1 101 Switching Protocols\r\n'
+                      'Upgrade: websocket\r\n'
+                      'Connection: Upgrade\r\n'
+                      f'Sec-WebSocket-Accept: {accept}\r\n\r\n').encode())
+        # Market of the kline subscription and markets of the deals one
+        connection = {
+            'sock': sock,
+            'lock': threading.Lock(),
+            'markets': set(),
+            'deals': set()
+        }
+        with fake.lock:
+            fake.connections.append(connection)
+        try:
+            while True:
+                opcode, payload = read_frame(sock)
+                if opcode == 0x8:
+                    with connection['lock']:
+                        write_frame(sock, payload[:2], 0x8)
+                    return
+                if opcode == 0x9:
+                    with connection['lock']:
+                        write_frame(sock, payload, 0xA)
+                    continue
+                if opcode != 0x1:
+                    continue
+                message = json.loads(payload.decode('utf-8'))
+                fake.ws_messages.append(message)
+                method = message.get('method')
+                if method == 'kline.subscribe':
+                    # Like CoinEx, a connection has one kline subscription
+                    connection['markets'] = {message['params'][0]}
+                    result = {'status': 'success'}
+                elif method == 'deals.subscribe':
+                    # Replaces the markets of the last deals.subscribe
+                    connection['deals'] = set(message['params'])
+                    result = {'status': 'success'}
+                elif method == 'server.ping':
+                    result = 'pong'
+                else:
+                    result = None
+                with connection['lock']:
+                    write_frame(
+                        sock,
+                        json.dumps({
+                            'error': None,
+                            'result': result,
+                            'id': message.get('id')
+                        }))
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            with fake.lock:
+                if connection in fake.connections:
+                    fake.connections.remove(connection)
+
+
+class FakeCoinexServer:
+    # `recorded` gives {market: {timeframe: rows}} to serve instead of the
+    # generated candles (see benchmark.py fixtures); its M3 rows are the ones
+    # push_kline updates
+
+    def __init__(self,
+                 markets,
+                 candles=4000,
+                 end_time=None,
+                 host='127.0.0.1',
+                 recorded=None):
+        self.markets = list(markets)
+        self.host = host
+        self.recorded = recorded or {}
+        end_time = int(time.time()) if end_time is None else end_time
+        step = TIMEFRAME_SECONDS[BASE_TIMEFRAME]
+        self.rows = {
+            market: (list(self.recorded[market][BASE_TIMEFRAME])
+                     if market in self.recorded else generate_rows(
+                         market, candles, end_time, step))
+            for market in self.markets
+        }
+        # Aggregated rows per (market, timeframe) until the next push_kline
+        self._aggregates = {}
+        self.lock = threading.Lock()
+        self.connections = []
+        self.requests = []
+        self.ws_messages = []
+        self._rest = None
+        self._ws = None
+
+    @property
+    def rest_url(self):
+        return f"http://{self.host}:{self._rest.server_address[1]}"
+
+    @property
+    def ws_url(self):
+        return f"ws://{self.host}:{self._ws.server_address[1]}/"
+
+    def start(self):
+        self._rest = ThreadingHTTPServer((self.host, 0), _RestHandler)
+        self._rest.daemon_threads = True
+        self._rest.fake = self
+        self._ws = socketserver.ThreadingTCPServer((self.host, 0), _WsHandler)
+        self._ws.daemon_threads = True
+        self._ws.fake = self
+        for server in (self._rest, self._ws):
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.drop_connections()
+        for server in (self._rest, self._ws):
+            if server:
+                server.shutdown()
+                server.server_close()
+
+    def klines(self, market, timeframe, limit):
+        if market not in self.rows or timeframe not in TIMEFRAME_SECONDS:
+            return None
+        if timeframe == BASE_TIMEFRAME:
+            with self.lock:
+                return self.rows[market][-limit:]
+        recorded = self.recorded.get(market, {}).get(timeframe)
+        if recorded is not None:
+            return recorded[-limit:]
+        with self.lock:
+            rows = self._aggregates.get((market, timeframe))
+            if rows is None:
+                rows = aggregate_rows(self.rows[market],
+                                      TIMEFRAME_SECONDS[timeframe])
+                self._aggregates[(market, timeframe)] = rows
+        return rows[-limit:]
+
+    def last_price(self, market):
+        if market not in self.rows:
+            return None
+        return float(self.rows[market][-1][2])
+
+    def tickers(self, count=480):
+        # /market/ticker/all entries over the last `count` M3 candles (24h)
+        tickers = {}
+        with self.lock:
+            for market in self.markets:
+                rows = self.rows[market][-count:]
+                volume = sum(float(row[5]) for row in rows)
+                tickers[market] = {
+                    'last': rows[-1][2],
+                    'high': str(max(float(row[3]) for row in rows)),
+                    'low': str(min(float(row[4]) for row in rows)),
+                    'vol': str(volume),
+                    'deal': str(sum(float(row[6]) for row in rows))
+                }
+        return tickers
+
+    def push_kline(self, market, row):
+        # Updates the REST data and streams the candle to subscribers
+        with self.lock:
+            rows = self.rows[market]
+            if rows and rows[-1][0] == row[0]:
+                rows[-1] = row
+            else:
+                rows.append(row)
+            for timeframe in TIMEFRAME_SECONDS:
+                self._aggregates.pop((market, timeframe), None)
+        # Streamed rows carry the market as their 8th field
+        self._broadcast(market, {
+            'method': 'kline.update',
+            'params': [list(row[:7]) + [market]],
+            'id': None
+        })
+
+    def push_deal(self, market, price):
+        self._broadcast(
+            market, {
+                'method':
+                'deals.update',
+                'params': [
+                    market,
+                    [{
+                        'id': int(time.time() * 1000),
+                        'time': time.time(),
+                        'price': str(price),
+                        'amount': '1',
+                        'type': 'buy'
+                    }]
+                ],
+                'id':
+                None
+            }, 'deals')
+
+    def _broadcast(self, market, message, subscription='markets'):
+        payload = json.dumps(message)
+        with self.lock:
+            connections = [
+                c for c in self.connections if market in c[subscription]
+            ]
+        for connection in connections:
+            try:
+                with connection['lock']:
+                    write_frame(connection['sock'], payload)
+            except OSError:
+                pass
+
+    def drop_connections(self):
+        # Simulates a network failure by killing every open websocket
+        with self.lock:
+            connections = list(self.connections)
+        for connection in connections:
+            try:
+                connection['sock'].shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+# ================== Fake Telegram ==================
+
+ERROR_DESCRIPTIONS = {
+    400: 'Bad Request',
+    403: 'Forbidden',
+    429: 'Too Many Requests',
+    500: 'Internal Server Error',
+    502: 'Bad Gateway',
+}
+
+
+class _TelegramHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def _handle(self):
+        fake = self.server.fake
+        parts = urlsplit(self.path)
+        params = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            body = self.rfile.read(length).decode('utf-8')
+            if self.headers.get('Content-Type', '').startswith(
+                    'application/json'):
+                params.update(json.loads(body))
+            else:
+                params.update(
+                    {k: v[0]
+                     for k, v in parse_qs(body).items()})
+        token, _, method = parts.path.lstrip('/').partition('/')
+        if fake.delay:
+            time.sleep(fake.delay)
+        with fake.lock:
+            failure = fake.failures.pop(0) if fake.failures else None
+            if (failure is None and token == f"bot{fake.token}"
+                    and method == 'sendMessage'):
+                message_id = len(fake.messages) + 1
+                fake.messages.append(dict(params, message_id=message_id))
+        if token != f"bot{fake.token}":
+            status, body = 401, {
+                'ok': False,
+                'error_code': 401,
+                'description': 'Unauthorized'
+            }
+        elif method != 'sendMessage':
+            status, body = 404, {
+                'ok': False,
+                'error_code': 404,
+                'description': 'Not Found'
+            }
+        elif failure is not None:
+            status, retry_after = failure
+            body = {
+                'ok': False,
+                'error_code': status,
+                'description': ERROR_DESCRIPTIONS.get(status, 'Error')
+            }
+            if retry_after is not None:
+                body['parameters'] = {'retry_after': retry_after}
+        else:
+            status, body = 200, {
+                'ok': True,
+                'result': {
+                    'message_id': message_id,
+                    'chat': {
+                        'id': params.get('chat_id')
+                    },
+                    'text': params.get('text')
+                }
+            }
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class FakeTelegramServer:
+    # Bot API sendMessage endpoint that records every delivered message:
+    #
+    #   telegram = FakeTelegramServer('TOKEN').start()
+    #   bot_code.TELEGRAM_BASE_URL = telegram.url
+    #   telegram.fail(2, status=429, retry_after=1)
+
+    def __init__(self, token, host='127.0.0.1', delay=0.0):
+        self.token = token
+        self.host = host
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.messages = []
+        self.failures = []
+        self._server = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self._server.server_address[1]}"
+
+    def start(self):
+        self._server = ThreadingHTTPServer((self.host, 0), _TelegramHandler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        threading.Thread(target=self._server.serve_forever,
+                         daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def fail(self, count, status=429, retry_after=None):
+        # The next `count` sendMessage calls fail with `status`
+        with self.lock:
+            self.failures.extend([(status, retry_after)] * count)
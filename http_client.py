@@ -0,0 +1,361 @@
+import collections
+import json
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+# orjson decodes API responses several times faster when it is installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# ================== Settings ==================
+COINEX_BASE_URL = os.environ.get('COINEX_BASE_URL', 'https://api.coinex.com')
+TELEGRAM_BASE_URL = os.environ.get('TELEGRAM_BASE_URL',
+                                   'https://api.telegram.org')
+
+# Requests per second and burst size for each (host, endpoint group). A
+# group is a path prefix; a request counts against the longest one its path
+# starts with, and paths in no group are not limited. CoinEx limits each
+# group of its API separately (20 requests/second per IP on the perpetual
+# market endpoints), Telegram allows about 30 messages/second per bot
+RATE_LIMITS = {
+    ('api.coinex.com', '/perpetual/v1/market/'): (20, 20),
+    ('api.telegram.org', '/'): (30, 30),
+}
+
+# Maximum number of requests in flight at the same time for each host
+HOST_LIMITS = {
+    'api.coinex.com': 8,
+    'api.telegram.org': 4,
+}
+DEFAULT_HOST_LIMIT = 4
+
+POOL_SIZE = 16
+REQUEST_TIMEOUT = 10
+
+# Exponential backoff with full jitter: sleep uniform(0, min(cap, base * 2^n))
+BACKOFF_BASE = 1
+BACKOFF_CAP = 30
+# Transport errors (resets, timeouts) in a row to a host before it is
+# paused; a single one is left to the caller's own backoff()
+TRANSPORT_ERROR_LIMIT = 3
+
+# Recent Date headers the server clock offset is the median of
+CLOCK_SAMPLES = 31
+
+# ================== JSON ==================
+
+
+def json_loads(data):
+    # bytes or str -> Python objects, with orjson when available
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def decode_json(response):
+    # response.json() through json_loads
+    return json_loads(response.content)
+
+
+# ================== Token Bucket ==================
+
+
+class TokenBucket:
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        # Takes `tokens` and returns 0 if they are available, otherwise
+        # takes nothing and returns the seconds until they will be
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        # Blocks the calling thread until `tokens` are available and returns
+        # the time spent waiting
+        waited = 0.0
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+
+# ================== Server Clock ==================
+
+
+class ServerClock:
+    # Offset of an API server's clock from ours, estimated from the Date
+    # header of its responses. The header only has whole seconds, so each
+    # sample is taken as the middle of its second and the median of the
+    # recent samples is used
+
+    def __init__(self, samples=CLOCK_SAMPLES):
+        self.offset = 0.0
+        self._samples = collections.deque(maxlen=samples)
+        self._lock = threading.Lock()
+
+    def observe(self, server_time, sent, received):
+        with self._lock:
+            self._samples.append(server_time + 0.5 - (sent + received) / 2)
+            ordered = sorted(self._samples)
+            self.offset = ordered[len(ordered) // 2]
+
+    def observe_response(self, response, sent, received):
+        date = response.headers.get('Date')
+        if not date:
+            return
+        try:
+            server_time = parsedate_to_datetime(date).timestamp()
+        except (TypeError, ValueError):
+            return
+        self.observe(server_time, sent, received)
+
+    def now(self):
+        return time.time() + self.offset
+
+
+# ================== HTTP Client ==================
+
+
+def retry_after(response):
+    # Seconds from a Retry-After header, or None without a usable one
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at - time.time())
+
+
+class HttpClient:
+
+    def __init__(self,
+                 rate_limits=None,
+                 host_limits=None,
+                 pool_size=POOL_SIZE,
+                 timeout=REQUEST_TIMEOUT,
+                 clock=None,
+                 clock_host=None):
+        self.rate_limits = RATE_LIMITS if rate_limits is None else rate_limits
+        self.host_limits = HOST_LIMITS if host_limits is None else host_limits
+        self.pool_size = pool_size
+        self.timeout = timeout
+        # `clock` (a ServerClock) learns from the responses of `clock_host`
+        self.clock = clock
+        self.clock_host = clock_host or urlsplit(COINEX_BASE_URL).hostname
+        self._sessions = {}
+        self._limiters = {}
+        self._slots = {}
+        # Host -> monotonic time its requests are paused until, and how many
+        # requests to it failed in a row. Only rate limiting, server errors
+        # and TRANSPORT_ERROR_LIMIT transport errors in a row pause a host
+        self._paused = {}
+        self._failures = {}
+        self._transport_errors = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _session(self, host):
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1,
+                                      pool_maxsize=self.pool_size)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._sessions[host] = session
+            return session
+
+    def _limiter(self, host, path):
+        # Token bucket of the endpoint group of `path`, None if it has none
+        group = None
+        for key in self.rate_limits:
+            if key[0] == host and path.startswith(key[1]) and (
+                    group is None or len(key[1]) > len(group[1])):
+                group = key
+        if group is None:
+            return None
+        with self._lock:
+            limiter = self._limiters.get(group)
+            if limiter is None:
+                limiter = TokenBucket(*self.rate_limits[group])
+                self._limiters[group] = limiter
+            return limiter
+
+    def _slot(self, host):
+        # Semaphore bounding the requests in flight to `host`; a request
+        # waiting for it blocks only its own caller
+        with self._lock:
+            slot = self._slots.get(host)
+            if slot is None:
+                slot = threading.BoundedSemaphore(
+                    self.host_limits.get(host, DEFAULT_HOST_LIMIT))
+                self._slots[host] = slot
+            return slot
+
+    def _endpoint_stats(self, endpoint):
+        stats = self._stats.get(endpoint)
+        if stats is None:
+            stats = self._stats.setdefault(
+                endpoint, {
+                    'requests': 0,
+                    'errors': 0,
+                    'retries': 0,
+                    'throttled': 0,
+                    'latency_total': 0.0,
+                    'latency_max': 0.0,
+                    'wait_total': 0.0,
+                })
+        return stats
+
+    def request(self, method, url, **kwargs):
+        parts = urlsplit(url)
+        endpoint = kwargs.pop('endpoint', None) or parts.path
+        kwargs.setdefault('timeout', self.timeout)
+        limiter = self._limiter(parts.hostname, parts.path)
+        # Waits for the host's backoff and a token before taking one of its
+        # request slots, so a throttled request never holds a slot idle
+        waited = self._wait_paused(parts.hostname)
+        waited += limiter.acquire() if limiter else 0.0
+        with self._slot(parts.hostname):
+            start = time.perf_counter()
+            sent = time.time()
+            try:
+                response = self._session(parts.hostname).request(
+                    method, url, **kwargs)
+            except Exception:
+                self._record(endpoint, time.perf_counter() - start, waited,
+                             error=True)
+                metrics.api_responses.inc(endpoint=endpoint, status='error')
+                self._transport_failed(parts.hostname)
+                raise
+        latency = time.perf_counter() - start
+        with self._lock:
+            self._transport_errors.pop(parts.hostname, None)
+        if self.clock and parts.hostname == self.clock_host:
+            self.clock.observe_response(response, sent, sent + latency)
+        if response.status_code == 429 or response.status_code >= 500:
+            self._host_failed(parts.hostname, retry_after(response))
+        else:
+            self._host_ok(parts.hostname)
+        self._record(endpoint,
+                     latency,
+                     waited,
+                     error=response.status_code >= 400,
+                     throttled=response.status_code == 429)
+        metrics.api_latency.observe(latency, endpoint=endpoint)
+        metrics.api_responses.inc(endpoint=endpoint,
+                                  status=response.status_code)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def _record(self, endpoint, latency, waited, error=False,
+                throttled=False):
+        with self._lock:
+            stats = self._endpoint_stats(endpoint)
+            stats['requests'] += 1
+            stats['latency_total'] += latency
+            stats['latency_max'] = max(stats['latency_max'], latency)
+            stats['wait_total'] += waited
+            if error:
+                stats['errors'] += 1
+            if throttled:
+                stats['throttled'] += 1
+
+    def _wait_paused(self, host):
+        with self._lock:
+            wait = self._paused.get(host, 0.0) - time.monotonic()
+        if wait <= 0:
+            return 0.0
+        time.sleep(wait)
+        return wait
+
+    def _host_failed(self, host, delay=None):
+        # The host is overloaded or unreachable: every request to it waits
+        # out a jittered pause that grows with its failures in a row, or the
+        # Retry-After it sent
+        with self._lock:
+            failures = self._failures.get(host, 0)
+            self._failures[host] = failures + 1
+            if delay is None:
+                delay = random.uniform(
+                    0, min(BACKOFF_CAP, BACKOFF_BASE * (2**failures)))
+            self._paused[host] = max(self._paused.get(host, 0.0),
+                                     time.monotonic() + delay)
+
+    def _transport_failed(self, host):
+        # One reset or timeout is the caller's to retry; only a host that
+        # keeps failing this way is paused
+        with self._lock:
+            errors = self._transport_errors.get(host, 0) + 1
+            self._transport_errors[host] = errors
+        if errors >= TRANSPORT_ERROR_LIMIT:
+            self._host_failed(host)
+
+    def _host_ok(self, host):
+        with self._lock:
+            self._failures.pop(host, None)
+
+    def backoff(self, attempt, endpoint, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+        # Sleeps only the calling market's thread; returns the delay used
+        delay = random.uniform(0, min(cap, base * (2**attempt)))
+        with self._lock:
+            self._endpoint_stats(endpoint)['retries'] += 1
+        time.sleep(delay)
+        return delay
+
+    def stats(self):
+        with self._lock:
+            snapshot = {}
+            for endpoint, stats in self._stats.items():
+                stats = dict(stats)
+                stats['latency_avg'] = (stats['latency_total'] /
+                                        stats['requests']
+                                        if stats['requests'] else 0.0)
+                snapshot[endpoint] = stats
+            return snapshot
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
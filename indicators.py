@@ -0,0 +1,359 @@
+import math
+import threading
+from collections import deque
+
+import numpy as np
+
+from candle_store import TIMEFRAME_SECONDS
+from candles import Candles
+
+# Technical indicators in two forms with the same results:
+#   - incremental: one object per indicator, update() takes the next candle
+#     and costs O(1), for the live bot
+#   - batch: one NumPy pass over whole arrays, for backtests
+#
+# Definitions (tests/test_indicators.py checks them against pandas):
+#   ema            close.ewm(span=period, adjust=False).mean()
+#   atr            true range .ewm(alpha=1/period, adjust=False).mean(), the
+#                  first true range being high - low
+#   rsi            Wilder's RSI, 100 * avg_gain / (avg_gain + avg_loss) with
+#                  both averages .ewm(alpha=1/period, adjust=False) of the
+#                  close changes; NaN for the first candle, 50 when flat
+#   volume_zscore  (volume - rolling mean) / rolling std (ddof=1); 0 when
+#                  the std is 0
+#   channel_width  (rolling max high - rolling min low) / close
+# Rolling indicators are NaN until `period` candles were seen.
+
+# ================== Settings ==================
+PERIODS = {
+    'ema_fast': 20,
+    'ema_slow': 50,
+    'atr': 14,
+    'rsi': 14,
+    'volume_z': 20,
+    'channel_width': 20,
+}
+# Batch EMAs are computed in blocks whose weights stay below e**EWM_BLOCK_LOG
+EWM_BLOCK_LOG = 50
+
+NAN = float('nan')
+
+# ================== Incremental ==================
+
+
+class EMA:
+    __slots__ = ('alpha', 'value')
+
+    def __init__(self, period=None, alpha=None):
+        self.alpha = alpha if alpha is not None else 2 / (period + 1)
+        self.value = None
+
+    def update(self, x):
+        if self.value is None:
+            self.value = x
+        else:
+            self.value = (1 - self.alpha) * self.value + self.alpha * x
+        return self.value
+
+
+class ATR:
+    __slots__ = ('_average', '_prev_close', 'value')
+
+    def __init__(self, period=PERIODS['atr']):
+        self._average = EMA(alpha=1 / period)
+        self._prev_close = None
+        self.value = NAN
+
+    def update(self, high, low, close):
+        true_range = high - low
+        if self._prev_close is not None:
+            true_range = max(true_range, abs(high - self._prev_close),
+                             abs(low - self._prev_close))
+        self._prev_close = close
+        self.value = self._average.update(true_range)
+        return self.value
+
+
+class RSI:
+    __slots__ = ('_gain', '_loss', '_prev_close', 'value')
+
+    def __init__(self, period=PERIODS['rsi']):
+        self._gain = EMA(alpha=1 / period)
+        self._loss = EMA(alpha=1 / period)
+        self._prev_close = None
+        self.value = NAN
+
+    def update(self, close):
+        if self._prev_close is not None:
+            change = close - self._prev_close
+            gain = self._gain.update(max(change, 0.0))
+            loss = self._loss.update(max(-change, 0.0))
+            self.value = 100 * gain / (gain + loss) if gain + loss else 50.0
+        self._prev_close = close
+        return self.value
+
+
+class VolumeZScore:
+    # Rolling mean and variance updated as one value enters the window and
+    # the oldest leaves (Welford's method, so no sums of squares to cancel)
+    __slots__ = ('period', '_window', '_mean', '_m2', 'value')
+
+    def __init__(self, period=PERIODS['volume_z']):
+        self.period = period
+        self._window = deque()
+        self._mean = 0.0
+        self._m2 = 0.0
+        self.value = NAN
+
+    def update(self, volume):
+        self._window.append(volume)
+        if len(self._window) > self.period:
+            old = self._window.popleft()
+            old_mean = self._mean
+            self._mean += (volume - old) / self.period
+            self._m2 += (volume - old) * (volume - self._mean + old -
+                                          old_mean)
+        else:
+            delta = volume - self._mean
+            self._mean += delta / len(self._window)
+            self._m2 += delta * (volume - self._mean)
+        if len(self._window) < self.period:
+            return self.value
+        std = math.sqrt(max(self._m2, 0.0) / (self.period - 1))
+        self.value = (volume - self._mean) / std if std > 0 else 0.0
+        return self.value
+
+
+class ChannelWidth:
+    # Rolling max/min kept in monotonic queues, amortized O(1) per candle
+    __slots__ = ('period', '_highs', '_lows', '_count', 'value')
+
+    def __init__(self, period=PERIODS['channel_width']):
+        self.period = period
+        self._highs = deque()
+        self._lows = deque()
+        self._count = 0
+        self.value = NAN
+
+    def update(self, high, low, close):
+        index = self._count
+        self._count += 1
+        while self._highs and self._highs[-1][1] <= high:
+            self._highs.pop()
+        self._highs.append((index, high))
+        while self._lows and self._lows[-1][1] >= low:
+            self._lows.pop()
+        self._lows.append((index, low))
+        start = index - self.period + 1
+        if self._highs[0][0] < start:
+            self._highs.popleft()
+        if self._lows[0][0] < start:
+            self._lows.popleft()
+        if self._count >= self.period:
+            self.value = (self._highs[0][1] - self._lows[0][1]) / close
+        return self.value
+
+
+class IndicatorSet:
+    # Every indicator of one market and timeframe, fed candle by candle
+
+    def __init__(self, periods=PERIODS):
+        self.ema_fast = EMA(periods['ema_fast'])
+        self.ema_slow = EMA(periods['ema_slow'])
+        self.atr = ATR(periods['atr'])
+        self.rsi = RSI(periods['rsi'])
+        self.volume_z = VolumeZScore(periods['volume_z'])
+        self.channel_width = ChannelWidth(periods['channel_width'])
+        self.time = None
+        self.count = 0
+
+    def update(self, candle):
+        high, low, close = candle['high'], candle['low'], candle['close']
+        self.ema_fast.update(close)
+        self.ema_slow.update(close)
+        self.atr.update(high, low, close)
+        self.rsi.update(close)
+        self.volume_z.update(candle['volume'])
+        self.channel_width.update(high, low, close)
+        self.time = candle['time']
+        self.count += 1
+
+    def values(self):
+        return {
+            'ema_fast': self.ema_fast.value,
+            'ema_slow': self.ema_slow.value,
+            'atr': self.atr.value,
+            'rsi': self.rsi.value,
+            'volume_z': self.volume_z.value,
+            'channel_width': self.channel_width.value
+        }
+
+
+class IndicatorStore:
+    # IndicatorSets per (market, timeframe), fed the closed candles of the
+    # candle store as they appear
+
+    def __init__(self, periods=PERIODS):
+        self.periods = periods
+        self._sets = {}
+        self._lock = threading.Lock()
+
+    def update(self, market, timeframe, klines):
+        # `klines` are closed candles (dicts or Candles), oldest first. Feeds
+        # the ones newer than the last fed candle and returns the latest
+        # values; starts over from `klines` when they no longer join up with
+        # what was fed
+        key = (market, timeframe)
+        with self._lock:
+            indicators = self._sets.get(key)
+        if not klines:
+            return indicators.values() if indicators else None
+        step = TIMEFRAME_SECONDS.get(timeframe, 0)
+        if (indicators is None or indicators.time is None
+                or klines[0]['time'] > indicators.time + step
+                or klines[-1]['time'] < indicators.time):
+            indicators = IndicatorSet(self.periods)
+            first = 0
+        else:
+            first = len(klines)
+            while first and klines[first - 1]['time'] > indicators.time:
+                first -= 1
+        fresh = klines[first:]
+        if isinstance(fresh, Candles):
+            fresh = fresh.to_klines()
+        for candle in fresh:
+            indicators.update(candle)
+        with self._lock:
+            self._sets[key] = indicators
+        return indicators.values()
+
+    def drop(self, market):
+        with self._lock:
+            for key in list(self._sets):
+                if key[0] == market:
+                    del self._sets[key]
+
+
+# ================== Batch ==================
+
+
+def ewm(values, alpha):
+    # y[0] = x[0], y[t] = (1 - alpha) * y[t - 1] + alpha * x[t], without a
+    # Python loop per value: inside a block y is a cumulative sum of
+    # decay-weighted values, and blocks are short enough for the weights
+    # to stay finite
+    values = np.asarray(values, dtype=np.float64)
+    out = np.empty_like(values)
+    if not len(values):
+        return out
+    decay = 1 - alpha
+    out[0] = values[0]
+    if decay <= 0:
+        out[1:] = values[1:]
+        return out
+    block = max(1, int(EWM_BLOCK_LOG / -math.log(decay)))
+    powers = decay**np.arange(1, block + 1)
+    carry = values[0]
+    start = 1
+    while start < len(values):
+        chunk = values[start:start + block]
+        weights = powers[:len(chunk)]
+        out[start:start + len(chunk)] = weights * (
+            carry + alpha * np.cumsum(chunk / weights))
+        carry = out[start + len(chunk) - 1]
+        start += len(chunk)
+    return out
+
+
+def ema(close, period=PERIODS['ema_fast']):
+    return ewm(close, 2 / (period + 1))
+
+
+def true_range(high, low, close):
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    prev_close = np.asarray(close, dtype=np.float64)[:-1]
+    ranges = high - low
+    ranges[1:] = np.maximum.reduce(
+        (ranges[1:], np.abs(high[1:] - prev_close),
+         np.abs(low[1:] - prev_close)))
+    return ranges
+
+
+def atr(high, low, close, period=PERIODS['atr']):
+    return ewm(true_range(high, low, close), 1 / period)
+
+
+def rsi(close, period=PERIODS['rsi']):
+    change = np.diff(np.asarray(close, dtype=np.float64))
+    gain = ewm(np.maximum(change, 0.0), 1 / period)
+    loss = ewm(np.maximum(-change, 0.0), 1 / period)
+    total = gain + loss
+    out = np.full(len(change) + 1, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out[1:] = np.where(total > 0, 100 * gain / total, 50.0)
+    return out
+
+
+def _window_sums(values, period):
+    # Sums of every `period` consecutive values
+    sums = np.cumsum(np.concatenate(([0.0], values)))
+    return sums[period:] - sums[:-period]
+
+
+def _rolling_max(values, period):
+    # Max of every `period` consecutive values in O(n) (van Herk/Gil-Werman):
+    # a window spans at most two blocks of `period` values, so it is the max
+    # of a block suffix and the next block's prefix
+    count = len(values)
+    blocks = -(-count // period)
+    padded = np.full(blocks * period, -np.inf)
+    padded[:count] = values
+    padded = padded.reshape(blocks, period)
+    prefix = np.maximum.accumulate(padded, axis=1).ravel()
+    suffix = np.maximum.accumulate(padded[:, ::-1], axis=1)[:, ::-1].ravel()
+    return np.maximum(suffix[:count - period + 1], prefix[period - 1:count])
+
+
+def volume_zscore(volume, period=PERIODS['volume_z']):
+    volume = np.asarray(volume, dtype=np.float64)
+    out = np.full(len(volume), np.nan)
+    if len(volume) < period:
+        return out
+    # Centered first so the sums of squares do not cancel
+    centered = volume - volume.mean()
+    mean = _window_sums(centered, period) / period
+    squares = _window_sums(centered * centered, period)
+    variance = np.maximum(squares - period * mean * mean, 0.0) / (period - 1)
+    std = np.sqrt(variance)
+    # Windows of equal values have a std of exactly 0, not rounding noise
+    flat = _rolling_max(volume, period) == -_rolling_max(-volume, period)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out[period - 1:] = np.where(
+            flat, 0.0, (centered[period - 1:] - mean) / std)
+    return out
+
+
+def channel_width(high, low, close, period=PERIODS['channel_width']):
+    high = np.asarray(high, dtype=np.float64)
+    out = np.full(len(high), np.nan)
+    if len(high) < period:
+        return out
+    highest = _rolling_max(high, period)
+    lowest = -_rolling_max(-np.asarray(low, dtype=np.float64), period)
+    out[period - 1:] = (highest - lowest) / np.asarray(close)[period - 1:]
+    return out
+
+
+def compute(candles, periods=PERIODS):
+    # Every indicator over Candles, one array per indicator name
+    return {
+        'ema_fast': ema(candles.close, periods['ema_fast']),
+        'ema_slow': ema(candles.close, periods['ema_slow']),
+        'atr': atr(candles.high, candles.low, candles.close, periods['atr']),
+        'rsi': rsi(candles.close, periods['rsi']),
+        'volume_z': volume_zscore(candles.volume, periods['volume_z']),
+        'channel_width': channel_width(candles.high, candles.low,
+                                       candles.close,
+                                       periods['channel_width'])
+    }
@@ -0,0 +1,192 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+# Log records are put on a queue by the scan threads and written by one
+# background listener thread, so a slow disk or console never stalls a
+# scan. Fields passed with `extra` (market, timeframe, stage, ...) become
+# keys of the JSON records:
+#
+#   logger = logging.getLogger('bot')
+#   logger.debug("Candles count for %s (%s): %d", market, timeframe, count,
+#                extra={'market': market, 'timeframe': timeframe})
+
+# ================== Settings ==================
+LOG_FILE = os.environ.get('BOT_LOG_FILE', 'bot_log.jsonl')
+ERROR_LOG = 'error_log.txt'
+LOG_LEVEL = os.environ.get('BOT_LOG_LEVEL', 'INFO')
+CONSOLE_LEVEL = os.environ.get('BOT_CONSOLE_LEVEL', 'INFO')
+# Files roll over at this size or age, keeping LOG_BACKUPS old files
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_MAX_AGE = 24 * 60 * 60
+LOG_BACKUPS = 5
+# Fraction of records kept per level, e.g. BOT_LOG_SAMPLE="DEBUG=0.05"
+LOG_SAMPLE = os.environ.get('BOT_LOG_SAMPLE', '')
+# Records beyond this many waiting for the writer are dropped
+QUEUE_SIZE = 10000
+
+# Attributes every LogRecord has; anything else came in through `extra`
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None)))
+_RECORD_FIELDS.update(('message', 'asctime'))
+
+_listener = None
+_atexit_registered = False
+
+# ================== Handlers ==================
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created,
+                                           timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and value is not None:
+                data[key] = value
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class RotatingHandler(logging.handlers.RotatingFileHandler):
+    # Rolls over when the file reaches max_bytes or every max_age seconds
+
+    def __init__(self, filename, max_bytes=LOG_MAX_BYTES,
+                 max_age=LOG_MAX_AGE, backups=LOG_BACKUPS):
+        super().__init__(filename,
+                         maxBytes=max_bytes,
+                         backupCount=backups,
+                         encoding='utf-8',
+                         delay=True)
+        self.max_age = max_age
+        self.rollover_at = time.time() + max_age if max_age else None
+
+    def shouldRollover(self, record):
+        if self.rollover_at is not None and record.created >= self.rollover_at:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        if self.max_age:
+            self.rollover_at = time.time() + self.max_age
+
+
+class SamplingFilter(logging.Filter):
+    # Keeps a random `rate` fraction of the records of each sampled level
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        rate = self.rates.get(record.levelno)
+        return rate is None or random.random() < rate
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    # Never blocks the logging thread: records that do not fit are counted
+    # (see dropped_records()) and dropped
+
+    dropped = 0
+    _dropped_lock = threading.Lock()
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with DroppingQueueHandler._dropped_lock:
+                DroppingQueueHandler.dropped += 1
+
+
+def dropped_records():
+    # Records dropped because the writer fell behind, since the process
+    # started
+    return DroppingQueueHandler.dropped
+
+
+def parse_sample(value):
+    # "DEBUG=0.05,INFO=0.5" -> {logging.DEBUG: 0.05, logging.INFO: 0.5}
+    rates = {}
+    for item in value.split(','):
+        level, _, rate = item.partition('=')
+        if level.strip():
+            rates[logging.getLevelName(level.strip().upper())] = float(rate)
+    return rates
+
+
+# ================== Setup ==================
+
+
+def setup_logging(level=LOG_LEVEL,
+                  log_file=LOG_FILE,
+                  error_log=ERROR_LOG,
+                  console_level=CONSOLE_LEVEL,
+                  sample=LOG_SAMPLE,
+                  stream=None):
+    # Routes the 'bot' logger through a queue to the JSON log, the error log
+    # and the console; calling it again replaces the earlier setup
+    global _listener, _atexit_registered
+    stop_logging()
+    if not _atexit_registered:
+        atexit.register(stop_logging)
+        _atexit_registered = True
+    handlers = []
+    if log_file:
+        json_handler = RotatingHandler(log_file)
+        json_handler.setFormatter(JsonFormatter())
+        handlers.append(json_handler)
+    if error_log:
+        error_handler = RotatingHandler(error_log)
+        error_handler.setLevel(logging.ERROR)
+        error_handler.setFormatter(
+            logging.Formatter('%(asctime)s: %(message)s'))
+        handlers.append(error_handler)
+    if console_level:
+        console = logging.StreamHandler(stream or sys.stdout)
+        console.setLevel(console_level)
+        console.setFormatter(
+            logging.Formatter('%(asctime)s %(levelname)s %(message)s',
+                              '%H:%M:%S'))
+        handlers.append(console)
+
+    log_queue = queue.Queue(QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    rates = parse_sample(sample) if sample else {}
+    if rates:
+        queue_handler.addFilter(SamplingFilter(rates))
+    logger = logging.getLogger('bot')
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(queue_handler)
+    logger.setLevel(level)
+    logger.propagate = False
+    _listener = logging.handlers.QueueListener(log_queue,
+                                               *handlers,
+                                               respect_handler_level=True)
+    _listener.start()
+    return logger
+
+
+def stop_logging():
+    # Writes out what is still queued and closes the files
+    global _listener
+    if _listener:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
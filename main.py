@@ -1,18 +1,63 @@
-﻿from flask import Flask
+﻿from flask import Flask, Response, jsonify
+import os
 import threading
-import bot_code
+import metrics
+
+# The web port is bound before the bot thread starts, so health checks pass
+# during a cold start: bot_code, its imports and the market discovery run
+# in the bot thread, and /ready answers 200 once the bot found its markets
+PORT = int(os.environ.get('PORT', '10000'))
 
 app = Flask(__name__)
+# bot_code once the bot thread imported it
+bot = None
+
 
 # اجرای کد سیگنال‌دهی در Thread جدا
+# python main.py --mode concurrent
+# python main.py --workers 4
 def run_bot():
-    bot_code.main()
+    global bot
+    import bot_code
+    try:
+        args = bot_code.parse_args()
+    except SystemExit as e:
+        # --help and bad arguments stop the process, not only this thread
+        os._exit(e.code or 0)
+    bot = bot_code
+    if args.workers or args.listen or args.coordinator:
+        import sharding
+        sharding.main(args)
+    else:
+        bot_code.main(args.mode, args.max_concurrency, args.digest)
+
 
-threading.Thread(target=run_bot).start()
+def serve(host="0.0.0.0", port=PORT):
+    # Listens first, then starts the bot
+    from werkzeug.serving import make_server
+    server = make_server(host, port, app, threaded=True)
+    threading.Thread(target=run_bot, name='bot').start()
+    server.serve_forever()
 
 @app.route('/')
 def home():
     return "Bot is running."
 
+@app.route('/ready')
+def ready():
+    if bot is None or not bot.runtime.get('ready'):
+        return jsonify(ready=False, loaded=bot is not None), 503
+    return jsonify(ready=True, ready_seconds=bot.runtime['ready_seconds'])
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/status')
+def status():
+    if bot is None:
+        return jsonify(ready=False), 503
+    return jsonify(bot.status())
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=10000)
+    serve()
@@ -0,0 +1,224 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+# Counters and histograms served in the Prometheus text format on /metrics:
+#
+#   scans = metrics.counter('scans_total', 'Market scans', ['market'])
+#   scans.inc(market='BTCUSDT')
+#   with metrics.api_latency.time(endpoint='/market/kline'):
+#       ...
+
+# ================== Settings ==================
+PREFIX = 'coinex_bot_'
+# Upper bounds in seconds, from cheap analysis steps to slow API calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+logger = logging.getLogger('bot')
+
+# ================== Metric Types ==================
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = PREFIX + name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [(self.name + _labels(self.labelnames, key), value)
+                for key, value in sorted(values.items())]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Counter):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'), )
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def value(self, **labels):
+        # (count, sum) of the observations
+        series = self._values.get(self._key(labels))
+        return (series[2], series[1]) if series else (0, 0.0)
+
+    def samples(self):
+        with self._lock:
+            values = {
+                key: (list(series[0]), series[1], series[2])
+                for key, series in self._values.items()
+            }
+        samples = []
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append(
+                    (self.name + '_bucket' +
+                     _labels(self.labelnames, key, f'le="{_number(bound)}"'),
+                     cumulative))
+            samples.append((self.name + '_sum' +
+                            _labels(self.labelnames, key), total))
+            samples.append((self.name + '_count' +
+                            _labels(self.labelnames, key), count))
+        return samples
+
+
+# ================== Registry ==================
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+        self.collector_errors = self.register(
+            Counter('collector_errors_total',
+                    'Scrapes where a metrics collector failed', ['collector']))
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def collector(self, func):
+        # `func()` returns metrics built at scrape time, e.g. gauges filled
+        # from another module's counters
+        with self._lock:
+            self._collectors.append(func)
+        return func
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        for func in collectors:
+            try:
+                metrics.extend(func())
+            except Exception:
+                # The other metrics are still served
+                logger.exception("Metrics collector %s failed",
+                                 func.__name__)
+                self.collector_errors.inc(collector=func.__name__)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name} {_number(value)}"
+                         for name, value in metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def counter(name, help, labelnames=()):
+    return REGISTRY.register(Counter(name, help, labelnames))
+
+
+def gauge(name, help, labelnames=()):
+    return REGISTRY.register(Gauge(name, help, labelnames))
+
+
+def histogram(name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
+
+
+def render():
+    return REGISTRY.render()
+
+
+# ================== Bot Metrics ==================
+api_latency = histogram('api_request_seconds', 'HTTP request latency',
+                        ['endpoint'])
+api_responses = counter('api_responses_total', 'HTTP responses by status',
+                        ['endpoint', 'status'])
+parse_latency = histogram('kline_parse_seconds',
+                          'Time to turn a kline response into candles',
+                          ['timeframe'])
+stage_latency = histogram('stage_seconds', 'Time spent running a scan stage',
+                          ['stage'])
+market_latency = histogram('market_scan_seconds',
+                           'Time to scan one market')
+cycle_latency = histogram('cycle_seconds', 'Time to scan all markets')
+market_stuck = counter('market_stuck_total',
+                       'Scans that stopped at a stage (signal: got through)',
+                       ['stage'])
+signals = counter('signals_total', 'Signals queued', ['signal', 'risk'])
+signal_levels = counter(
+    'signal_levels_total',
+    'Stop losses, profit targets and expiries reached by sent signals',
+    ['level', 'risk'])
+shard_signals = counter('shard_signals_total',
+                        'Signals received from shard workers', ['worker'])
+shard_rebalances = counter('shard_rebalances_total',
+                           'Market reassignments across shard workers')
@@ -0,0 +1,261 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+from collections import deque
+
+from http_client import TokenBucket
+
+# ================== Settings ==================
+MAX_ATTEMPTS = 5
+RETRY_BASE = 1
+RETRY_CAP = 60
+# A (market, signal, chat) is sent at most once inside this window
+DEDUP_SECONDS = 180
+# Digest mode collects signals for this long, then sends one message per chat
+DIGEST_SECONDS = 30
+# Telegram rejects longer messages
+MESSAGE_LIMIT = 4096
+# Telegram allows about 30 messages/second per bot and 1/second per chat
+GLOBAL_RATE = 30
+CHAT_RATE = 1
+# Delivery threads. A message that has to wait (its chat's rate limit or a
+# retry backoff) goes back in the queue instead of holding a thread, so
+# these only overlap slow posts
+WORKERS = 4
+
+# ================== Notifier ==================
+
+
+class Notifier:
+    # Delivers Telegram messages from a background worker so a slow or
+    # throttled Telegram API never blocks the scan threads.
+    # `post(chat_id, text)` sends one message and returns the response.
+    # The queue is unbounded: a signal fanned out to every subscriber is
+    # delivered in full, however many there are. Messages are taken in
+    # order of the time they may be sent at, so one busy chat never holds
+    # up the others
+
+    def __init__(self,
+                 post,
+                 chat_id,
+                 log=print,
+                 digest=False,
+                 dedup_seconds=DEDUP_SECONDS,
+                 digest_seconds=DIGEST_SECONDS,
+                 max_attempts=MAX_ATTEMPTS,
+                 workers=WORKERS):
+        self.post = post
+        self.chat_id = chat_id
+        self.log = log
+        self.digest = digest
+        self.dedup_seconds = dedup_seconds
+        self.digest_seconds = digest_seconds
+        self.max_attempts = max_attempts
+        self.workers = workers
+        self._rate = TokenBucket(GLOBAL_RATE, GLOBAL_RATE)
+        self._chat_rates = {}
+        # Heap of (not before, sequence, chat_id, text, keys, attempt), on
+        # the monotonic clock
+        self._queue = []
+        self._sequence = itertools.count()
+        self._queue_ready = threading.Condition()
+        # Dedup key -> time last queued, and (time, key) in that order so
+        # expired keys come off the left
+        self._seen = {}
+        self._seen_order = deque()
+        self._digest = {}
+        self._digest_started = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self.stats = {
+            'queued': 0,
+            'sent': 0,
+            'failed': 0,
+            'retries': 0,
+            'throttled': 0,
+            'deferred': 0,
+            'duplicates': 0
+        }
+
+    def start(self):
+        if not self._threads:
+            self._stop.clear()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run,
+                                          name=f'notifier-{i}',
+                                          daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        return self
+
+    def stop(self, timeout=30):
+        # Sends what is still queued (up to `timeout` seconds) and stops
+        self.flush()
+        self._stop.set()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        self._threads = []
+        if self.pending():
+            self.log(f"{self.pending()} Telegram messages not sent before "
+                     "shutdown")
+
+    def pending(self):
+        with self._queue_ready:
+            return len(self._queue)
+
+    def send(self, text, chat_id=None):
+        # Queues a plain message
+        return self._enqueue(chat_id or self.chat_id, text, [])
+
+    def notify(self, market, signal, text, chat_id=None):
+        # Queues a signal unless the same one went to this chat within
+        # dedup_seconds; returns whether it was queued
+        chat_id = chat_id or self.chat_id
+        key = (market, signal, chat_id)
+        now = time.time()
+        with self._lock:
+            self._expire_seen(now)
+            if key in self._seen:
+                self.stats['duplicates'] += 1
+                return False
+            self._seen[key] = now
+            self._seen_order.append((now, key))
+            if self.digest:
+                self._digest.setdefault(chat_id, []).append((key, text))
+                if self._digest_started is None:
+                    self._digest_started = now
+                return True
+        return self._enqueue(chat_id, text, [key])
+
+    def fan_out(self, market, signal, text, chat_ids):
+        # Queues one signal text for every chat; returns how many were queued
+        return sum(
+            1 for chat_id in chat_ids
+            if self.notify(market, signal, text, chat_id))
+
+    def flush(self):
+        # Queues the collected digest, one message (or a few, when longer
+        # than MESSAGE_LIMIT) per chat
+        with self._lock:
+            digest, self._digest = self._digest, {}
+            self._digest_started = None
+        for chat_id, entries in digest.items():
+            keys, text = [], ''
+            for key, entry in entries:
+                if text and len(text) + len(entry) + 2 > MESSAGE_LIMIT:
+                    self._enqueue(chat_id, text, keys)
+                    keys, text = [], ''
+                keys.append(key)
+                text = f"{text}\n\n{entry}" if text else entry
+            if text:
+                self._enqueue(chat_id, text, keys)
+
+    def _enqueue(self, chat_id, text, keys):
+        self._put(0.0, chat_id, text, keys, 0)
+        with self._lock:
+            self.stats['queued'] += 1
+        return True
+
+    def _put(self, not_before, chat_id, text, keys, attempt):
+        with self._queue_ready:
+            heapq.heappush(self._queue, (not_before, next(self._sequence),
+                                         chat_id, text, keys, attempt))
+            self._queue_ready.notify()
+
+    def _get(self, timeout):
+        # The next message that may be sent now, waiting up to `timeout`
+        # seconds for one; None if there is none by then
+        deadline = time.monotonic() + timeout
+        with self._queue_ready:
+            while True:
+                now = time.monotonic()
+                if self._queue and self._queue[0][0] <= now:
+                    return heapq.heappop(self._queue)[2:]
+                if now >= deadline:
+                    return None
+                wait = deadline - now
+                if self._queue:
+                    wait = min(wait, self._queue[0][0] - now)
+                self._queue_ready.wait(wait)
+
+    def _expire_seen(self, now):
+        # Drops the dedup keys older than dedup_seconds, oldest first; a key
+        # queued again or forgotten since has a newer time or none, and stays
+        order = self._seen_order
+        while order and now - order[0][0] >= self.dedup_seconds:
+            seen, key = order.popleft()
+            if self._seen.get(key) == seen:
+                del self._seen[key]
+
+    def _forget(self, keys):
+        # Lets a signal that could not be delivered go out again later
+        with self._lock:
+            for key in keys:
+                self._seen.pop(key, None)
+
+    def _run(self):
+        while not self._stop.is_set() or self.pending():
+            started = self._digest_started
+            if (started is not None
+                    and time.time() - started >= self.digest_seconds):
+                self.flush()
+            message = self._get(timeout=0.5)
+            if message is None:
+                continue
+            chat_id, text, keys, attempt = message
+            wait = self._chat_rate(chat_id).try_acquire()
+            if wait:
+                # The chat had its message this second; others go first
+                with self._lock:
+                    self.stats['deferred'] += 1
+                self._put(time.monotonic() + wait, chat_id, text, keys,
+                          attempt)
+                continue
+            self._rate.acquire()
+            self._deliver(chat_id, text, keys, attempt)
+
+    def _chat_rate(self, chat_id):
+        with self._lock:
+            rate = self._chat_rates.get(chat_id)
+            if rate is None:
+                rate = self._chat_rates[chat_id] = TokenBucket(CHAT_RATE, 1)
+            return rate
+
+    def _deliver(self, chat_id, text, keys, attempt):
+        # One attempt; a failed one that may be retried is queued again to
+        # go out after its backoff
+        delay = random.uniform(0, min(RETRY_CAP, RETRY_BASE * 2**attempt))
+        retry = True
+        try:
+            response = self.post(chat_id, text)
+            if response.status_code == 200:
+                with self._lock:
+                    self.stats['sent'] += 1
+                return
+            error = response.text
+            if response.status_code == 429:
+                # Telegram says how long to wait in parameters.retry_after
+                with self._lock:
+                    self.stats['throttled'] += 1
+                try:
+                    delay = response.json()['parameters']['retry_after']
+                except Exception:
+                    pass
+            elif response.status_code < 500:
+                retry = False
+        except Exception as e:
+            error = str(e)
+        if retry and attempt + 1 < self.max_attempts:
+            with self._lock:
+                self.stats['retries'] += 1
+            self._put(time.monotonic() + delay, chat_id, text, keys,
+                      attempt + 1)
+            return
+        with self._lock:
+            self.stats['failed'] += 1
+        self.log(f"Error sending to Telegram: {error}")
+        self._forget(keys)
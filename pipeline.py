@@ -0,0 +1,120 @@
+import threading
+
+import metrics
+from candle_store import TIMEFRAME_SECONDS
+from candles import Candles
+
+# ================== Settings ==================
+# Stages of scan_market in pipeline order
+STAGES = [
+    'swings_m15', 'trend_m15', 'indicators_m15', 'momentum_m15', 'swings_m3',
+    'trend_m3', 'breakout_m3', 'hpta', 'indicators_m3', 'algo4', 'swings_h1',
+    'trend_h1'
+]
+
+# ================== Candle Close Keys ==================
+
+
+def last_closed_time(timeframe, now):
+    # Open time of the newest candle that has closed by `now`
+    step = TIMEFRAME_SECONDS[timeframe]
+    return int(now // step) * step - step
+
+
+def closed_klines(klines, timeframe, now):
+    # Drops the still open candle(s) from the end of `klines`
+    step = TIMEFRAME_SECONDS[timeframe]
+    end = len(klines)
+    if isinstance(klines, Candles):
+        # Read from the time column, without building candle dicts
+        times = klines.time
+        while end and times[end - 1] + step > now:
+            end -= 1
+        return klines[:end]
+    while end and klines[end - 1]['time'] + step > now:
+        end -= 1
+    return klines[:end]
+
+
+# ================== Stage Cache ==================
+
+
+class StageCache:
+    # Last result of every (market, stage), together with the key it was
+    # computed for. Keys are built from the last closed candle of the stage's
+    # input timeframe, so a stage only runs again once that candle changes
+
+    def __init__(self):
+        self._entries = {}
+        self._filled = set()
+        self._lock = threading.Lock()
+        self.hits = {stage: 0 for stage in STAGES}
+        self.misses = {stage: 0 for stage in STAGES}
+
+    def lookup(self, market, stage, key):
+        # Returns (True, result) for a cached result of `key`, else (False,
+        # None); counts the hit or miss
+        entry = self._entries.get((market, stage))
+        with self._lock:
+            if entry is not None and entry[0] == key:
+                if (market, stage) in self._filled:
+                    self._filled.discard((market, stage))
+                else:
+                    self.hits[stage] = self.hits.get(stage, 0) + 1
+                return True, entry[1]
+            self.misses[stage] = self.misses.get(stage, 0) + 1
+        return False, None
+
+    def peek(self, market, stage, key):
+        # lookup() without counting
+        entry = self._entries.get((market, stage))
+        if entry is not None and entry[0] == key:
+            return True, entry[1]
+        return False, None
+
+    def store(self, market, stage, key, result):
+        self._entries[(market, stage)] = (key, result)
+        self._filled.discard((market, stage))
+        return result
+
+    def fill(self, market, stage, key, result):
+        # Stores a result computed outside run() (the batch pass of
+        # bot_code): counted as a run, and its first lookup not as a hit
+        self.store(market, stage, key, result)
+        with self._lock:
+            self.misses[stage] = self.misses.get(stage, 0) + 1
+            self._filled.add((market, stage))
+        return result
+
+    def run(self, market, stage, key, func, *args):
+        found, result = self.lookup(market, stage, key)
+        if found:
+            return result
+        with metrics.stage_latency.time(stage=stage):
+            result = func(*args)
+        return self.store(market, stage, key, result)
+
+    def drop(self, market):
+        for stage in STAGES:
+            self._entries.pop((market, stage), None)
+            self._filled.discard((market, stage))
+
+    def stats(self):
+        with self._lock:
+            stats = {}
+            for stage in self.hits:
+                total = self.hits[stage] + self.misses[stage]
+                stats[stage] = {
+                    'hits': self.hits[stage],
+                    'misses': self.misses[stage],
+                    'hit_ratio': self.hits[stage] / total if total else 0.0
+                }
+            return stats
+
+    def report(self):
+        lines = ["Stage cache hit ratios:"]
+        for stage, stat in self.stats().items():
+            if stat['hits'] or stat['misses']:
+                lines.append(f"  {stage:<13} {stat['hit_ratio']:>6.1%} "
+                             f"({stat['hits']} hits, {stat['misses']} runs)")
+        return '\n'.join(lines)
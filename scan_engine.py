@@ -0,0 +1,65 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# ================== Settings ==================
+# Maximum number of markets analysed at the same time in one cycle
+MAX_CONCURRENT_MARKETS = 16
+
+# ================== Scan Pool ==================
+
+
+class ScanPool:
+    # A bounded pool of scan threads, reused by every cycle. Cycles are run
+    # by one thread at a time (the main loop).
+    #
+    # scan_market is blocking code (requests, numpy), so each market takes a
+    # pool thread for its whole scan and at most `max_concurrency` markets
+    # are in flight. They overlap because the threads release the GIL while
+    # they wait on the network, so anything the scans share must be locked
+    # (bot_code.state_lock). Requests per host are bounded separately by
+    # HttpClient
+
+    def __init__(self, max_concurrency=MAX_CONCURRENT_MARKETS):
+        self.max_concurrency = max(1, max_concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                           thread_name_prefix='scan')
+
+    def run(self, markets, scan_market):
+        futures = [
+            self.executor.submit(scan_market, market) for market in markets
+        ]
+        results = []
+        for market, future in zip(markets, futures):
+            try:
+                results.append((market, future.result()))
+            except Exception as e:
+                results.append((market, e))
+        return results
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(max_concurrency=MAX_CONCURRENT_MARKETS):
+    # The shared pool, replaced when the concurrency changes
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.max_concurrency != max_concurrency:
+            if _pool is not None:
+                _pool.close()
+            _pool = ScanPool(max_concurrency)
+        return _pool
+
+
+def run_scan_cycle(markets, scan_market,
+                   max_concurrency=MAX_CONCURRENT_MARKETS):
+    # Runs `scan_market(market)` once for every market on the pool and
+    # returns [(market, result_or_exception), ...] in input order
+    markets = list(markets)
+    if not markets:
+        return []
+    return get_pool(max(1, max_concurrency)).run(markets, scan_market)
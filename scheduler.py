@@ -0,0 +1,298 @@
+import math
+import os
+import threading
+import zlib
+
+from candle_store import TIMEFRAME_SECONDS
+
+# Decides which markets are scanned when. Every market has its own scan
+# interval: busy, volatile markets and markets whose price is close to an
+# algo 4 zone are scanned more often, quiet ones less often, and all
+# intervals are stretched when together they would need more API requests
+# than REQUEST_BUDGET. Markets dropped after repeated errors are re-admitted
+# after a backoff.
+#
+# Scans are aligned to the candle closes of ALIGN_TIMEFRAME on the exchange
+# clock: a market with a 180 second interval is scanned CLOSE_DELAY seconds
+# after every M3 close, one with 540 seconds after every third, and a hot
+# one also between the closes. Each market has its own offset inside
+# STAGGER_WINDOW so the requests after a close are spread out.
+
+# ================== Settings ==================
+# Seconds between refreshes of the market list and the 24h tickers
+UNIVERSE_REFRESH = 60 * 60
+# Besides REQUESTED_MARKETS, also scan this many of the most traded markets
+UNIVERSE_SIZE = int(os.environ.get('BOT_UNIVERSE_SIZE', '0'))
+QUOTE_ASSET = 'USDT'
+# False scans every market every BASE_INTERVAL seconds
+ADAPTIVE_POLLING = True
+HOT_INTERVAL = 60
+BASE_INTERVAL = 180
+COLD_INTERVAL = 540
+# Markets scoring in the top HOT_SHARE are hot, in the bottom COLD_SHARE cold
+HOT_SHARE = 0.2
+COLD_SHARE = 0.4
+# A market whose price is within this fraction of the channel diameter of
+# its algo 4 zone is hot
+NEAR_ZONE = 0.25
+# Average API requests per minute the scans may use, and what a scan costs
+REQUEST_BUDGET = 240
+REQUESTS_PER_SCAN = 3
+# Dropped markets come back after READMIT_BASE * 2**(drops - 1) seconds
+READMIT_BASE = 10 * 60
+READMIT_CAP = 6 * 60 * 60
+ALIGN_TIMEFRAME = '3min'
+# Seconds after a close before the exchange is asked for the new candle
+CLOSE_DELAY = 2
+STAGGER_WINDOW = 30
+# Shortest sleep between two scheduler ticks
+MIN_WAIT = 1
+
+# ================== Market Ranking ==================
+
+
+def market_stats(tickers):
+    # {market: ticker} of /market/ticker/all -> {market: {'turnover',
+    # 'volatility'}} with the 24h turnover in the quote asset and the 24h
+    # range as a fraction of the price
+    stats = {}
+    for market, ticker in tickers.items():
+        try:
+            last = float(ticker['last'])
+            if last <= 0:
+                continue
+            turnover = float(
+                ticker.get('deal') or float(ticker['vol']) * last)
+            volatility = (float(ticker['high']) - float(ticker['low'])) / last
+        except (KeyError, TypeError, ValueError):
+            continue
+        stats[market] = {'turnover': turnover, 'volatility': volatility}
+    return stats
+
+
+def top_markets(stats, count, quote=QUOTE_ASSET):
+    # The `count` markets quoted in `quote` with the highest turnover
+    markets = [market for market in stats if market.endswith(quote)]
+    markets.sort(key=lambda market: stats[market]['turnover'], reverse=True)
+    return markets[:count]
+
+
+def _percentiles(values):
+    # {key: value} -> {key: rank / (n - 1)}, 0 for the lowest value
+    ordered = sorted(values, key=values.get)
+    last = max(1, len(ordered) - 1)
+    return {key: i / last for i, key in enumerate(ordered)}
+
+
+def zone_distance(trend, channel, price):
+    # How far `price` still has to move to reach the algo 4 zone, as a
+    # fraction of the channel diameter (0 inside the zone)
+    if not channel or not price:
+        return None
+    support = channel['support'][1]['price']
+    resistance = channel['resistance'][1]['price']
+    diameter = abs(resistance - support)
+    if not diameter:
+        return None
+    if trend == 'up trend':
+        return max(0.0, (price - support) / diameter)
+    if trend == 'down trend':
+        return max(0.0, (resistance - price) / diameter)
+    return None
+
+
+def stagger(market, window=STAGGER_WINDOW):
+    # Fixed offset of `market` inside `window`, the same in every process
+    return zlib.crc32(market.encode()) % 1000 / 1000 * window
+
+
+def period(interval, timeframe=ALIGN_TIMEFRAME):
+    # `interval` rounded to a multiple (or an even fraction) of the candle
+    # step, so scans keep landing right after closes
+    step = TIMEFRAME_SECONDS[timeframe]
+    if interval >= step:
+        return math.ceil(interval / step - 1e-9) * step
+    return step / max(1, math.floor(step / interval))
+
+
+def next_scan_time(interval, offset, now):
+    # First close boundary of the interval's period after `now`, plus the
+    # close delay and the market's offset. After a scan off the grid (a new
+    # or re-admitted market) a slot less than half a period away is skipped
+    every = period(interval)
+    shift = CLOSE_DELAY + offset
+    next_time = (math.floor((now - shift) / every) + 1) * every + shift
+    if next_time - now < every / 2:
+        next_time += every
+    return next_time
+
+
+# ================== Scheduler ==================
+
+
+class MarketScheduler:
+
+    def __init__(self,
+                 markets=(),
+                 adaptive=ADAPTIVE_POLLING,
+                 budget=REQUEST_BUDGET):
+        self.adaptive = adaptive
+        self.budget = budget
+        self.scores = {}
+        self.stretch = 1.0
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.set_markets(markets)
+
+    def __contains__(self, market):
+        return market in self._entries
+
+    def markets(self):
+        return list(self._entries)
+
+    def set_markets(self, markets):
+        # Returns (added, removed); new markets are due right away
+        with self._lock:
+            added = [m for m in markets if m not in self._entries]
+            removed = [m for m in self._entries if m not in markets]
+            for market in removed:
+                del self._entries[market]
+            for market in added:
+                self._entries[market] = {
+                    'next': 0,
+                    'offset': stagger(market),
+                    'interval': BASE_INTERVAL,
+                    'near_zone': False,
+                    'drops': 0,
+                    'retry_at': None,
+                    'readmitted_at': None
+                }
+            self._plan()
+        return added, removed
+
+    def set_budget(self, budget):
+        with self._lock:
+            self.budget = budget
+            self._plan()
+
+    def rank(self, stats):
+        # Scores markets by 24h turnover and range, 0 (quietest) to 1
+        turnover = _percentiles(
+            {m: s['turnover']
+             for m, s in stats.items()})
+        volatility = _percentiles(
+            {m: s['volatility']
+             for m, s in stats.items()})
+        with self._lock:
+            self.scores = {
+                market: (turnover[market] + volatility[market]) / 2
+                for market in stats
+            }
+            self._plan()
+
+    def hint(self, market, distance):
+        # `distance` to the algo 4 zone from the last scan (None: no zone)
+        with self._lock:
+            entry = self._entries.get(market)
+            if entry is None:
+                return
+            near_zone = distance is not None and distance <= NEAR_ZONE
+            if near_zone != entry['near_zone']:
+                entry['near_zone'] = near_zone
+                self._plan()
+
+    def _plan(self):
+        # Sets every interval from the scores and hints, then stretches them
+        # all if the request rate would exceed the budget
+        for market, entry in self._entries.items():
+            score = self.scores.get(market, 0.5)
+            if not self.adaptive:
+                entry['interval'] = BASE_INTERVAL
+            elif entry['near_zone'] or score >= 1 - HOT_SHARE:
+                entry['interval'] = HOT_INTERVAL
+            elif score < COLD_SHARE:
+                entry['interval'] = COLD_INTERVAL
+            else:
+                entry['interval'] = BASE_INTERVAL
+        self.stretch = 1.0
+        if self.adaptive and self.budget:
+            rate = sum(REQUESTS_PER_SCAN * 60 / entry['interval']
+                       for entry in self._entries.values())
+            if rate > self.budget:
+                self.stretch = rate / self.budget
+                for entry in self._entries.values():
+                    entry['interval'] *= self.stretch
+
+    def due(self, now, active_markets):
+        # Active markets whose next scan time has come, most overdue first
+        active_markets = set(active_markets)
+        with self._lock:
+            due = [(entry['next'], market)
+                   for market, entry in self._entries.items()
+                   if entry['next'] <= now and market in active_markets]
+        return [market for _, market in sorted(due)]
+
+    def scanned(self, markets, now):
+        # `now` is exchange time, like every time given to the scheduler
+        with self._lock:
+            for market in markets:
+                entry = self._entries.get(market)
+                if entry:
+                    entry['next'] = next_scan_time(entry['interval'],
+                                                   entry['offset'], now)
+
+    def wait(self, now, active_markets):
+        # Seconds until the next active market is due
+        active_markets = set(active_markets)
+        with self._lock:
+            times = [
+                entry['next'] for market, entry in self._entries.items()
+                if market in active_markets
+            ]
+            times += [
+                entry['retry_at'] for entry in self._entries.values()
+                if entry['retry_at'] is not None
+            ]
+        if not times:
+            return BASE_INTERVAL
+        return min(BASE_INTERVAL, max(MIN_WAIT, min(times) - now))
+
+    def readmit(self, active_markets, now):
+        # Puts the markets scan_market dropped on a backoff and returns the
+        # ones whose backoff is over, which the caller scans again
+        readmitted = []
+        with self._lock:
+            for market, entry in self._entries.items():
+                if market in active_markets:
+                    continue
+                if entry['retry_at'] is None:
+                    # A market that stayed in for the longest backoff starts
+                    # over with the shortest
+                    if (entry['readmitted_at'] is not None
+                            and now - entry['readmitted_at'] >= READMIT_CAP):
+                        entry['drops'] = 0
+                    entry['drops'] += 1
+                    entry['retry_at'] = now + min(
+                        READMIT_CAP, READMIT_BASE * 2**(entry['drops'] - 1))
+                elif now >= entry['retry_at']:
+                    entry['retry_at'] = None
+                    entry['readmitted_at'] = now
+                    entry['next'] = 0
+                    readmitted.append(market)
+        return readmitted
+
+    def stats(self):
+        with self._lock:
+            intervals = [e['interval'] for e in self._entries.values()]
+            return {
+                'markets': len(self._entries),
+                'hot': sum(1 for e in self._entries.values()
+                           if e['interval'] <= HOT_INTERVAL * self.stretch),
+                'near_zone': sum(1 for e in self._entries.values()
+                                 if e['near_zone']),
+                'suspended': sum(1 for e in self._entries.values()
+                                 if e['retry_at'] is not None),
+                'stretch': round(self.stretch, 3),
+                'scans_per_minute': round(
+                    sum(60 / i for i in intervals), 2) if intervals else 0
+            }
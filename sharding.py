@@ -0,0 +1,646 @@
+import bisect
+import hashlib
+import os
+import platform
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+import bot_code
+import metrics
+import scheduler
+import snapshot
+from logs import ERROR_LOG, LOG_FILE
+
+# Spreads the markets over worker processes, on this host or others. The
+# coordinator owns the market list and the notifier; workers scan the markets
+# the coordinator assigns them and send their signals back, so every signal
+# still goes through one deduplicating notifier:
+#
+#   python sharding.py --workers 4
+#   BOT_SHARD_KEY=secret python sharding.py --listen 0.0.0.0:7070
+#   BOT_SHARD_KEY=secret python sharding.py --coordinator 10.0.0.1:7070
+#
+# Messages are tuples over multiprocessing.connection:
+#   worker -> coordinator: ('hello', worker_id), ('heartbeat', info),
+#                          ('signal', market, signal, risk, message)
+#   coordinator -> worker: ('assign', markets, request_budget), ('stop', )
+
+# ================== Settings ==================
+# Shared secret of the coordinator and its workers; without it the
+# coordinator makes one up, which only its local workers know
+SHARD_KEY = os.environ.get('BOT_SHARD_KEY', '')
+LISTEN_ADDRESS = ('127.0.0.1', 0)
+# Points per worker on the hash ring; more points spread markets more evenly
+REPLICAS = 100
+HEARTBEAT_SECONDS = 10
+# Workers not heard from for this long are dropped and their markets moved
+WORKER_TIMEOUT = 3 * HEARTBEAT_SECONDS
+# Joins and leaves within this many seconds are rebalanced together
+REBALANCE_DELAY = 2
+CONNECT_RETRY_CAP = 30
+# Crashed local workers are restarted after 1, 2, 4... seconds, up to the cap;
+# a worker that ran for RESPAWN_STABLE seconds starts from 1 again
+RESPAWN_BASE = 1
+RESPAWN_CAP = 60
+RESPAWN_STABLE = 60
+
+# ================== Hash Ring ==================
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    # Consistent hashing: a market belongs to the first worker point after
+    # its hash, so a worker joining or leaving only moves the markets on its
+    # own arcs of the ring
+
+    def __init__(self, nodes=(), replicas=REPLICAS):
+        self.replicas = replicas
+        self.nodes = set()
+        self._points = []
+        self._owners = []
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for i in range(self.replicas):
+            point = _hash(f"{node}#{i}")
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove(self, node):
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        keep = [i for i, owner in enumerate(self._owners) if owner != node]
+        self._points = [self._points[i] for i in keep]
+        self._owners = [self._owners[i] for i in keep]
+
+    def owner(self, key):
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[index]
+
+    def assign(self, keys):
+        # {node: [keys]} for every node, including the ones given no keys
+        assignment = {node: [] for node in self.nodes}
+        for key in keys:
+            owner = self.owner(key)
+            if owner is not None:
+                assignment[owner].append(key)
+        return assignment
+
+
+def parse_address(value):
+    # "host:port" -> (host, port)
+    host, _, port = value.rpartition(':')
+    return (host or '127.0.0.1', int(port))
+
+
+def format_address(address):
+    return f"{address[0]}:{address[1]}"
+
+
+# ================== Coordinator ==================
+
+
+class Coordinator:
+    # Accepts worker connections, keeps the hash ring in step with the live
+    # workers and hands every signal a worker sends to `publish(market,
+    # signal, risk, message)`
+
+    def __init__(self,
+                 markets,
+                 publish,
+                 address=LISTEN_ADDRESS,
+                 authkey=None,
+                 log=print,
+                 timeout=WORKER_TIMEOUT):
+        self.markets = list(markets)
+        self.publish = publish
+        self.authkey = authkey or secrets.token_hex(16).encode()
+        self.log = log
+        self.timeout = timeout
+        self.listener = Listener(address, authkey=self.authkey)
+        self.address = self.listener.address
+        self.ring = HashRing()
+        self.workers = {}
+        self.processes = {}
+        self._respawns = {}
+        self.rebalances = 0
+        self._changed_at = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for target, name in ((self._accept, 'shard-accept'),
+                             (self._monitor, 'shard-monitor')):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        with self._lock:
+            workers = list(self.workers.values())
+        for worker in workers:
+            self._send(worker, ('stop', ))
+        deadline = time.monotonic() + timeout
+        for process, _ in self.processes.values():
+            try:
+                process.wait(max(0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                process.terminate()
+        self.listener.close()
+        for worker in workers:
+            worker['conn'].close()
+
+    def spawn(self, worker_id, *args):
+        # Starts a local worker process; `args` are extra command line
+        # arguments such as ('--mode', 'concurrent')
+        command = [
+            sys.executable,
+            os.path.abspath(__file__), '--coordinator',
+            format_address(self.address), '--worker-id', worker_id
+        ] + list(args)
+        env = dict(os.environ, BOT_SHARD_KEY=self.authkey.decode())
+        process = subprocess.Popen(command, env=env)
+        self.processes[worker_id] = (process, args)
+        respawn = self._respawns.setdefault(worker_id, {'crashes': 0})
+        respawn.update(started=time.monotonic(), at=None)
+        return process
+
+    def set_markets(self, markets):
+        with self._lock:
+            if markets != self.markets:
+                self.markets = list(markets)
+                self._changed_at = time.monotonic()
+
+    def _accept(self):
+        while not self._stop.is_set():
+            try:
+                conn = self.listener.accept()
+            except Exception:
+                if self._stop.is_set():
+                    return
+                self.log("Shard worker failed to connect or authenticate")
+                continue
+            threading.Thread(target=self._serve,
+                             args=(conn, ),
+                             name='shard-reader',
+                             daemon=True).start()
+
+    def _serve(self, conn):
+        try:
+            if not conn.poll(self.timeout):
+                raise EOFError("no hello")
+            kind, worker_id = conn.recv()[:2]
+            if kind != 'hello':
+                raise EOFError(f"expected hello, got {kind}")
+        except Exception:
+            conn.close()
+            return
+        worker = {
+            'id': worker_id,
+            'conn': conn,
+            'send_lock': threading.Lock(),
+            'joined': time.time(),
+            'last_seen': time.time(),
+            'markets': [],
+            'info': {},
+            'signals': 0
+        }
+        with self._lock:
+            old = self.workers.get(worker_id)
+            self.workers[worker_id] = worker
+            self.ring.add(worker_id)
+            self._changed_at = time.monotonic()
+        if old:
+            old['conn'].close()
+        bot_code.logger.info("Shard worker %s joined",
+                             worker_id,
+                             extra={'worker': worker_id})
+        while not self._stop.is_set():
+            try:
+                if not conn.poll(1):
+                    continue
+                message = conn.recv()
+            except (EOFError, OSError):
+                break
+            worker['last_seen'] = time.time()
+            if message[0] == 'heartbeat':
+                worker['info'] = message[1]
+            elif message[0] == 'signal':
+                worker['signals'] += 1
+                metrics.shard_signals.inc(worker=worker_id)
+                try:
+                    self.publish(*message[1:])
+                except Exception as e:
+                    self.log(f"Error publishing signal from {worker_id}: "
+                             f"{str(e)}")
+        self._drop(worker, "connection closed")
+
+    def _drop(self, worker, reason):
+        with self._lock:
+            if self.workers.get(worker['id']) is not worker:
+                return
+            del self.workers[worker['id']]
+            self.ring.remove(worker['id'])
+            self._changed_at = time.monotonic()
+        worker['conn'].close()
+        if not self._stop.is_set():
+            self.log(f"Shard worker {worker['id']} dropped ({reason}). "
+                     f"Moving its {len(worker['markets'])} markets.")
+
+    def _send(self, worker, message):
+        try:
+            with worker['send_lock']:
+                worker['conn'].send(message)
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def _monitor(self):
+        while not self._stop.wait(1):
+            now = time.time()
+            with self._lock:
+                workers = list(self.workers.values())
+            for worker in workers:
+                if now - worker['last_seen'] > self.timeout:
+                    self._drop(worker, "no heartbeat")
+                    local = self.processes.get(worker['id'])
+                    if local and local[0].poll() is None:
+                        local[0].terminate()
+            if not self._stop.is_set():
+                self._respawn(time.monotonic())
+            changed_at = self._changed_at
+            if (changed_at is not None
+                    and time.monotonic() - changed_at >= REBALANCE_DELAY):
+                self.rebalance()
+
+    def _respawn(self, now):
+        # Restarts the local workers that exited, waiting twice as long after
+        # every crash in a row so a worker failing at startup does not spin
+        for worker_id, (process, args) in list(self.processes.items()):
+            if process.poll() is None:
+                continue
+            respawn = self._respawns[worker_id]
+            if respawn['at'] is None:
+                if now - respawn['started'] >= RESPAWN_STABLE:
+                    respawn['crashes'] = 0
+                delay = min(RESPAWN_CAP,
+                            RESPAWN_BASE * (2**respawn['crashes']))
+                respawn['crashes'] += 1
+                respawn['at'] = now + delay
+                self.log(f"Shard worker {worker_id} exited with code "
+                         f"{process.returncode}. Restarting it in {delay} "
+                         f"seconds.")
+            if now >= respawn['at']:
+                self.spawn(worker_id, *args)
+
+    def rebalance(self):
+        # Sends every worker its markets and its share of the request
+        # budget; consistent hashing keeps the markets of the workers that
+        # stayed where they were
+        with self._lock:
+            self._changed_at = None
+            assignment = self.ring.assign(self.markets)
+            total = len(self.markets)
+            workers = list(self.workers.values())
+        self.rebalances += 1
+        metrics.shard_rebalances.inc()
+        for worker in workers:
+            markets = assignment.get(worker['id'], [])
+            if markets == worker['markets']:
+                continue
+            budget = scheduler.REQUEST_BUDGET * len(markets) / max(1, total)
+            if self._send(worker, ('assign', markets, budget)):
+                worker['markets'] = markets
+            else:
+                self._drop(worker, "assignment not delivered")
+        bot_code.logger.info(
+            "Markets assigned to %d shard workers: %s", len(workers),
+            ', '.join(f"{w['id']}={len(w['markets'])}" for w in workers))
+
+    def status(self):
+        with self._lock:
+            workers = list(self.workers.values())
+        return {
+            'address': format_address(self.address),
+            'rebalances': self.rebalances,
+            'workers': {
+                worker['id']:
+                dict(worker['info'],
+                     markets=len(worker['markets']),
+                     joined=worker['joined'],
+                     last_seen=worker['last_seen'],
+                     signals=worker['signals'])
+                for worker in workers
+            }
+        }
+
+
+def run_coordinator(workers=0,
+                    listen=None,
+                    mode=bot_code.SCAN_MODE,
+                    max_concurrency=bot_code.scan_engine.MAX_CONCURRENT_MARKETS,
+                    digest=bot_code.DIGEST_MODE):
+    logger = bot_code.logger
+    bot_code.setup_logging(error_log=ERROR_LOG)
+    if mode == 'stream':
+        logger.warning("Shard workers do not stream candles; using "
+                       "concurrent mode.")
+        mode = 'concurrent'
+    logger.info("Starting Coinex futures monitoring (%d local shard "
+                "workers, %s mode)...", workers, mode)
+    booted_at = time.time()
+    bot_code.announce_start()
+    markets = bot_code.check_available_markets()
+    if not markets:
+        logger.error("No valid markets found. Stopping program.")
+        return
+    # Only keeps the market list current; the workers schedule the scans
+    universe = scheduler.MarketScheduler(adaptive=False)
+    markets = bot_code.select_markets(universe, markets)
+    universe.set_markets(markets)
+    bot_code.MARKETS = markets
+    notifier = bot_code.start_notifier(digest)
+    if listen and not SHARD_KEY:
+        logger.warning("BOT_SHARD_KEY is not set; only local workers can "
+                       "connect.")
+    coordinator = Coordinator(markets,
+                              bot_code.publish_signal,
+                              parse_address(listen) if listen else
+                              LISTEN_ADDRESS,
+                              SHARD_KEY.encode() or None,
+                              log=bot_code.log_error).start()
+    logger.info("Shard coordinator listening on %s",
+                format_address(coordinator.address))
+    for i in range(workers):
+        coordinator.spawn(f"local-{i}", '--mode', mode, '--max-concurrency',
+                          str(max_concurrency))
+    bot_code.runtime.update(mode=f"sharded/{mode}",
+                            started_at=time.time(),
+                            coordinator=coordinator)
+    bot_code.mark_ready(booted_at)
+    last_refresh = time.time()
+    try:
+        while True:
+            time.sleep(bot_code.SLEEP_SECONDS)
+            notifier.flush()
+            if time.time() - last_refresh >= scheduler.UNIVERSE_REFRESH:
+                universe.set_markets(bot_code.select_markets(universe))
+                coordinator.set_markets(universe.markets())
+                last_refresh = time.time()
+    except KeyboardInterrupt:
+        logger.info("Program stopped by user.")
+    finally:
+        coordinator.stop()
+        notifier.stop()
+
+
+# ================== Worker ==================
+
+
+class WorkerLink:
+    # The worker's end of the connection: forwards signals and heartbeats
+    # and keeps the latest market assignment
+
+    def __init__(self, conn, worker_id):
+        self.conn = conn
+        self.worker_id = worker_id
+        self.markets = []
+        self.budget = scheduler.REQUEST_BUDGET
+        self.info = {}
+        self.changed = threading.Event()
+        self.stopped = threading.Event()
+        self._send_lock = threading.Lock()
+
+    def start(self):
+        self.send(('hello', self.worker_id))
+        for target, name in ((self._read, 'shard-link'),
+                             (self._heartbeat, 'shard-heartbeat')):
+            threading.Thread(target=target, name=name, daemon=True).start()
+        return self
+
+    def send(self, message):
+        try:
+            with self._send_lock:
+                self.conn.send(message)
+            return True
+        except (OSError, ValueError):
+            self.stopped.set()
+            self.changed.set()
+            return False
+
+    def signal_sink(self, market, signal, risk, message):
+        # Used as bot_code.signal_sink; delivery is up to the coordinator
+        return 1 if self.send(('signal', market, signal, risk, message)) else 0
+
+    def wait(self, timeout):
+        # Sleeps until `timeout` passes or the assignment changes
+        changed = self.changed.wait(timeout)
+        self.changed.clear()
+        return changed
+
+    def _read(self):
+        while not self.stopped.is_set():
+            try:
+                message = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            if message[0] == 'assign':
+                self.markets = list(message[1])
+                self.budget = message[2]
+                self.changed.set()
+            elif message[0] == 'stop':
+                break
+        self.stopped.set()
+        self.changed.set()
+
+    def _heartbeat(self):
+        while not self.stopped.wait(HEARTBEAT_SECONDS):
+            self.send(('heartbeat', dict(self.info)))
+
+
+def connect(address, authkey, log=print):
+    # Retries until the coordinator is up
+    delay = 1
+    while True:
+        try:
+            return Client(address, authkey=authkey)
+        except (OSError, EOFError) as e:
+            log(f"Shard coordinator {format_address(address)} not reachable: "
+                f"{str(e)}. Retrying in {delay} seconds.")
+            time.sleep(delay)
+            delay = min(CONNECT_RETRY_CAP, delay * 2)
+
+
+def run_worker(coordinator,
+               worker_id=None,
+               mode=bot_code.SCAN_MODE,
+               max_concurrency=bot_code.scan_engine.MAX_CONCURRENT_MARKETS):
+    logger = bot_code.logger
+    worker_id = worker_id or f"{platform.node()}-{os.getpid()}"
+    # One JSON log and one state snapshot per worker; errors also reach the
+    # console
+    bot_code.setup_logging(log_file=f"{LOG_FILE}.{worker_id}", error_log=None)
+    snapshot_file = f"{snapshot.SNAPSHOT_FILE}.{worker_id}"
+    if not SHARD_KEY:
+        logger.error("BOT_SHARD_KEY must be set for shard workers.")
+        return
+    if mode == 'stream':
+        mode = 'concurrent'
+    booted_at = time.time()
+    conn = connect(parse_address(coordinator), SHARD_KEY.encode(),
+                   bot_code.log_error)
+    link = WorkerLink(conn, worker_id).start()
+    bot_code.signal_sink = link.signal_sink
+    logger.info("Shard worker %s connected to %s", worker_id, coordinator)
+
+    state = {}
+    error_counts = {}
+    active_markets = []
+    cycle_count = 0
+    market_scheduler = scheduler.MarketScheduler(budget=link.budget)
+    last_rank = 0
+    last_snapshot = time.time()
+    restored = False
+    bot_code.runtime.update(mode=f"worker/{mode}",
+                            started_at=time.time(),
+                            cycles=0,
+                            state=state,
+                            error_counts=error_counts,
+                            active_markets=active_markets,
+                            scheduler=market_scheduler)
+    bot_code.mark_ready(booted_at)
+
+    def reassign():
+        markets = link.markets
+        market_scheduler.set_markets(markets)
+        market_scheduler.set_budget(link.budget)
+        for market in [m for m in state if m not in markets]:
+            with bot_code.state_lock:
+                del state[market]
+                del error_counts[market]
+                if market in active_markets:
+                    active_markets.remove(market)
+            bot_code.stage_cache.drop(market)
+            bot_code.candle_store.drop(market)
+            bot_code.indicator_store.drop(market)
+        added = [m for m in markets if m not in state]
+        for market in added:
+            with bot_code.state_lock:
+                state[market] = bot_code.new_market_state()
+                error_counts[market] = 0
+                active_markets.append(market)
+            # The previous owner may have archived newer candles
+            bot_code.candle_archive.forget(market)
+        bot_code.warm_start(added)
+        if added:
+            logger.info("Shard worker %s took over %d markets",
+                        worker_id,
+                        len(added),
+                        extra={'worker': worker_id})
+
+    prefetched = {}
+
+    def scan(market):
+        # Markets moved away in the middle of a cycle are skipped
+        if market not in link.markets:
+            return False
+        return bot_code.scan_market(market, state, error_counts,
+                                    active_markets,
+                                    prefetched=prefetched.pop(market, None))
+
+    def analyze(markets):
+        prefetched.clear()
+        batched, state_changed = bot_code.analyze_batch(
+            markets, state, error_counts)
+        prefetched.update(batched)
+        return list(batched), state_changed
+
+    link.wait(WORKER_TIMEOUT)
+    while not link.stopped.is_set():
+        try:
+            reassign()
+            if not restored and state:
+                # Swings, cooldowns and open signals this worker id saved
+                # before it restarted, for the markets it got back
+                bot_code.restore_state(state, error_counts, active_markets,
+                                       snapshot_file)
+                restored = True
+            if time.time() - last_rank >= scheduler.UNIVERSE_REFRESH:
+                stats = bot_code.get_market_stats()
+                if stats:
+                    market_scheduler.rank(stats)
+                last_rank = time.time()
+            now = bot_code.server_clock.now()
+            bot_code.readmit_markets(market_scheduler, error_counts,
+                                     active_markets, now)
+            due = market_scheduler.due(now, active_markets)
+            cycle_count += 1
+            started = time.perf_counter()
+            state_changed = bot_code.scan_cycle(mode, due, scan,
+                                                max_concurrency, analyze)
+            market_scheduler.scanned(due, now)
+            for market in due:
+                market_scheduler.hint(
+                    market,
+                    bot_code.market_status.get(market,
+                                               {}).get('zone_distance'))
+            bot_code.runtime['cycles'] = cycle_count
+            bot_code.report_outcomes(bot_code.signal_tracker.expire())
+            if (state_changed or time.time() - last_snapshot >=
+                    snapshot.SNAPSHOT_INTERVAL):
+                bot_code.save_state(state, error_counts, active_markets,
+                                    snapshot_file)
+                last_snapshot = time.time()
+            link.info = {
+                'cycles': cycle_count,
+                'active_markets': len(active_markets),
+                'scanned': len(due),
+                'cycle_seconds': round(time.perf_counter() - started, 3)
+            }
+            # A new assignment starts the next cycle right away
+            link.wait(
+                market_scheduler.wait(bot_code.server_clock.now(),
+                                      active_markets))
+        except KeyboardInterrupt:
+            break
+        except Exception as e:
+            error_msg = f"General error in shard worker loop: {str(e)}"
+            bot_code.log_error(error_msg)
+            link.wait(bot_code.SLEEP_SECONDS)
+    bot_code.save_state(state, error_counts, active_markets, snapshot_file)
+    logger.info("Shard worker %s stopped", worker_id)
+    conn.close()
+
+
+# ================== Main ==================
+
+
+def main(args):
+    if args.coordinator:
+        run_worker(args.coordinator, args.worker_id, args.mode,
+                   args.max_concurrency)
+    else:
+        run_coordinator(args.workers, args.listen, args.mode,
+                        args.max_concurrency, args.digest)
+
+
+if __name__ == "__main__":
+    main(bot_code.parse_args())
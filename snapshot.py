@@ -0,0 +1,97 @@
+import json
+import os
+import tempfile
+import time
+
+from swings import SwingSeries
+
+# ================== Settings ==================
+SNAPSHOT_FILE = os.environ.get('BOT_STATE_FILE', 'bot_state.json')
+# Bump when the layout changes; snapshots of other versions are ignored
+SNAPSHOT_VERSION = 1
+# Seconds between snapshots when nothing changed
+SNAPSHOT_INTERVAL = 300
+# Older snapshots only restore cooldowns and error counts: after a longer
+# downtime the M3 swing lookback (50 candles) no longer covers the gap
+SNAPSHOT_MAX_AGE = 2 * 60 * 60
+
+SWING_KEYS = ('swings_h1', 'swings_m15', 'swings_m3')
+
+# ================== Encoding ==================
+
+
+def encode_swings(swings):
+    if not swings:
+        return None
+    return {
+        'highs': swings['highs'].to_list(),
+        'lows': swings['lows'].to_list(),
+        'maxlen': swings['highs'].maxlen
+    }
+
+
+def decode_swings(data):
+    if not data:
+        return None
+    return {
+        'highs': SwingSeries.from_list(data['highs'], data['maxlen']),
+        'lows': SwingSeries.from_list(data['lows'], data['maxlen'])
+    }
+
+
+# ================== Snapshots ==================
+
+
+def write_atomic(path, payload):
+    # Write to a temporary file in the same directory, then rename it over
+    # the old snapshot so a crash never leaves a half-written file
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory,
+                                     prefix='.' + os.path.basename(path),
+                                     suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def save_snapshot(state, error_counts, active_markets, last_signal_time,
+                  path=SNAPSHOT_FILE, extra=None):
+    snapshot = {
+        'version': SNAPSHOT_VERSION,
+        'saved_at': time.time(),
+        'state': {
+            market: {key: encode_swings(values.get(key))
+                     for key in SWING_KEYS}
+            for market, values in list(state.items())
+        },
+        'error_counts': dict(error_counts),
+        'active_markets': list(active_markets),
+        'last_signal_time': dict(last_signal_time),
+    }
+    if extra:
+        snapshot.update(extra)
+    write_atomic(path, json.dumps(snapshot, separators=(',', ':')))
+
+
+def load_snapshot(path=SNAPSHOT_FILE):
+    # Returns the decoded snapshot, or None when there is no usable one
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        snapshot = json.load(f)
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        # Written by another version of the bot; start from scratch
+        return None
+    snapshot['state'] = {
+        market: {key: decode_swings(values.get(key))
+                 for key in SWING_KEYS}
+        for market, values in snapshot['state'].items()
+    }
+    return snapshot
@@ -0,0 +1,340 @@
+import json
+import os
+import random
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from candle_store import TIMEFRAME_SECONDS
+from http_client import json_loads
+
+# ================== Settings ==================
+COINEX_WS_URL = os.environ.get('COINEX_WS_URL', 'wss://perpetual.coinex.com/')
+
+# Timeframe subscribed on the socket; larger timeframes are rebuilt from it
+STREAM_TIMEFRAME = '3min'
+DERIVED_TIMEFRAMES = ['15min', '1hour']
+
+PING_INTERVAL = 30
+PING_TIMEOUT = 10
+# A connection that delivered nothing for this long is closed and reopened
+STALE_SECONDS = 90
+RECONNECT_BASE = 1
+RECONNECT_CAP = 60
+# Streamed prices older than this are ignored by last_price()
+PRICE_MAX_AGE = 30
+
+# ================== Helpers ==================
+
+
+def parse_kline_row(row):
+    return {
+        'time': int(row[0]),
+        'open': float(row[1]),
+        'close': float(row[2]),
+        'high': float(row[3]),
+        'low': float(row[4]),
+        'volume': float(row[5])
+    }
+
+
+def decode_message(message):
+    # CoinEx may send compressed binary frames
+    if isinstance(message, bytes):
+        try:
+            message = zlib.decompress(message, 16 + zlib.MAX_WBITS)
+        except zlib.error:
+            try:
+                message = zlib.decompress(message)
+            except zlib.error:
+                pass
+    return json_loads(message)
+
+
+# ================== Stream Connection ==================
+
+
+class StreamConnection:
+    # One websocket per market: CoinEx takes a single kline subscription
+    # per connection and a new kline.subscribe replaces the previous one.
+    # Updates of other markets are ignored
+
+    def __init__(self, manager, market):
+        self.manager = manager
+        self.market = market
+        self.name = market
+        self.ws = None
+        self.connected = False
+        self.opened = False
+        self.last_message = 0.0
+        self.reconnects = 0
+        self._request_id = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run,
+                                        name=f'stream-{self.name}',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._set_live(False)
+        if self.ws:
+            self.ws.close()
+
+    def send(self, method, params):
+        with self._lock:
+            self._request_id += 1
+            request_id = self._request_id
+        self.ws.send(
+            json.dumps({
+                'method': method,
+                'params': params,
+                'id': request_id
+            }))
+
+    def _run(self):
+        import websocket
+
+        attempt = 0
+        while not self._stop.is_set():
+            self.ws = websocket.WebSocketApp(self.manager.ws_url,
+                                             on_open=self._on_open,
+                                             on_message=self._on_message,
+                                             on_error=self._on_error)
+            self.opened = False
+            try:
+                self.ws.run_forever(ping_interval=PING_INTERVAL,
+                                    ping_timeout=PING_TIMEOUT)
+            except Exception as e:
+                self.manager.log(f"Stream {self.name} failed: {str(e)}")
+            self._mark_disconnected()
+            if self._stop.is_set():
+                break
+            delay = random.uniform(
+                0, min(RECONNECT_CAP, RECONNECT_BASE * (2**attempt)))
+            attempt = 0 if self.opened else attempt + 1
+            self.reconnects += 1
+            self.manager.log(
+                f"Stream {self.name} disconnected. Reconnecting in {delay:.1f} seconds..."
+            )
+            self._stop.wait(delay)
+
+    def _on_open(self, ws):
+        self.opened = True
+        self.last_message = time.time()
+        with self._lock:
+            self.connected = True
+        # Fills whatever was missed while disconnected before going live
+        self.manager.resync(self.market)
+        self.send('kline.subscribe',
+                  [self.market, TIMEFRAME_SECONDS[STREAM_TIMEFRAME]])
+        self.send('deals.subscribe', [self.market])
+        if not self._stop.is_set():
+            self._set_live()
+
+    def _set_live(self, live=True):
+        for timeframe in [STREAM_TIMEFRAME] + DERIVED_TIMEFRAMES:
+            self.manager.store.set_live(self.market, timeframe, live)
+
+    def _on_error(self, ws, error):
+        self.manager.log(f"Stream {self.name} error: {str(error)}")
+
+    def _mark_disconnected(self):
+        with self._lock:
+            self.connected = False
+        self._set_live(False)
+
+    def _on_message(self, ws, message):
+        self.last_message = time.time()
+        try:
+            data = decode_message(message)
+        except Exception as e:
+            self.manager.log(
+                f"Invalid message on stream {self.name}: {str(e)}")
+            return
+        method = data.get('method')
+        if method == 'kline.update':
+            for row in data.get('params') or []:
+                # Rows carry the market as their 8th field
+                if len(row) <= 7 or row[7] == self.market:
+                    self.manager.on_kline(self.market, parse_kline_row(row))
+        elif method == 'deals.update':
+            params = data.get('params') or []
+            if len(params) >= 2 and params[0] == self.market and params[1]:
+                self.manager.on_price(self.market,
+                                      float(params[1][0]['price']))
+        elif method == 'state.update':
+            for states in data.get('params') or []:
+                state = states.get(self.market)
+                if state and 'last' in state:
+                    self.manager.on_price(self.market, float(state['last']))
+
+
+# ================== Stream Manager ==================
+
+
+class StreamManager:
+    # Keeps candle_store up to date from CoinEx websockets and calls
+    # on_candle_close(market, timeframe) whenever a candle closes, and
+    # on_price(market, price) on every price update. `streams` maps every
+    # market to its StreamConnection. A gap in a market's candles is
+    # refetched on `executor` (by default a thread of the manager's own),
+    # so the socket's reader thread never waits for the REST API
+
+    def __init__(self,
+                 markets,
+                 store,
+                 resync,
+                 on_candle_close,
+                 log=print,
+                 ws_url=None,
+                 on_price=None,
+                 executor=None):
+        self.store = store
+        self.resync_market = resync
+        self.on_candle_close = on_candle_close
+        self.price_callback = on_price
+        self.log = log
+        self.ws_url = ws_url or COINEX_WS_URL
+        self.streams = {}
+        self.prices = {}
+        self._own_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='stream-resync')
+        # Updates received while their market is resynced, per market
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watchdog = None
+        for market in markets:
+            self.streams[market] = StreamConnection(self, market)
+
+    @property
+    def connections(self):
+        return list(self.streams.values())
+
+    def start(self):
+        for connection in self.connections:
+            connection.start()
+        self._watchdog = threading.Thread(target=self._watch,
+                                          name='stream-watchdog',
+                                          daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        self._stop.set()
+        for connection in self.connections:
+            connection.stop()
+        if self._own_executor:
+            self.executor.shutdown(wait=False)
+
+    def add(self, market):
+        if market in self.streams or self._stop.is_set():
+            return
+        connection = StreamConnection(self, market)
+        self.streams[market] = connection
+        connection.start()
+
+    def remove(self, market):
+        connection = self.streams.pop(market, None)
+        if connection is not None:
+            connection.stop()
+
+    def resync(self, market):
+        try:
+            self.resync_market(market)
+        except Exception as e:
+            self.log(f"Error resyncing {market}: {str(e)}")
+
+    def on_kline(self, market, kline):
+        step = TIMEFRAME_SECONDS[STREAM_TIMEFRAME]
+        with self._lock:
+            pending = self._pending.get(market)
+            if pending is not None:
+                pending.append(kline)
+                return
+            last_time = self.store.last_time(market, STREAM_TIMEFRAME)
+            if last_time is not None and kline['time'] > last_time + step:
+                # Candles were missed; they are refetched before this and
+                # any later update of the market is applied
+                self._pending[market] = [kline]
+                self.store.set_live(market, STREAM_TIMEFRAME, False)
+                try:
+                    self.executor.submit(self._resync_gap, market, last_time)
+                except RuntimeError:
+                    # Stopped
+                    del self._pending[market]
+                return
+        self._apply(market, kline, last_time)
+
+    def _resync_gap(self, market, last_time):
+        self.resync(market)
+        while True:
+            with self._lock:
+                pending = self._pending[market]
+                if not pending:
+                    del self._pending[market]
+                    connection = self.streams.get(market)
+                    if connection and connection.connected:
+                        self.store.set_live(market, STREAM_TIMEFRAME)
+                    return
+                self._pending[market] = []
+            for kline in pending:
+                self._apply(market, kline, last_time)
+                last_time = self.store.last_time(market, STREAM_TIMEFRAME)
+
+    def _apply(self, market, kline, last_time):
+        # `last_time` is the time of the newest stored candle before a
+        # resync, if any, stored the candles up to `kline`
+        closed = self.store.update(market, STREAM_TIMEFRAME, kline)
+        if closed is None and last_time is not None and kline[
+                'time'] > last_time:
+            # The resync already stored the new candle
+            closed = last_time
+        closed_timeframes = [STREAM_TIMEFRAME] if closed is not None else []
+        for timeframe in DERIVED_TIMEFRAMES:
+            tf_step = TIMEFRAME_SECONDS[timeframe]
+            bucket_time = kline['time'] - kline['time'] % tf_step
+            if self.store.rebuild_bucket(market, STREAM_TIMEFRAME, timeframe,
+                                         bucket_time) is not None:
+                closed_timeframes.append(timeframe)
+        for timeframe in closed_timeframes:
+            try:
+                self.on_candle_close(market, timeframe)
+            except Exception as e:
+                self.log(f"Error handling candle close for {market}: {str(e)}")
+
+    def on_price(self, market, price):
+        self.prices[market] = (price, time.time())
+        if self.price_callback:
+            try:
+                self.price_callback(market, price)
+            except Exception as e:
+                self.log(f"Error handling price of {market}: {str(e)}")
+
+    def last_price(self, market, max_age=PRICE_MAX_AGE):
+        price = self.prices.get(market)
+        if price and time.time() - price[1] <= max_age:
+            return price[0]
+        return None
+
+    def _watch(self):
+        while not self._stop.wait(PING_INTERVAL):
+            now = time.time()
+            for connection in list(self.connections):
+                if not connection.connected:
+                    continue
+                try:
+                    if now - connection.last_message > STALE_SECONDS:
+                        self.log(f"Stream {connection.name} is stale.")
+                        connection.ws.close()
+                    else:
+                        connection.send('server.ping', [])
+                except Exception as e:
+                    self.log(
+                        f"Error pinging stream {connection.name}: {str(e)}")
@@ -0,0 +1,152 @@
+import argparse
+import json
+import os
+import threading
+
+from snapshot import write_atomic
+
+# python subscriptions.py add 146323300 --markets BTCUSDT,ETHUSDT --risks "Very Low,Low"
+# python subscriptions.py remove 146323300
+# python subscriptions.py list
+
+# ================== Settings ==================
+SUBSCRIBERS_FILE = os.environ.get('BOT_SUBSCRIBERS', 'subscribers.json')
+SUBSCRIBERS_VERSION = 1
+RISK_LEVELS = ['Very Low', 'Low', 'Medium']
+# Market filter that matches every market
+ALL_MARKETS = '*'
+
+# ================== Registry ==================
+
+
+class SubscriptionRegistry:
+    # Chats and the markets/risk levels they want signals for. Filters are
+    # indexed by (market, risk) so routing a signal only touches the chats
+    # that match it, however many subscribers there are
+
+    def __init__(self):
+        self._subscribers = {}
+        self._index = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def add(self, chat_id, markets=None, risks=None):
+        # Replaces any earlier filter of `chat_id`; None means everything
+        chat_id = str(chat_id)
+        markets = sorted(set(markets)) if markets else [ALL_MARKETS]
+        risks = sorted(set(risks)) if risks else list(RISK_LEVELS)
+        unknown = set(risks) - set(RISK_LEVELS)
+        if unknown:
+            raise ValueError(f"Unknown risk levels: {', '.join(unknown)}")
+        with self._lock:
+            self._unindex(chat_id)
+            self._subscribers[chat_id] = {'markets': markets, 'risks': risks}
+            for market in markets:
+                for risk in risks:
+                    self._index.setdefault((market, risk), set()).add(chat_id)
+
+    def remove(self, chat_id):
+        chat_id = str(chat_id)
+        with self._lock:
+            self._unindex(chat_id)
+            return self._subscribers.pop(chat_id, None) is not None
+
+    def _unindex(self, chat_id):
+        subscriber = self._subscribers.get(chat_id)
+        if not subscriber:
+            return
+        for market in subscriber['markets']:
+            for risk in subscriber['risks']:
+                chats = self._index.get((market, risk))
+                if chats:
+                    chats.discard(chat_id)
+                    if not chats:
+                        del self._index[(market, risk)]
+
+    def route(self, market, risk):
+        # Chats subscribed to signals of `market` with `risk`
+        with self._lock:
+            return list(
+                self._index.get((market, risk), set())
+                | self._index.get((ALL_MARKETS, risk), set()))
+
+    def subscribers(self):
+        with self._lock:
+            return {
+                chat_id: dict(subscriber)
+                for chat_id, subscriber in self._subscribers.items()
+            }
+
+    def save(self, path=SUBSCRIBERS_FILE):
+        data = {
+            'version': SUBSCRIBERS_VERSION,
+            'subscribers': [
+                dict(subscriber, chat_id=chat_id)
+                for chat_id, subscriber in self.subscribers().items()
+            ]
+        }
+        write_atomic(path, json.dumps(data, indent=1))
+
+    @classmethod
+    def load(cls, path=SUBSCRIBERS_FILE, default_chat=None):
+        # Without a subscribers file `default_chat` gets every signal
+        registry = cls()
+        if not os.path.exists(path):
+            if default_chat:
+                registry.add(default_chat)
+            return registry
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('version') != SUBSCRIBERS_VERSION:
+            raise ValueError(
+                f"Subscribers file version {data.get('version')} is not supported"
+            )
+        for subscriber in data['subscribers']:
+            markets = [m for m in subscriber['markets'] if m != ALL_MARKETS]
+            registry.add(subscriber['chat_id'], markets, subscriber['risks'])
+        return registry
+
+
+# ================== Main ==================
+
+
+def split_list(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Signal subscribers")
+    parser.add_argument('--file', default=SUBSCRIBERS_FILE)
+    commands = parser.add_subparsers(dest='command', required=True)
+    adder = commands.add_parser('add')
+    adder.add_argument('chat_id')
+    adder.add_argument('--markets',
+                       type=split_list,
+                       help="comma separated markets (default: all)")
+    adder.add_argument('--risks',
+                       type=split_list,
+                       help="comma separated risk levels out of "
+                       f"{', '.join(RISK_LEVELS)} (default: all)")
+    remover = commands.add_parser('remove')
+    remover.add_argument('chat_id')
+    commands.add_parser('list')
+    args = parser.parse_args(argv)
+
+    registry = SubscriptionRegistry.load(args.file)
+    if args.command == 'add':
+        registry.add(args.chat_id, args.markets, args.risks)
+        registry.save(args.file)
+    elif args.command == 'remove':
+        if not registry.remove(args.chat_id):
+            print(f"{args.chat_id} is not subscribed")
+        registry.save(args.file)
+    else:
+        for chat_id, subscriber in registry.subscribers().items():
+            print(f"{chat_id:<16} {','.join(subscriber['markets']):<40} "
+                  f"{','.join(subscriber['risks'])}")
+
+
+if __name__ == "__main__":
+    main()
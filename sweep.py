@@ -0,0 +1,178 @@
+import argparse
+import csv
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import bot_code
+import backtest
+
+# python sweep.py --data history/ --markets BTCUSDT,ETHUSDT \
+#     --grid swing_width=2,3 signal_cooldown=180,900 stop_offset_divisor=2,4
+
+# ================== Settings ==================
+RESULT_FIELDS = ['market', 'signals', 'stop_rate', 'target1_rate',
+                 'target2_rate', 'target3_rate', 'seconds']
+
+# Candle history opened by each worker process; archives and .npy files
+# are memory-mapped read-only, so every worker shares the OS page cache
+# instead of holding its own copy of the dataset
+_data_dir = None
+_histories = {}
+
+# ================== Worker ==================
+
+
+def _init_worker(data_dir):
+    global _data_dir
+    _data_dir = data_dir
+    _histories.clear()
+
+
+def _history(market):
+    history = _histories.get(market)
+    if history is None:
+        history = backtest.load_history(_data_dir, market)
+        _histories[market] = history
+    return history
+
+
+def run_task(params, market, horizon):
+    start = time.perf_counter()
+    history = _history(market)
+    signals = backtest.replay_market(market, history, params)
+    backtest.evaluate_outcomes(signals, history['3min'], horizon)
+    summary = backtest.summarize(signals)
+    row = dict(params, market=market)
+    row['signals'] = summary['signals']
+    for name in backtest.OUTCOMES:
+        row[f'{name}_rate'] = round(summary[f'{name}_rate'], 4)
+    row['seconds'] = round(time.perf_counter() - start, 3)
+    return row
+
+
+# ================== Sweep ==================
+
+
+def parse_grid(items):
+    # ['swing_width=2,3', ...] -> [{'swing_width': 2, ...}, ...]
+    names, values = [], []
+    for item in items:
+        name, _, options = item.partition('=')
+        if name not in bot_code.STRATEGY:
+            raise ValueError(f"Unknown strategy parameter: {name}")
+        if name not in backtest.REPLAY_PARAMS:
+            # Every value would replay the same signals
+            raise ValueError(f"Strategy parameter not used by the backtest: "
+                             f"{name}")
+        kind = type(bot_code.STRATEGY[name])
+        names.append(name)
+        values.append([kind(option) for option in options.split(',')])
+    return [dict(zip(names, combo)) for combo in itertools.product(*values)]
+
+
+def prepare_data(data_dir, markets, synthetic_days):
+    # Synthetic history is generated once and saved so workers can map it
+    for seed, market in enumerate(markets):
+        path = os.path.join(data_dir, f"{market}_3min.npy")
+        if synthetic_days and not os.path.exists(path):
+            backtest.save_history(
+                data_dir, market,
+                backtest.synthetic_history(market, synthetic_days, seed))
+
+
+def rank(rows):
+    # Best first: most signals reaching target 1, then fewest stopped out
+    return sorted(rows,
+                  key=lambda r: (-r['target1_rate'], r['stop_rate'],
+                                 -r['signals']))
+
+
+def run_sweep(grid, markets, data_dir, output, workers=None,
+              horizon=backtest.OUTCOME_HORIZON):
+    # Rows are written to `output` as soon as each (params, market) task
+    # finishes, and returned ranked
+    fields = list(grid[0]) + RESULT_FIELDS
+    rows = []
+    with open(output, 'w', newline='') as f, ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(data_dir, )) as executor:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        # Market-major order keeps each worker on few markets
+        futures = [
+            executor.submit(run_task, params, market, horizon)
+            for market in markets for params in grid
+        ]
+        for future in as_completed(futures):
+            row = future.result()
+            writer.writerow(row)
+            f.flush()
+            rows.append(row)
+    return rank(rows)
+
+
+def print_summary(grid, rows):
+    # Signal-weighted rates of every parameter set over all markets
+    names = list(grid[0])
+    print(' '.join(f"{name:>20}" for name in names) +
+          f" {'signals':>8} {'stop':>7} {'target1':>8} {'target2':>8} "
+          f"{'target3':>8}")
+    for params in grid:
+        selected = [
+            r for r in rows if all(r[n] == params[n] for n in names)
+        ]
+        signals = sum(r['signals'] for r in selected)
+
+        def rate(name):
+            if not signals:
+                return 0.0
+            return sum(r[f'{name}_rate'] * r['signals']
+                       for r in selected) / signals
+
+        print(' '.join(f"{params[name]:>20}" for name in names) +
+              f" {signals:>8} {rate('stop'):>7.1%} {rate('target1'):>8.1%} "
+              f"{rate('target2'):>8.1%} {rate('target3'):>8.1%}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Strategy parameter sweep")
+    parser.add_argument('--data',
+                        default='sweep_data',
+                        help="candle archive or directory with "
+                        "MARKET_TIMEFRAME.npy files")
+    parser.add_argument('--markets',
+                        default=','.join(bot_code.REQUESTED_MARKETS),
+                        help="comma separated markets, or a count with "
+                        "--synthetic-days")
+    parser.add_argument('--synthetic-days', type=int)
+    parser.add_argument('--grid',
+                        nargs='+',
+                        default=['swing_width=2,3', 'stop_offset_divisor=2,4'],
+                        help="name=value1,value2 ... over backtest.REPLAY_PARAMS")
+    parser.add_argument('--horizon',
+                        type=int,
+                        default=backtest.OUTCOME_HORIZON)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--output', default='sweep_results.csv')
+    args = parser.parse_args(argv)
+
+    if args.synthetic_days and args.markets.isdigit():
+        markets = [f"SYN{i}USDT" for i in range(int(args.markets))]
+    else:
+        markets = [m for m in args.markets.split(',') if m]
+    grid = parse_grid(args.grid)
+    prepare_data(args.data, markets, args.synthetic_days)
+
+    start = time.perf_counter()
+    rows = run_sweep(grid, markets, args.data, args.output, args.workers,
+                     args.horizon)
+    print_summary(grid, rows)
+    print(f"{len(rows)} runs in {time.perf_counter() - start:.1f} seconds, "
+          f"results in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+from array import array
+from bisect import bisect_right
+
+import numpy as np
+
+# Default number of highs (and of lows) kept per market and timeframe
+MAX_SWINGS = 50
+
+# ================== Swing Series ==================
+
+
+class SwingSeries:
+    # Time-sorted pivots kept in two flat arrays and capped at `maxlen`, the
+    # oldest pivot being dropped first. Indexing returns {'time', 'price'}
+    # dicts like the lists it replaces
+
+    __slots__ = ('times', 'prices', 'maxlen')
+
+    def __init__(self, maxlen=MAX_SWINGS, pivots=()):
+        self.times = array('q')
+        self.prices = array('d')
+        self.maxlen = maxlen
+        for pivot in pivots:
+            self.append(pivot)
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [{
+                'time': t,
+                'price': p
+            } for t, p in zip(self.times[index], self.prices[index])]
+        return {'time': self.times[index], 'price': self.prices[index]}
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __eq__(self, other):
+        if isinstance(other, SwingSeries):
+            return self.times == other.times and self.prices == other.prices
+        return self[:] == list(other)
+
+    def __repr__(self):
+        return f"SwingSeries({self[:]!r})"
+
+    def append(self, pivot):
+        self.append_pivot(pivot['time'], pivot['price'])
+
+    def append_pivot(self, time, price):
+        self.times.append(time)
+        self.prices.append(price)
+        if len(self.times) > self.maxlen:
+            del self.times[0]
+            del self.prices[0]
+
+    def pop(self):
+        pivot = self[-1]
+        del self.times[-1]
+        del self.prices[-1]
+        return pivot
+
+    def copy(self):
+        series = SwingSeries(self.maxlen)
+        series.times = self.times[:]
+        series.prices = self.prices[:]
+        return series
+
+    def has_between(self, start_time, end_time):
+        # Whether a pivot lies strictly between the two times, O(log n)
+        index = bisect_right(self.times, start_time)
+        return index < len(self.times) and self.times[index] < end_time
+
+    def to_list(self):
+        return [[t, p] for t, p in zip(self.times, self.prices)]
+
+    @classmethod
+    def from_list(cls, pivots, maxlen=MAX_SWINGS):
+        series = cls(maxlen)
+        for t, p in pivots:
+            series.append_pivot(t, p)
+        return series
+
+
+def new_swings(maxlen=MAX_SWINGS):
+    return {'highs': SwingSeries(maxlen), 'lows': SwingSeries(maxlen)}
+
+
+def copy_swings(swings):
+    return {'highs': swings['highs'].copy(), 'lows': swings['lows'].copy()}
+
+
+# ================== Vectorized Swing Detection ==================
+
+
+def find_pivots(high, low, start=0, width=2):
+    # Indices i in [start + width, n - width) whose high (low) is strictly
+    # above (below) the `width` candles on each side
+    n = len(high)
+    first = start + width
+    last = n - width
+    if last <= first:
+        empty = np.empty(0, dtype=np.intp)
+        return empty, empty
+    center_high = high[first:last]
+    center_low = low[first:last]
+    is_high = np.ones(last - first, dtype=bool)
+    is_low = np.ones(last - first, dtype=bool)
+    for k in range(1, width + 1):
+        is_high &= center_high > high[first - k:last - k]
+        is_high &= center_high > high[first + k:last + k]
+        is_low &= center_low < low[first - k:last - k]
+        is_low &= center_low < low[first + k:last + k]
+    return np.flatnonzero(is_high) + first, np.flatnonzero(is_low) + first
+
+
+def apply_pivot(swings, is_low, pivot_time, price):
+    # A pivot replaces the previous one of the same kind when no opposite
+    # pivot lies between them, keeping highs and lows alternating. Returns
+    # whether the pivot was added
+    if is_low:
+        same, opposite = swings['lows'], swings['highs']
+    else:
+        same, opposite = swings['highs'], swings['lows']
+    if same:
+        last_time = same.times[-1]
+        if pivot_time <= last_time:
+            return False
+        if not opposite.has_between(last_time, pivot_time):
+            same.pop()
+    same.append_pivot(pivot_time, price)
+    return True
+
+
+def merge_pivots(swings, times, highs, lows, high_idx, low_idx):
+    # Applies pivots in candle order, a high before a low on the same candle
+    order = np.concatenate((high_idx * 2, low_idx * 2 + 1))
+    order.sort()
+    times = times.tolist()
+    highs = highs.tolist()
+    lows = lows.tolist()
+    new_swing_detected = False
+    for key in order.tolist():
+        i, is_low = divmod(key, 2)
+        if apply_pivot(swings, is_low, times[i],
+                       lows[i] if is_low else highs[i]):
+            new_swing_detected = True
+    return new_swing_detected
+
+
+def detect_swings_columnar(candles, start, swings, width=2):
+    high_idx, low_idx = find_pivots(candles.high, candles.low, start, width)
+    return merge_pivots(swings, candles.time, candles.high, candles.low,
+                        high_idx, low_idx)
@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+import indicators
+
+# pandas implementation of the indicator definitions in indicators.py, the
+# oracle of tests/test_indicators.py (benchmark.py times it too)
+
+
+def pandas_indicators(candles, periods=indicators.PERIODS):
+    close = pd.Series(candles.close)
+    high = pd.Series(candles.high)
+    low = pd.Series(candles.low)
+    volume = pd.Series(candles.volume)
+    prev_close = close.shift()
+    true_range = pd.concat(
+        [high - low, (high - prev_close).abs(), (low - prev_close).abs()],
+        axis=1).max(axis=1)
+    change = close.diff()
+    gain = change.clip(lower=0).ewm(alpha=1 / periods['rsi'],
+                                    adjust=False).mean()
+    loss = (-change).clip(lower=0).ewm(alpha=1 / periods['rsi'],
+                                       adjust=False).mean()
+    rsi = (100 * gain / (gain + loss)).where(gain + loss > 0, 50.0)
+    rsi.iloc[0] = np.nan
+    rolling_volume = volume.rolling(periods['volume_z'])
+    std = rolling_volume.std()
+    volume_z = ((volume - rolling_volume.mean()) / std).where(std > 0, 0.0)
+    volume_z[std.isna()] = np.nan
+    window = periods['channel_width']
+    return {
+        'ema_fast': close.ewm(span=periods['ema_fast'], adjust=False).mean(),
+        'ema_slow': close.ewm(span=periods['ema_slow'], adjust=False).mean(),
+        'atr': true_range.ewm(alpha=1 / periods['atr'], adjust=False).mean(),
+        'rsi': rsi,
+        'volume_z': volume_z,
+        'channel_width': (high.rolling(window).max() -
+                          low.rolling(window).min()) / close
+    }
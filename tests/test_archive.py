@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+import bot_code
+from archive import CandleArchive
+from candle_store import CandleStore, KLINE_WINDOW, has_gap
+from candles import Candles, synthetic_candles
+
+# warm_start seeds candle_store only from archive windows without holes
+
+STEP = 180
+NOW = 1700000000 + 1000 * STEP
+
+
+@pytest.fixture
+def archive(tmp_path, monkeypatch):
+    archive = CandleArchive(str(tmp_path))
+    monkeypatch.setattr(bot_code, 'candle_archive', archive)
+    monkeypatch.setattr(bot_code, 'candle_store', CandleStore())
+    return archive
+
+
+def test_archived_window_seeds_the_store(archive):
+    candles = synthetic_candles(500)
+    assert archive.append('BTCUSDT', '3min', candles, now=NOW) == 500
+    bot_code.warm_start(['BTCUSDT'], timeframes=('3min', ))
+    stored = bot_code.candle_store.get('BTCUSDT', '3min')
+    assert len(stored) == KLINE_WINDOW
+    assert np.array_equal(stored.time, candles.time[-KLINE_WINDOW:])
+
+
+def test_window_with_a_hole_is_left_for_a_full_fetch(archive):
+    # Candles archived before and after a downtime of 300 candles
+    candles = synthetic_candles(700)
+    before, after = candles[:300], candles[600:]
+    archive.append('BTCUSDT', '3min', before, now=NOW)
+    archive.append('BTCUSDT', '3min', after, now=NOW)
+    assert has_gap(archive.read('BTCUSDT', '3min', limit=KLINE_WINDOW),
+                   '3min')
+    bot_code.warm_start(['BTCUSDT'], timeframes=('3min', ))
+    assert bot_code.candle_store.get('BTCUSDT', '3min') is None
+    assert bot_code.candle_store.delta_limit('BTCUSDT', '3min',
+                                             KLINE_WINDOW) is None
+
+
+def test_has_gap():
+    candles = synthetic_candles(10)
+    assert not has_gap(candles, '3min')
+    assert not has_gap(candles[:1], '3min')
+    holed = Candles.concat((candles[:4], candles[5:]))
+    assert has_gap(holed, '3min')
+    # Candles of a larger timeframe are further apart than 3 minutes
+    assert has_gap(candles, '1min')
+
+
+def test_torn_append_is_cut_off(archive):
+    candles = synthetic_candles(20)
+    archive.append('BTCUSDT', '3min', candles[:10], now=NOW)
+    # A crash in the middle of the next append
+    with open(archive.path('BTCUSDT', '3min'), 'ab') as f:
+        f.write(candles[10:11].to_records().tobytes()[:3])
+    assert np.array_equal(archive.read('BTCUSDT', '3min').time,
+                          candles.time[:10])
+    reopened = CandleArchive(archive.root)
+    assert reopened.last_time('BTCUSDT', '3min') == candles.time[9]
+    assert reopened.append('BTCUSDT', '3min', candles, now=NOW) == 10
+    assert np.array_equal(reopened.read('BTCUSDT', '3min').time,
+                          candles.time)
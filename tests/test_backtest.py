@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+import backtest
+import bot_code
+from candle_store import TIMEFRAME_SECONDS
+from indicators import IndicatorStore
+from pipeline import StageCache
+from tracker import SignalTracker
+
+# replay_market against scan_market run at every M3 close over the same
+# candles: the backtest has to send the signals the live bot sends
+
+MARKET = 'SYN1USDT'
+HISTORY = backtest.synthetic_history(MARKET, 8, seed=1)
+# The live bot fetches this many candles of each timeframe
+WINDOW = 200
+
+
+class Clock:
+
+    def __init__(self):
+        self.time = 0
+
+    def now(self):
+        return self.time
+
+
+def live_signals(monkeypatch):
+    # (time, signal, risk, entry) of every signal scan_market sends when
+    # called just after each M3 close, with the candles closed by then
+    clock = Clock()
+    candles = {}
+    signals = []
+
+    def get_klines_cached(market, timeframe='15min', limit=200):
+        return candles[timeframe][-limit:]
+
+    def get_ticker(market, retries=5, delay=1):
+        return float(candles['3min'].close[-1])
+
+    def signal_sink(market, signal, risk, message):
+        if signal in ('Long', 'Short'):
+            signals.append((clock.time, signal, risk, get_ticker(market)))
+        return 1
+
+    for name, value in (('stage_cache', StageCache()),
+                        ('indicator_store', IndicatorStore()),
+                        ('signal_tracker', SignalTracker()),
+                        ('fresh_swings', set()), ('market_status', {}),
+                        ('last_signal_time', {}), ('server_clock', clock),
+                        ('get_klines_cached', get_klines_cached),
+                        ('get_ticker', get_ticker),
+                        ('signal_sink', signal_sink)):
+        monkeypatch.setattr(bot_code, name, value)
+    state = {MARKET: bot_code.new_market_state()}
+    for time in HISTORY['3min'].time[1:].tolist():
+        clock.time = time + TIMEFRAME_SECONDS['3min']
+        for timeframe, history in HISTORY.items():
+            closed = np.searchsorted(
+                history.time,
+                clock.time - TIMEFRAME_SECONDS[timeframe],
+                side='right')
+            candles[timeframe] = history[max(0, closed - WINDOW):closed]
+        bot_code.scan_market(MARKET, state, {MARKET: 0}, [MARKET])
+    return signals
+
+
+def replay_signals():
+    return [(s['time'], s['signal'], s['risk'], s['entry'])
+            for s in backtest.replay_market(MARKET, HISTORY)]
+
+
+@pytest.fixture(autouse=True)
+def no_cooldown(monkeypatch):
+    # The live cooldown runs on the wall clock
+    monkeypatch.setitem(bot_code.STRATEGY, 'signal_cooldown', 0)
+
+
+def after_warm_up(signals):
+    start = HISTORY['3min'].time[WINDOW]
+    return [signal for signal in signals if signal[0] > start]
+
+
+def test_replay_sends_the_live_signals(monkeypatch):
+    live = after_warm_up(live_signals(monkeypatch))
+    replay = after_warm_up(replay_signals())
+    assert len(live) > 10
+    # The live bot only searches the last swing_lookback_slow H1 candles
+    # when a scan gets to the H1 stage, so the risk can differ
+    assert [s[:2] + s[3:] for s in live] == [s[:2] + s[3:] for s in replay]
+
+
+def test_risk_matches_with_the_whole_h1_window(monkeypatch):
+    monkeypatch.setitem(bot_code.STRATEGY, 'swing_lookback_slow', WINDOW)
+    assert after_warm_up(live_signals(monkeypatch)) == after_warm_up(
+        replay_signals())
@@ -0,0 +1,167 @@
+import pytest
+
+import bot_code
+from candles import resample, synthetic_candles
+from indicators import IndicatorStore
+from pipeline import StageCache
+from tracker import SignalTracker
+
+# analyze_batch followed by scan_market against scan_market alone, and
+# scans on the ScanPool threads against serial ones, over the same synthetic
+# markets: all have to send the same signals and stop every scan at the same
+# stage
+
+MARKETS = [f"SYN{i}USDT" for i in range(24)]
+STEP = 180
+# Cycles of CYCLE_CANDLES M3 candles each, so an M15 candle closes on every
+# cycle, after FIRST_CANDLES candles of history
+CYCLES = 40
+CYCLE_CANDLES = 5
+FIRST_CANDLES = 1000
+HISTORY = {
+    market: synthetic_candles(FIRST_CANDLES + CYCLES * CYCLE_CANDLES,
+                              seed=seed)
+    for seed, market in enumerate(MARKETS)
+}
+
+
+class Clock:
+
+    def __init__(self):
+        self.time = 0
+
+    def now(self):
+        return self.time
+
+
+class Replay:
+    # The candles and price each market had at the current cycle, served in
+    # place of the CoinEx API
+
+    def __init__(self):
+        self.clock = Clock()
+        self.candles = {}
+        self.signals = []
+        self.cycle = 0
+
+    def move_to(self, cycle):
+        self.cycle = cycle
+        end = FIRST_CANDLES + cycle * CYCLE_CANDLES
+        for market, history in HISTORY.items():
+            m3 = history[:end]
+            self.candles[market] = {
+                '3min': m3[-200:],
+                '15min': resample(m3, 900)[-200:],
+                '1hour': resample(m3, 3600)[-200:]
+            }
+        self.clock.time = int(m3.time[-1]) + STEP
+
+    def get_klines_cached(self, market, timeframe='15min', limit=200):
+        return self.candles[market][timeframe][-limit:]
+
+    def get_ticker(self, market, retries=5, delay=1):
+        return float(self.candles[market]['3min'].close[-1])
+
+    def signal_sink(self, market, signal, risk, message):
+        self.signals.append((self.cycle, market, signal, risk))
+        return 1
+
+
+@pytest.fixture
+def replay(monkeypatch):
+    replay = Replay()
+    monkeypatch.setattr(bot_code, 'server_clock', replay.clock)
+    monkeypatch.setattr(bot_code, 'get_klines_cached',
+                        replay.get_klines_cached)
+    monkeypatch.setattr(bot_code, 'get_ticker', replay.get_ticker)
+    monkeypatch.setattr(bot_code, 'signal_sink', replay.signal_sink)
+    monkeypatch.setitem(bot_code.STRATEGY, 'signal_cooldown', 0)
+    return replay
+
+
+def run(monkeypatch, replay, batched, max_concurrency=None):
+    # Signals, the stage every scan stopped at per cycle and how many
+    # scan_market calls there were. Scans run serially, or on the ScanPool
+    # with `max_concurrency`
+    for name, value in (('stage_cache', StageCache()),
+                        ('indicator_store', IndicatorStore()),
+                        ('signal_tracker', SignalTracker()),
+                        ('fresh_swings', set()), ('market_status', {}),
+                        ('last_signal_time', {}), ('batch_books', {})):
+        monkeypatch.setattr(bot_code, name, value)
+    replay.signals = []
+    state = {market: bot_code.new_market_state() for market in MARKETS}
+    error_counts = dict.fromkeys(MARKETS, 0)
+    active_markets = list(MARKETS)
+    cycles = []
+    scans = 0
+    for cycle in range(CYCLES):
+        replay.move_to(cycle)
+        prefetched = {market: None for market in MARKETS}
+        if batched:
+            # The markets the batch pass stopped are not scanned
+            prefetched, _ = bot_code.analyze_batch(MARKETS, state,
+                                                   error_counts)
+        scans += len(prefetched)
+
+        def scan(market):
+            return bot_code.scan_market(market,
+                                        state,
+                                        error_counts,
+                                        active_markets,
+                                        prefetched=prefetched[market])
+
+        if max_concurrency:
+            bot_code.scan_markets_concurrent(list(prefetched), scan,
+                                             max_concurrency)
+        else:
+            bot_code.scan_markets_serial(list(prefetched), scan)
+        cycles.append({
+            market: {
+                key: value
+                for key, value in bot_code.market_status[market].items()
+                if key not in ('last_scan', 'scan_seconds')
+            }
+            for market in MARKETS
+        })
+    # Markets stopped by the batch pass follow their open signals before
+    # the others are scanned, so only the order within a cycle may differ
+    return sorted(replay.signals), cycles, scans
+
+
+def test_batch_matches_per_market_scans(monkeypatch, replay):
+    signals, stages, scans = run(monkeypatch, replay, batched=False)
+    batch_signals, batch_stages, batch_scans = run(monkeypatch,
+                                                   replay,
+                                                   batched=True)
+    assert batch_signals == signals
+    assert batch_stages == stages
+    # Most markets stop at a batch stage and are not scanned one by one
+    assert batch_scans < scans / 2
+    # The markets got through every stage, and stopped at most of them
+    assert signals
+    reached = {
+        status['stage']
+        for cycle in stages for status in cycle.values()
+    }
+    assert {'trend_m15', 'momentum', 'signal'} <= reached
+    assert 'error' not in reached
+
+
+def without_ids(signals):
+    # Stops and targets name the signal by its id, which the tracker gives
+    # out in the order the pool threads open signals
+    return sorted((cycle, market, ' '.join(signal.split()[:2]), risk)
+                  for cycle, market, signal, risk in signals)
+
+
+def test_pool_matches_serial_scans(monkeypatch, replay):
+    signals, stages, scans = run(monkeypatch, replay, batched=False)
+    pool_signals, pool_stages, pool_scans = run(monkeypatch,
+                                                replay,
+                                                batched=False,
+                                                max_concurrency=8)
+    assert signals
+    assert without_ids(pool_signals) == without_ids(signals)
+    assert pool_stages == stages
+    assert pool_scans == scans
@@ -0,0 +1,148 @@
+import pytest
+
+import bot_code
+from archive import CandleArchive
+from candle_store import CandleStore, DELTA_OVERLAP, KLINE_WINDOW
+from fake_servers import FakeCoinexServer, generate_rows
+
+# get_klines_cached against the fake CoinEx API: after one full fetch the
+# store is kept current with small delta fetches
+
+MARKET = 'BTCUSDT'
+STEP = 180
+# Two minutes into an M3 candle, which is still open
+START = 1700000000 - 1700000000 % STEP + 120
+TIMEFRAMES = ('3min', '15min', '1hour')
+
+
+class Clock:
+
+    def __init__(self, now):
+        self.time = now
+
+    def now(self):
+        return self.time
+
+
+@pytest.fixture
+def coinex(tmp_path, monkeypatch):
+    server = FakeCoinexServer([MARKET], candles=2000, end_time=START).start()
+    clock = Clock(START)
+    monkeypatch.setattr(bot_code, 'COINEX_BASE_URL', server.rest_url)
+    monkeypatch.setattr(bot_code, 'server_clock', clock)
+    monkeypatch.setattr(bot_code, 'candle_store', CandleStore())
+    monkeypatch.setattr(bot_code, 'candle_archive',
+                        CandleArchive(str(tmp_path)))
+    server.clock = clock
+    yield server
+    server.stop()
+
+
+def advance(server, candles=1, behind=0):
+    # The exchange opens `candles` M3 candles; the clock moves on as many,
+    # less `behind` when it lags the exchange
+    server.clock.time += (candles - behind) * STEP
+    for _ in range(candles):
+        open_time = server.rows[MARKET][-1][0] + STEP
+        server.push_kline(MARKET, generate_rows(MARKET, 1, open_time,
+                                                seed=open_time)[0])
+
+
+def kline_requests(server):
+    return [
+        query for path, query in server.requests
+        if path.endswith('/market/kline')
+    ]
+
+
+def fetch(timeframe='3min'):
+    return bot_code.get_klines_cached(MARKET, timeframe, KLINE_WINDOW)
+
+
+def assert_matches_server(server, klines, timeframe='3min', closed=False):
+    # With `closed`, the open candle may be as it was at the last fetch
+    rows = server.klines(MARKET, timeframe, KLINE_WINDOW)
+    assert klines.time.tolist() == [row[0] for row in rows]
+    if closed:
+        klines, rows = klines[:-1], rows[:-1]
+    assert klines.close.tolist() == [float(row[2]) for row in rows]
+
+
+def test_delta_fetch_merges_new_candles(coinex):
+    assert_matches_server(coinex, fetch())
+    advance(coinex, 3)
+    klines = fetch()
+    assert_matches_server(coinex, klines)
+    requests = kline_requests(coinex)
+    assert [int(query['limit'])
+            for query in requests] == [KLINE_WINDOW, 3 + DELTA_OVERLAP]
+    assert bot_code.candle_store.stats['deltas'] == 1
+
+
+def test_open_candle_is_replaced(coinex):
+    fetch()
+    # The open candle keeps trading after the fetch, then closes
+    row = list(coinex.rows[MARKET][-1])
+    row[2] = str(float(row[2]) * 1.01)
+    coinex.push_kline(MARKET, row)
+    advance(coinex)
+    klines = fetch()
+    assert_matches_server(coinex, klines)
+    assert klines.close[-2] == float(row[2])
+    assert len(set(klines.time.tolist())) == len(klines)
+
+
+def test_window_keeps_the_newest_candles(coinex):
+    first = fetch()
+    advance(coinex, 5)
+    klines = fetch()
+    assert len(klines) == KLINE_WINDOW
+    assert klines.time[0] == first.time[5]
+    assert klines.time[-1] == first.time[-1] + 5 * STEP
+
+
+def test_nothing_is_fetched_while_the_last_candle_is_open(coinex):
+    fetch()
+    coinex.clock.time += 30
+    fetch()
+    assert len(kline_requests(coinex)) == 1
+
+
+def test_long_pause_reseeds_with_a_full_fetch(coinex):
+    fetch()
+    advance(coinex, KLINE_WINDOW + 10)
+    assert_matches_server(coinex, fetch())
+    assert [int(query['limit']) for query in kline_requests(coinex)
+            ] == [KLINE_WINDOW, KLINE_WINDOW]
+    assert bot_code.candle_store.stats['seeds'] == 2
+
+
+def test_gap_in_the_delta_reseeds(coinex):
+    fetch()
+    # The clock lags the exchange by three candles, so the delta sized by
+    # it does not reach back to the stored candles
+    advance(coinex, 5, behind=3)
+    klines = fetch()
+    assert_matches_server(coinex, klines)
+    assert [int(query['limit']) for query in kline_requests(coinex)
+            ] == [KLINE_WINDOW, 2 + DELTA_OVERLAP, KLINE_WINDOW]
+    assert bot_code.candle_store.stats['seeds'] == 2
+
+
+def test_delta_fetches_cut_kline_rows_tenfold(coinex):
+    # Rows requested over an hour of M3 cycles of the three timeframes,
+    # against a full fetch of each on every cycle
+    cycles = 20
+    for timeframe in TIMEFRAMES:
+        fetch(timeframe)
+    del coinex.requests[:]
+    for _ in range(cycles):
+        advance(coinex)
+        for timeframe in TIMEFRAMES:
+            assert_matches_server(coinex,
+                                  fetch(timeframe),
+                                  timeframe,
+                                  closed=True)
+    rows = sum(int(query['limit']) for query in kline_requests(coinex))
+    full = cycles * len(TIMEFRAMES) * KLINE_WINDOW
+    assert rows * 10 <= full
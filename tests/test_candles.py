@@ -0,0 +1,85 @@
+import importlib.util
+import json
+import sys
+
+import numpy as np
+import pytest
+
+import http_client
+from candles import CANDLE_FIELDS, Candles
+
+# CoinEx kline rows parsed into columnar candles, and JSON decoding with and
+# without orjson
+
+ROWS = [[1700000000, '100.5', '101.25', '102', '99.75', '12.5', '1261.3'],
+        [1700000180, '101.25', '100.8', '101.5', '100.1', '7', '707.2']]
+
+
+def test_rows_into_columns():
+    candles = Candles.from_rows(ROWS)
+    assert len(candles) == 2
+    assert candles.time.dtype == np.int64
+    assert all(
+        getattr(candles, field).dtype == np.float64
+        for field in CANDLE_FIELDS[1:])
+    # Rows are [time, open, close, high, low, volume, amount]; the amount
+    # is dropped
+    assert candles[0] == {
+        'time': 1700000000,
+        'open': 100.5,
+        'close': 101.25,
+        'high': 102.0,
+        'low': 99.75,
+        'volume': 12.5
+    }
+    assert candles.close.tolist() == [101.25, 100.8]
+    assert candles.low.tolist() == [99.75, 100.1]
+    # The time column also comes as a string
+    assert Candles.from_rows([['1700000360', '1', '2', '3', '0.5',
+                               '4']]).time.tolist() == [1700000360]
+
+
+def test_empty_rows():
+    candles = Candles.from_rows([])
+    assert len(candles) == 0
+    assert candles.time.dtype == np.int64
+    assert candles.volume.dtype == np.float64
+
+
+def test_short_rows_are_rejected():
+    with pytest.raises(ValueError):
+        Candles.from_rows([[1700000000, '100.5', '101.25', '102']])
+
+
+RESPONSE = ('{"code":0,"data":[[1700000000,"100.5","101.25","102","99.75",'
+            '"12.5","1261.3"]],"message":"OK","ratio":0.1,"text":"\\u0633"}')
+
+
+class Response:
+
+    def __init__(self, content):
+        self.content = content
+
+
+def without_orjson(monkeypatch):
+    # A fresh copy of http_client imported where orjson is not installed
+    monkeypatch.setitem(sys.modules, 'orjson', None)
+    spec = importlib.util.spec_from_file_location('http_client_stdlib',
+                                                  http_client.__file__)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_stdlib_fallback_decodes_the_same(monkeypatch):
+    stdlib = without_orjson(monkeypatch)
+    assert stdlib.orjson is None
+    expected = json.loads(RESPONSE)
+    for data in (RESPONSE, RESPONSE.encode()):
+        assert stdlib.json_loads(data) == expected
+        assert http_client.json_loads(data) == expected
+    assert stdlib.decode_json(Response(RESPONSE.encode())) == expected
+    assert http_client.decode_json(Response(
+        RESPONSE.encode())) == expected
+    rows = stdlib.decode_json(Response(RESPONSE.encode()))['data']
+    assert Candles.from_rows(rows)[0] == Candles.from_rows(ROWS[:1])[0]
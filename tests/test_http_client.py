@@ -0,0 +1,137 @@
+import random
+import socket
+import threading
+import time
+
+import pytest
+
+import http_client
+from fake_servers import FakeTelegramServer
+from http_client import HttpClient
+
+# Backoff: a retry sleeps only its own caller, and only a host that is
+# throttling, failing or keeps being unreachable pauses every request to it
+
+TOKEN = 'TEST:TOKEN'
+PAUSE = 0.3
+
+
+@pytest.fixture
+def telegram():
+    server = FakeTelegramServer(TOKEN).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # Host pauses take their longest jittered delay
+    monkeypatch.setattr(http_client, 'BACKOFF_BASE', PAUSE)
+    monkeypatch.setattr(random, 'uniform', lambda low, high: high)
+    client = HttpClient(rate_limits={})
+    yield client
+    client.close()
+
+
+def send(client, telegram):
+    url = f"{telegram.url}/bot{TOKEN}/sendMessage"
+    started = time.monotonic()
+    response = client.post(url, params={'chat_id': '1', 'text': 'hi'})
+    return response.status_code, time.monotonic() - started
+
+
+@pytest.mark.parametrize('status', [429, 502])
+def test_throttling_and_server_errors_pause_the_host(client, telegram,
+                                                     status):
+    telegram.fail(1, status=status)
+    assert send(client, telegram)[0] == status
+    status, elapsed = send(client, telegram)
+    assert status == 200
+    assert elapsed >= PAUSE * 0.9
+
+
+def test_pause_grows_with_failures_in_a_row(client, telegram):
+    telegram.fail(2, status=503)
+    send(client, telegram)
+    assert send(client, telegram)[1] >= PAUSE * 0.9
+    # The second failure in a row doubles the pause; a success resets it
+    assert send(client, telegram)[1] >= 2 * PAUSE * 0.9
+    assert send(client, telegram)[1] < PAUSE
+
+
+def test_client_errors_do_not_pause_the_host(client, telegram):
+    telegram.fail(1, status=400)
+    assert send(client, telegram)[0] == 400
+    status, elapsed = send(client, telegram)
+    assert status == 200
+    assert elapsed < PAUSE
+
+
+def refuse(client):
+    # A request to a closed port of the fake's host
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    with pytest.raises(Exception):
+        client.get(f"http://127.0.0.1:{port}/")
+
+
+def test_single_transport_error_does_not_pause_the_host(client, telegram):
+    for _ in range(http_client.TRANSPORT_ERROR_LIMIT - 1):
+        refuse(client)
+        status, elapsed = send(client, telegram)
+        assert status == 200
+        assert elapsed < PAUSE
+
+
+def test_transport_errors_in_a_row_pause_the_host(client, telegram):
+    for _ in range(http_client.TRANSPORT_ERROR_LIMIT):
+        refuse(client)
+    status, elapsed = send(client, telegram)
+    assert status == 200
+    assert elapsed >= PAUSE * 0.9
+
+
+def test_rate_limits_apply_per_endpoint_group(telegram):
+    # One request per PAUSE to the bot's endpoints, none to other paths
+    client = HttpClient(rate_limits={('127.0.0.1', '/bot'): (1 / PAUSE, 1)})
+    started = time.monotonic()
+    for _ in range(2):
+        client.get(f"{telegram.url}/status")
+    assert time.monotonic() - started < PAUSE
+    send(client, telegram)
+    assert send(client, telegram)[1] >= PAUSE * 0.9
+    client.close()
+
+
+def test_backoff_sleeps_only_the_caller(client, telegram):
+    retrying = threading.Thread(target=client.backoff,
+                                args=(2, '/sendMessage'),
+                                kwargs={'base': PAUSE})
+    started = time.monotonic()
+    retrying.start()
+    # Another market's request goes out while the retry sleeps
+    status, elapsed = send(client, telegram)
+    assert status == 200
+    assert elapsed < PAUSE
+    retrying.join()
+    assert time.monotonic() - started >= 4 * PAUSE * 0.9
+    assert client.stats()['/sendMessage']['retries'] == 1
+
+
+def test_host_limit_bounds_requests_in_flight(telegram):
+    # Four requests through two slots take two rounds of the fake's delay
+    telegram.delay = PAUSE
+    client = HttpClient(rate_limits={}, host_limits={'127.0.0.1': 2})
+    threads = [
+        threading.Thread(target=send, args=(client, telegram))
+        for _ in range(4)
+    ]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    client.close()
+    assert time.monotonic() - started >= 2 * PAUSE * 0.9
+    assert len(telegram.messages) == 4
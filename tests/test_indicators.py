@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+
+import indicators
+from candles import synthetic_candles
+
+pytest.importorskip('pandas')
+from pandas_reference import pandas_indicators  # noqa: E402
+
+# The batch and incremental indicators against the pandas reference in
+# pandas_reference.py, which follows the definitions in indicators.py
+
+SIZES = (1, 2, 20, 200, 5000)
+SEEDS = range(5)
+RTOL = 1e-9
+ATOL = 1e-9
+
+
+def make_candles(size, seed):
+    candles = synthetic_candles(size, seed)
+    # Flat volume windows exercise the zero std case
+    candles.volume[::7] = 0
+    return candles
+
+
+def assert_close(actual, expected, message):
+    assert np.allclose(np.asarray(actual, dtype=np.float64),
+                       np.asarray(expected, dtype=np.float64),
+                       rtol=RTOL,
+                       atol=ATOL,
+                       equal_nan=True), message
+
+
+def assert_latest(values, expected, message):
+    for name, value in values.items():
+        assert_close(value, expected[name].iloc[-1], f"{message}: {name}")
+
+
+@pytest.mark.parametrize('size', SIZES)
+@pytest.mark.parametrize('seed', SEEDS)
+def test_batch_matches_pandas(size, seed):
+    candles = make_candles(size, seed)
+    expected = pandas_indicators(candles)
+    for name, values in indicators.compute(candles).items():
+        assert_close(values, expected[name].to_numpy(), name)
+
+
+@pytest.mark.parametrize('size', SIZES)
+@pytest.mark.parametrize('seed', SEEDS)
+def test_indicator_set_matches_pandas(size, seed):
+    candles = make_candles(size, seed)
+    expected = pandas_indicators(candles)
+    indicator_set = indicators.IndicatorSet()
+    values = {name: [] for name in indicators.PERIODS}
+    for candle in candles.to_klines():
+        indicator_set.update(candle)
+        for name, value in indicator_set.values().items():
+            values[name].append(value)
+    for name in values:
+        assert_close(values[name], expected[name].to_numpy(), name)
+
+
+@pytest.mark.parametrize('size', SIZES)
+@pytest.mark.parametrize('seed', SEEDS)
+def test_store_fed_in_windows_matches_pandas(size, seed):
+    # Like the candle store: a sliding window of the newest 200 candles
+    candles = make_candles(size, seed)
+    expected = pandas_indicators(candles)
+    klines = candles.to_klines()
+    store = indicators.IndicatorStore()
+    for end in range(0, size + 1, max(1, min(50, size // 7))):
+        store.update('TEST', '3min', klines[max(0, end - 200):end])
+    assert_latest(store.update('TEST', '3min', klines[-200:]), expected,
+                  f"{size} candles, seed {seed}")
+
+
+def test_store_takes_columnar_candles():
+    candles = make_candles(500, 1)
+    store = indicators.IndicatorStore()
+    store.update('TEST', '3min', candles[:300])
+    assert_latest(store.update('TEST', '3min', candles[100:]),
+                  pandas_indicators(candles), "Candles input")
+
+
+def test_store_restarts_after_a_gap():
+    # Candles that start after the next expected one cannot continue the
+    # fed ones; the store starts over from them
+    candles = make_candles(600, 2)
+    klines = candles.to_klines()
+    store = indicators.IndicatorStore()
+    store.update('TEST', '3min', klines[:200])
+    values = store.update('TEST', '3min', klines[400:])
+    assert_latest(values, pandas_indicators(candles[400:]), "after a gap")
+
+
+def test_store_restarts_on_older_candles():
+    # Candles that end before the last fed one (e.g. a reseeded market)
+    # also start the indicators over
+    candles = make_candles(600, 3)
+    klines = candles.to_klines()
+    store = indicators.IndicatorStore()
+    store.update('TEST', '3min', klines[300:])
+    values = store.update('TEST', '3min', klines[:250])
+    assert_latest(values, pandas_indicators(candles[:250]), "older candles")
+
+
+def test_store_keeps_markets_apart_and_drops_them():
+    candles = make_candles(300, 4)
+    other = make_candles(300, 5)
+    store = indicators.IndicatorStore()
+    store.update('A', '3min', candles.to_klines())
+    store.update('B', '3min', other.to_klines())
+    assert_latest(store.update('A', '3min', []), pandas_indicators(candles),
+                  "market A")
+    store.drop('A')
+    assert store.update('A', '3min', []) is None
+    assert_latest(store.update('B', '3min', []), pandas_indicators(other),
+                  "market B")
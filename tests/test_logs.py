@@ -0,0 +1,114 @@
+import json
+import logging
+import queue
+import random
+import sys
+
+import bot_code
+import metrics
+from logs import (DroppingQueueHandler, JsonFormatter, RotatingHandler,
+                  SamplingFilter, dropped_records, parse_sample)
+
+# The handlers of the log writer: rotation by size and age, JSON records,
+# sampling, and records the log queue had no room for, which are counted
+# and shown by status() and the metrics endpoint
+
+
+def record(message='scan', level=logging.INFO, created=None, **extra):
+    new = logging.LogRecord('bot', level, __file__, 1, message, (), None)
+    new.__dict__.update(extra)
+    if created is not None:
+        new.created = created
+    return new
+
+
+def test_dropped_records_are_exported():
+    before = dropped_records()
+    handler = DroppingQueueHandler(queue.Queue(1))
+    logger = logging.getLogger('test_logs.dropping')
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        for i in range(3):
+            logger.warning('record %d', i)
+    finally:
+        logger.removeHandler(handler)
+    assert dropped_records() == before + 2
+    assert bot_code.status()['log_records_dropped'] == before + 2
+    assert f'log_records_dropped_total {before + 2}' in metrics.render()
+
+
+def test_rotation_by_size(tmp_path):
+    path = tmp_path / 'bot.log'
+    handler = RotatingHandler(str(path), max_bytes=100, max_age=0, backups=2)
+    try:
+        for i in range(12):
+            handler.emit(record(f'record {i:02d} ' + 'x' * 20))
+    finally:
+        handler.close()
+    # Every file stays under the limit, the oldest backups are gone
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        'bot.log', 'bot.log.1', 'bot.log.2'
+    ]
+    assert all(p.stat().st_size <= 100 for p in tmp_path.iterdir())
+    assert 'record 11' in path.read_text()
+    assert 'record 00' not in ''.join(p.read_text()
+                                      for p in tmp_path.iterdir())
+
+
+def test_rotation_by_age(tmp_path):
+    path = tmp_path / 'bot.log'
+    handler = RotatingHandler(str(path), max_bytes=0, max_age=60)
+    try:
+        start = handler.rollover_at - 60
+        handler.emit(record('first', created=start + 10))
+        handler.emit(record('second', created=start + 59))
+        assert not (tmp_path / 'bot.log.1').exists()
+        # A record past the age rolls the file over and restarts the clock
+        handler.emit(record('third', created=start + 61))
+        assert handler.rollover_at > start + 60
+    finally:
+        handler.close()
+    assert (tmp_path / 'bot.log.1').read_text().split() == ['first', 'second']
+    assert path.read_text().split() == ['third']
+
+
+def test_json_records_with_extra_fields_and_exceptions():
+    formatter = JsonFormatter()
+    data = json.loads(
+        formatter.format(
+            record('Candles for %s' % 'BTCUSDT',
+                   logging.DEBUG,
+                   created=0,
+                   market='BTCUSDT',
+                   timeframe='3min',
+                   stage=None)))
+    assert data == {
+        'time': '1970-01-01T00:00:00+00:00',
+        'level': 'DEBUG',
+        'logger': 'bot',
+        'thread': data['thread'],
+        'message': 'Candles for BTCUSDT',
+        'market': 'BTCUSDT',
+        'timeframe': '3min'
+    }
+    try:
+        raise ValueError('bad kline')
+    except ValueError:
+        failed = record('failed', logging.ERROR, market='ETHUSDT')
+        failed.exc_info = sys.exc_info()
+    data = json.loads(formatter.format(failed))
+    assert data['market'] == 'ETHUSDT'
+    assert data['exception'].startswith('Traceback')
+    assert 'ValueError: bad kline' in data['exception']
+
+
+def test_sampling_keeps_a_fraction_of_a_level(monkeypatch):
+    rates = parse_sample('DEBUG=0.25, info=1')
+    assert rates == {logging.DEBUG: 0.25, logging.INFO: 1.0}
+    sampler = SamplingFilter(rates)
+    monkeypatch.setattr(random, 'random', iter([0.1, 0.3, 0.2, 0.9]).__next__)
+    kept = [sampler.filter(record(level=logging.DEBUG)) for _ in range(4)]
+    assert kept == [True, False, True, False]
+    # Levels without a rate are all kept, without drawing
+    assert sampler.filter(record(level=logging.WARNING))
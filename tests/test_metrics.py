@@ -0,0 +1,127 @@
+import logging
+
+import pytest
+
+import bot_code
+import main
+import metrics
+from metrics import Registry
+
+# The Prometheus text format served on /metrics, and the /metrics and
+# /status routes of the web app
+
+
+def test_help_and_type_lines():
+    registry = Registry()
+    scans = registry.register(
+        metrics.Counter('scans_total', 'Market scans', ['market']))
+    registry.register(metrics.Gauge('markets', 'Active markets')).set(12)
+    scans.inc(market='BTCUSDT')
+    scans.inc(2, market='BTCUSDT')
+    lines = registry.render().splitlines()
+    assert lines[lines.index('# HELP coinex_bot_scans_total Market scans') +
+                 1] == '# TYPE coinex_bot_scans_total counter'
+    assert 'coinex_bot_scans_total{market="BTCUSDT"} 3' in lines
+    assert '# TYPE coinex_bot_markets gauge' in lines
+    assert 'coinex_bot_markets 12' in lines
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    errors = registry.register(
+        metrics.Counter('errors_total', 'Errors', ['message']))
+    errors.inc(message='bad "quote" \\ and\nnewline')
+    assert ('coinex_bot_errors_total{message="bad \\"quote\\" \\\\ and'
+            '\\nnewline"} 1') in registry.render().splitlines()
+
+
+def test_histogram_buckets_sum_and_count():
+    registry = Registry()
+    latency = registry.register(
+        metrics.Histogram('latency_seconds', 'Latency', ['endpoint'],
+                          buckets=(0.1, 1)))
+    for value in (0.05, 0.5, 0.5, 3):
+        latency.observe(value, endpoint='/kline')
+    lines = registry.render().splitlines()
+    assert '# TYPE coinex_bot_latency_seconds histogram' in lines
+    name = 'coinex_bot_latency_seconds'
+    # Buckets are cumulative, ending with +Inf
+    assert lines[lines.index(f'# TYPE {name} histogram') + 1:][:5] == [
+        f'{name}_bucket{{endpoint="/kline",le="0.1"}} 1',
+        f'{name}_bucket{{endpoint="/kline",le="1"}} 3',
+        f'{name}_bucket{{endpoint="/kline",le="+Inf"}} 4',
+        f'{name}_sum{{endpoint="/kline"}} 4.05',
+        f'{name}_count{{endpoint="/kline"}} 4',
+    ]
+    assert latency.value(endpoint='/kline') == (4, pytest.approx(4.05))
+
+
+class Records(logging.Handler):
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def test_failing_collector_is_logged_and_counted():
+    registry = Registry()
+    registry.register(metrics.Gauge('markets', 'Active markets')).set(3)
+
+    @registry.collector
+    def broken_collector():
+        raise KeyError('runtime')
+
+    records = Records()
+    logger = logging.getLogger('bot')
+    logger.addHandler(records)
+    try:
+        text = registry.render()
+    finally:
+        logger.removeHandler(records)
+    # The other metrics are still served
+    assert 'coinex_bot_markets 3' in text
+    assert registry.collector_errors.value(collector='broken_collector') == 1
+    assert ('coinex_bot_collector_errors_total{collector="broken_collector"}'
+            ' 1') in text
+    [record] = [r for r in records.records if 'collector' in r.getMessage()]
+    assert record.levelno == logging.ERROR
+    assert 'broken_collector' in record.getMessage()
+    assert record.exc_info[0] is KeyError
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main, 'bot', None)
+    return main.app.test_client()
+
+
+def test_metrics_route(client):
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type == metrics.CONTENT_TYPE
+    text = response.get_data(as_text=True)
+    assert '# TYPE coinex_bot_api_request_seconds histogram' in text
+    assert '# TYPE coinex_bot_collector_errors_total counter' in text
+
+
+def test_status_route(client, monkeypatch):
+    # 503 until the bot thread imported bot_code
+    response = client.get('/status')
+    assert response.status_code == 503
+    assert response.get_json() == {'ready': False}
+    monkeypatch.setattr(main, 'bot', bot_code)
+    monkeypatch.setattr(bot_code, 'runtime', {
+        'mode': 'serial',
+        'cycles': 4,
+        'active_markets': []
+    })
+    response = client.get('/status')
+    assert response.status_code == 200
+    status = response.get_json()
+    assert status['mode'] == 'serial'
+    assert status['cycles'] == 4
+    assert status['ready'] is False
+    assert 'stage_cache' in status and 'api' in status
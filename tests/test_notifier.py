@@ -0,0 +1,123 @@
+import threading
+import time
+
+import pytest
+
+import bot_code
+import notifier
+from fake_servers import FakeTelegramServer
+from notifier import Notifier
+
+# Delivery through the fake Telegram Bot API, with the failures it is told
+# to return
+
+TOKEN = 'TEST:TOKEN'
+CHAT_ID = '1001'
+
+
+@pytest.fixture
+def telegram(monkeypatch):
+    server = FakeTelegramServer(TOKEN).start()
+    monkeypatch.setattr(bot_code, 'TELEGRAM_BASE_URL', server.url)
+    monkeypatch.setattr(bot_code, 'TELEGRAM_TOKEN', TOKEN)
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def delivery(telegram):
+    errors = []
+    sender = Notifier(bot_code.post_telegram_message, CHAT_ID,
+                      log=errors.append).start()
+    yield sender, errors
+    sender.stop(timeout=5)
+
+
+def wait_until(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def wait_for_sent(sender, telegram, count):
+    # The fake records a message before the notifier has its response
+    wait_until(lambda: sender.stats['sent'] >= count)
+    return telegram.messages
+
+
+def test_waits_retry_after_then_delivers(telegram, delivery):
+    sender, errors = delivery
+    telegram.fail(1, status=429, retry_after=2)
+    started = time.monotonic()
+    assert sender.send('hello')
+    messages = wait_for_sent(sender, telegram, 1)
+    elapsed = time.monotonic() - started
+    assert [m['text'] for m in messages] == ['hello']
+    assert messages[0]['chat_id'] == CHAT_ID
+    # The retry waits the retry_after Telegram asked for, not the backoff
+    assert 2 <= elapsed < 3
+    assert sender.stats['throttled'] == 1
+    assert sender.stats['retries'] == 1
+    assert sender.stats['sent'] == 1
+    assert errors == []
+
+
+def test_retries_server_errors(monkeypatch, telegram, delivery):
+    monkeypatch.setattr(notifier, 'RETRY_BASE', 0.01)
+    sender, errors = delivery
+    telegram.fail(2, status=502)
+    assert sender.send('again')
+    assert [m['text']
+            for m in wait_for_sent(sender, telegram, 1)] == ['again']
+    assert sender.stats['retries'] == 2
+    assert sender.stats['sent'] == 1
+    assert errors == []
+
+
+def test_client_errors_are_not_retried(telegram, delivery):
+    sender, errors = delivery
+    telegram.fail(1, status=400)
+    assert sender.notify('BTCUSDT', 'Long', 'signal')
+    assert wait_until(lambda: sender.stats['failed'])
+    assert sender.stats['failed'] == 1
+    assert sender.stats['retries'] == 0
+    assert len(errors) == 1
+    # The undelivered signal can be sent again right away
+    assert sender.notify('BTCUSDT', 'Long', 'signal')
+    assert [m['text']
+            for m in wait_for_sent(sender, telegram, 1)] == ['signal']
+
+
+class Sent:
+    status_code = 200
+
+
+def test_busy_chat_does_not_hold_up_the_others():
+    # More messages for one chat than there are workers, then one for
+    # another chat: the chat limit (one a second) defers the busy chat's
+    # messages without holding a worker
+    delivered = []
+    lock = threading.Lock()
+
+    def post(chat_id, text):
+        with lock:
+            delivered.append((chat_id, time.monotonic()))
+        return Sent()
+
+    sender = Notifier(post, CHAT_ID, workers=2).start()
+    started = time.monotonic()
+    for i in range(4):
+        sender.send(f'busy {i}', chat_id='busy')
+    sender.send('other', chat_id='other')
+    assert wait_until(lambda: ('other' in [c for c, _ in delivered]))
+    other = next(t for c, t in delivered if c == 'other')
+    assert other - started < 0.5
+    assert wait_until(lambda: len(delivered) == 5)
+    busy = [t for c, t in delivered if c == 'busy']
+    # The busy chat still gets at most one message a second
+    assert all(b - a >= 0.9 for a, b in zip(busy, busy[1:]))
+    assert sender.stats['deferred'] >= 3
+    sender.stop(timeout=5)
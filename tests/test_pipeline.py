@@ -0,0 +1,166 @@
+import pytest
+
+import bot_code
+from candles import resample, synthetic_candles
+from indicators import IndicatorStore
+from pipeline import StageCache, closed_klines, last_closed_time
+from tracker import SignalTracker
+
+# Stage results cached per closed candle: the keys taken from the candles,
+# hits and misses of the cache and the stages scan_market skips while their
+# candle has not closed
+
+# 2023-11-14 22:00:00 UTC, an M3, M15 and H1 close
+HOUR = 1700000000 - 1700000000 % 3600
+CANDLES = synthetic_candles(300, start_time=HOUR - 240 * 180)
+
+
+def test_last_closed_time():
+    assert last_closed_time('3min', HOUR + 179) == HOUR - 180
+    assert last_closed_time('3min', HOUR + 180) == HOUR
+    assert last_closed_time('1hour', HOUR + 3599) == HOUR - 3600
+    assert last_closed_time('1hour', HOUR + 3600) == HOUR
+
+
+def test_forming_candle_is_excluded():
+    now = int(CANDLES.time[-1]) + 60
+    closed = closed_klines(CANDLES, '3min', now)
+    assert len(closed) == len(CANDLES) - 1
+    assert closed.time[-1] == CANDLES.time[-2]
+    # Once it has closed it stays
+    assert len(closed_klines(CANDLES, '3min', now + 120)) == len(CANDLES)
+    # The same for candle dicts
+    rows = [CANDLES[i] for i in range(len(CANDLES) - 3, len(CANDLES))]
+    assert closed_klines(rows, '3min', now) == rows[:-1]
+    assert closed_klines([], '3min', now) == []
+
+
+def test_hit_on_an_unchanged_closed_candle():
+    cache = StageCache()
+    calls = []
+
+    def stage(value):
+        calls.append(value)
+        return value * 2
+
+    assert cache.run('BTCUSDT', 'trend_m3', HOUR, stage, 1) == 2
+    assert cache.run('BTCUSDT', 'trend_m3', HOUR, stage, 5) == 2
+    assert calls == [1]
+    assert cache.stats()['trend_m3'] == {
+        'hits': 1,
+        'misses': 1,
+        'hit_ratio': 0.5
+    }
+    # Other markets have their own entries
+    assert cache.lookup('ETHUSDT', 'trend_m3', HOUR) == (False, None)
+
+
+def test_miss_after_a_new_candle_closes():
+    cache = StageCache()
+    cache.store('BTCUSDT', 'trend_m3', HOUR, 'up trend')
+    assert cache.lookup('BTCUSDT', 'trend_m3', HOUR + 180) == (False, None)
+    assert cache.run('BTCUSDT', 'trend_m3', HOUR + 180,
+                     lambda: 'down trend') == 'down trend'
+    assert cache.lookup('BTCUSDT', 'trend_m3',
+                        HOUR + 180) == (True, 'down trend')
+    assert cache.stats()['trend_m3']['misses'] == 2
+    assert cache.stats()['trend_m3']['hits'] == 1
+
+
+def test_peek_does_not_count():
+    cache = StageCache()
+    assert cache.peek('BTCUSDT', 'hpta', HOUR) == (False, None)
+    cache.store('BTCUSDT', 'hpta', HOUR, True)
+    assert cache.peek('BTCUSDT', 'hpta', HOUR) == (True, True)
+    assert cache.peek('BTCUSDT', 'hpta', HOUR + 180) == (False, None)
+    assert cache.stats()['hpta'] == {'hits': 0, 'misses': 0, 'hit_ratio': 0.0}
+
+
+def test_filled_results_count_as_runs():
+    cache = StageCache()
+    cache.fill('BTCUSDT', 'trend_m15', HOUR, 'up trend')
+    # The batch pass ran the stage, so its first lookup is not a hit
+    assert cache.lookup('BTCUSDT', 'trend_m15', HOUR) == (True, 'up trend')
+    assert cache.stats()['trend_m15']['hits'] == 0
+    assert cache.stats()['trend_m15']['misses'] == 1
+    assert cache.lookup('BTCUSDT', 'trend_m15', HOUR) == (True, 'up trend')
+    assert cache.stats()['trend_m15']['hits'] == 1
+    cache.drop('BTCUSDT')
+    assert cache.peek('BTCUSDT', 'trend_m15', HOUR) == (False, None)
+
+
+CHANNEL = {
+    'resistance': [{'price': 104.0}, {'price': 105.0}],
+    'support': [{'price': 95.0}, {'price': 96.0}]
+}
+
+
+class Feed:
+    # The M3 candles up to `now`, and the M15 and H1 candles built from them
+
+    def __init__(self):
+        self.now = 0
+        self.fetched = []
+
+    def get_klines_cached(self, market, timeframe='15min', limit=200):
+        self.fetched.append(timeframe)
+        m3 = CANDLES[:int(((self.now - CANDLES.time[0]) // 180) + 1)]
+        return {
+            '3min': m3,
+            '15min': resample(m3, 900),
+            '1hour': resample(m3, 3600)
+        }[timeframe][-limit:]
+
+
+@pytest.fixture
+def feed(monkeypatch):
+    # scan_market with every stage passing, so each scan gets to the H1 stage
+    feed = Feed()
+    for name, value in (('stage_cache', StageCache()),
+                        ('indicator_store', IndicatorStore()),
+                        ('signal_tracker', SignalTracker()),
+                        ('fresh_swings', set()), ('market_status', {}),
+                        ('last_signal_time', {'BTCUSDT': float('inf')})):
+        monkeypatch.setattr(bot_code, name, value)
+    monkeypatch.setattr(bot_code.server_clock, 'now', lambda: feed.now)
+    monkeypatch.setattr(bot_code, 'get_klines_cached', feed.get_klines_cached)
+    monkeypatch.setattr(bot_code, 'get_ticker', lambda *args, **kwargs: 100.0)
+    monkeypatch.setattr(bot_code, 'detect_swings',
+                        lambda market, timeframe, klines, swings: ({}, False))
+    monkeypatch.setattr(bot_code, 'detect_trend_and_channel',
+                        lambda market, timeframe, swings:
+                        ('up trend', CHANNEL, None))
+    monkeypatch.setattr(bot_code, 'calculate_range_momentum',
+                        lambda *args: (True, 1.0))
+    monkeypatch.setattr(bot_code, 'check_channel_breakout',
+                        lambda *args: False)
+    monkeypatch.setattr(bot_code, 'check_hpta', lambda *args: True)
+    monkeypatch.setattr(bot_code, 'algo4_check',
+                        lambda *args: (True, None, False))
+    return feed
+
+
+def scan(feed, now):
+    feed.now = now
+    feed.fetched = []
+    bot_code.scan_market('BTCUSDT', {'BTCUSDT': bot_code.new_market_state()},
+                         {'BTCUSDT': 0}, ['BTCUSDT'])
+    return bot_code.stage_cache.stats()
+
+
+def test_h1_stage_skipped_when_only_m3_closed(feed):
+    stats = scan(feed, HOUR + 3 * 180 + 1)
+    assert '1hour' in feed.fetched
+    assert stats['trend_h1']['misses'] == 1
+    # The next M3 candle closes within the same hour: M3 stages run again,
+    # H1 candles are not fetched
+    stats = scan(feed, HOUR + 4 * 180 + 1)
+    assert '1hour' not in feed.fetched
+    assert stats['trend_m3']['misses'] == 2
+    assert stats['trend_h1'] == {'hits': 1, 'misses': 1, 'hit_ratio': 0.5}
+    # The scan got through every stage to the signal cooldown
+    assert bot_code.market_status['BTCUSDT']['stage'] == 'cooldown'
+    # Until the hour closes
+    scan(feed, HOUR + 3600 + 1)
+    assert '1hour' in feed.fetched
+    assert bot_code.stage_cache.stats()['trend_h1']['misses'] == 2
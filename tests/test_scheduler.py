@@ -0,0 +1,189 @@
+import pytest
+
+import scheduler
+from http_client import ServerClock
+from scheduler import MarketScheduler, next_scan_time, period, stagger
+
+# Per-market scan intervals from the market ranking and the request budget,
+# re-admission backoff of dropped markets, the order markets come due in and
+# the alignment of scans to candle closes
+
+MARKETS = [f"M{i}USDT" for i in range(10)]
+
+
+def ranked(budget=0):
+    # M0 is the quietest market and M9 the busiest
+    markets = MarketScheduler(MARKETS, adaptive=True, budget=budget)
+    markets.rank({
+        market: {
+            'turnover': 1000.0 * (i + 1),
+            'volatility': 0.01 * (i + 1)
+        }
+        for i, market in enumerate(MARKETS)
+    })
+    return markets
+
+
+def intervals(markets):
+    return {m: e['interval'] for m, e in markets._entries.items()}
+
+
+def test_hot_markets_get_shorter_intervals():
+    markets = ranked()
+    found = intervals(markets)
+    # Top 20% hot, bottom 40% cold, the rest in between
+    assert [found[m] for m in MARKETS] == (
+        [scheduler.COLD_INTERVAL] * 4 + [scheduler.BASE_INTERVAL] * 4 +
+        [scheduler.HOT_INTERVAL] * 2)
+    # A quiet market near its algo 4 zone is hot until it moves away
+    markets.hint('M0USDT', scheduler.NEAR_ZONE / 2)
+    assert intervals(markets)['M0USDT'] == scheduler.HOT_INTERVAL
+    markets.hint('M0USDT', None)
+    assert intervals(markets)['M0USDT'] == scheduler.COLD_INTERVAL
+    assert markets.stretch == 1.0
+
+
+def test_fixed_intervals_without_adaptive_polling():
+    markets = ranked()
+    markets.adaptive = False
+    markets.set_budget(0)
+    assert set(intervals(markets).values()) == {scheduler.BASE_INTERVAL}
+
+
+def scan_rate(markets):
+    # API requests per minute the scans take
+    return sum(scheduler.REQUESTS_PER_SCAN * 60 / interval
+               for interval in intervals(markets).values())
+
+
+def test_intervals_stretch_to_the_request_budget():
+    unbounded = intervals(ranked())
+    rate = scan_rate(ranked())
+    markets = ranked(budget=rate / 2.5)
+    assert markets.stretch == pytest.approx(2.5)
+    for market, interval in intervals(markets).items():
+        assert interval == pytest.approx(unbounded[market] * 2.5)
+    assert scan_rate(markets) == pytest.approx(rate / 2.5)
+    # A budget the scans fit into leaves them alone
+    markets.set_budget(rate * 2)
+    assert markets.stretch == 1.0
+    assert intervals(markets) == unbounded
+
+
+def test_readmit_backoff_grows_then_resets():
+    markets = MarketScheduler(['BTCUSDT'])
+    base, cap = scheduler.READMIT_BASE, scheduler.READMIT_CAP
+    now = 1000.0
+    backoffs = []
+    for _ in range(7):
+        # Dropped: put on a backoff, then scanned again once it is over
+        assert markets.readmit([], now) == []
+        retry_at = markets._entries['BTCUSDT']['retry_at']
+        backoffs.append(retry_at - now)
+        assert markets.readmit([], retry_at - 1) == []
+        assert markets.readmit([], retry_at) == ['BTCUSDT']
+        assert markets.due(retry_at, ['BTCUSDT']) == ['BTCUSDT']
+        now = retry_at + 1
+    assert backoffs == [min(cap, base * 2**i) for i in range(7)]
+    assert backoffs[-1] == cap
+    # Active markets are never put on a backoff
+    assert markets.readmit(['BTCUSDT'], now) == []
+    # Staying in for the longest backoff starts over with the shortest
+    now += cap
+    markets.readmit([], now)
+    assert markets._entries['BTCUSDT']['retry_at'] - now == base
+
+
+def test_due_and_wait_follow_the_clock():
+    markets = MarketScheduler(['A', 'B', 'C'], adaptive=False)
+    now = 10000.0
+    # New markets are due right away
+    assert markets.due(now, ['A', 'B', 'C']) == ['A', 'B', 'C']
+    markets.scanned(['A', 'B', 'C'], now)
+    assert markets.due(now, ['A', 'B', 'C']) == []
+    next_times = {m: e['next'] for m, e in markets._entries.items()}
+    first = min(next_times, key=next_times.get)
+    assert markets.wait(now, ['A', 'B', 'C']) == pytest.approx(
+        min(scheduler.BASE_INTERVAL, next_times[first] - now))
+    # Nothing is due before its time, and the most overdue comes first
+    later = max(next_times.values())
+    assert markets.due(min(next_times.values()) - 0.001, ['A', 'B', 'C']) == []
+    assert markets.due(later, ['A', 'B', 'C']) == sorted(next_times,
+                                                       key=next_times.get)
+    # Inactive markets are neither due nor waited for
+    assert markets.due(later, ['A']) == ['A']
+    assert markets.wait(later + 1000, ['A']) == scheduler.MIN_WAIT
+    assert markets.wait(now, []) == scheduler.BASE_INTERVAL
+
+
+# 2023-11-14 22:00:00 UTC, an M3, M15 and H1 close
+CLOSE = 1700000000 - 1700000000 % 3600
+
+
+def test_period_keeps_scans_on_the_m3_grid():
+    assert period(180) == 180
+    assert period(900) == 900
+    assert period(3600) == 3600
+    # Longer intervals round up to whole candles, shorter ones to fractions
+    assert period(200) == 360
+    assert period(60) == 60
+    assert period(50) == 60
+
+
+@pytest.mark.parametrize('interval', [180, 900, 3600])
+def test_scans_land_just_after_the_close(interval):
+    offset = stagger('BTCUSDT')
+    shift = scheduler.CLOSE_DELAY + offset
+    now = CLOSE + interval + 0.5 * interval
+    next_time = next_scan_time(interval, offset, now)
+    # The close delay and the market's offset after a close of the interval
+    assert (next_time - shift) % interval == pytest.approx(0, abs=1e-6)
+    assert next_time - shift == CLOSE + 2 * interval
+    # Scans keep landing on that grid
+    assert next_scan_time(interval, offset,
+                          next_time) == pytest.approx(next_time + interval)
+
+
+@pytest.mark.parametrize('interval', [180, 900, 3600])
+def test_scan_exactly_at_a_boundary(interval):
+    offset = stagger('ETHUSDT')
+    shift = scheduler.CLOSE_DELAY + offset
+    # A scan exactly at its slot is scheduled for the next one
+    slot = CLOSE + interval + shift
+    assert next_scan_time(interval, offset, slot) == pytest.approx(slot +
+                                                                   interval)
+    # So is a scan right at the close, before the delay and offset
+    assert next_scan_time(interval, offset,
+                          CLOSE + interval) == pytest.approx(slot + interval)
+    # A scan off the grid skips a slot less than half a period away
+    assert next_scan_time(interval, offset,
+                          slot - 1) == pytest.approx(slot + interval)
+    assert next_scan_time(interval, offset,
+                          slot - interval / 2 - 1) == pytest.approx(slot)
+
+
+def test_offsets_stay_inside_the_stagger_window():
+    offsets = {stagger(market) for market in MARKETS}
+    assert len(offsets) > 1
+    assert all(0 <= offset < scheduler.STAGGER_WINDOW for offset in offsets)
+    # The same in every process
+    assert stagger('BTCUSDT') == stagger('BTCUSDT')
+
+
+def test_scans_follow_the_exchange_clock():
+    # The exchange clock is 7.5 seconds ahead of ours
+    clock = ServerClock()
+    local = CLOSE + 100.0
+    clock.observe(local + 7, local, local)
+    assert clock.offset == pytest.approx(7.5)
+    markets = MarketScheduler(['BTCUSDT'], adaptive=False)
+    exchange_now = local + clock.offset
+    markets.scanned(['BTCUSDT'], exchange_now)
+    next_time = markets._entries['BTCUSDT']['next']
+    shift = scheduler.CLOSE_DELAY + stagger('BTCUSDT')
+    assert (next_time - shift) % 180 == pytest.approx(0, abs=1e-6)
+    # Waiting by the local clock still wakes up on the exchange's slot
+    wait = markets.wait(exchange_now, ['BTCUSDT'])
+    assert local + wait + clock.offset == pytest.approx(next_time)
+    assert markets.due(next_time - 0.01, ['BTCUSDT']) == []
+    assert markets.due(next_time, ['BTCUSDT']) == ['BTCUSDT']
@@ -0,0 +1,168 @@
+import threading
+import time
+from multiprocessing.connection import Client
+
+import pytest
+
+import sharding
+from sharding import Coordinator, HashRing
+
+# Placement on the hash ring, rebalancing when workers come and go, and the
+# coordinator's handling of silent and crashing workers
+
+MARKETS = [f"COIN{i}USDT" for i in range(1000)]
+AUTHKEY = b'test-key'
+
+
+def test_every_market_has_one_owner():
+    ring = HashRing(['a', 'b', 'c', 'd'])
+    assignment = ring.assign(MARKETS)
+    assert sorted(sum(assignment.values(), [])) == sorted(MARKETS)
+    for node, markets in assignment.items():
+        assert all(ring.owner(market) == node for market in markets)
+        # REPLICAS points per worker spread the markets about evenly
+        assert 150 <= len(markets) <= 350
+
+
+def test_placement_does_not_depend_on_join_order():
+    first = HashRing(['a', 'b', 'c'])
+    second = HashRing(['c', 'a', 'b'])
+    assert all(first.owner(m) == second.owner(m) for m in MARKETS)
+
+
+def test_join_only_moves_markets_to_the_new_worker():
+    ring = HashRing(['a', 'b', 'c'])
+    before = {market: ring.owner(market) for market in MARKETS}
+    ring.add('d')
+    moved = [m for m in MARKETS if ring.owner(m) != before[m]]
+    assert moved
+    assert all(ring.owner(market) == 'd' for market in moved)
+    assert len(moved) < len(MARKETS) / 2
+
+
+def test_leave_only_moves_the_markets_of_the_leaving_worker():
+    ring = HashRing(['a', 'b', 'c', 'd'])
+    before = {market: ring.owner(market) for market in MARKETS}
+    ring.remove('b')
+    for market in MARKETS:
+        if before[market] == 'b':
+            assert ring.owner(market) in ('a', 'c', 'd')
+        else:
+            assert ring.owner(market) == before[market]
+    assert ring.assign(MARKETS).keys() == {'a', 'c', 'd'}
+
+
+def wait_until(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class FakeWorker:
+    # A worker connection that records its assignments and, if asked,
+    # sends heartbeats
+
+    def __init__(self, address, worker_id, heartbeat=None):
+        self.conn = Client(address, authkey=AUTHKEY)
+        self.conn.send(('hello', worker_id))
+        self.markets = None
+        self.stopped = threading.Event()
+        threading.Thread(target=self._read, daemon=True).start()
+        if heartbeat:
+            threading.Thread(target=self._heartbeat,
+                             args=(heartbeat, ),
+                             daemon=True).start()
+
+    def _read(self):
+        while not self.stopped.is_set():
+            try:
+                message = self.conn.recv()
+            except Exception:
+                # Closed, possibly by close() in the middle of recv()
+                break
+            if message[0] == 'assign':
+                self.markets = message[1]
+
+    def _heartbeat(self, interval):
+        while not self.stopped.wait(interval):
+            try:
+                self.conn.send(('heartbeat', {}))
+            except OSError:
+                break
+
+    def close(self):
+        self.stopped.set()
+        self.conn.close()
+
+
+@pytest.fixture
+def coordinator(monkeypatch):
+    monkeypatch.setattr(sharding, 'REBALANCE_DELAY', 0)
+    logged = []
+    coordinator = Coordinator(MARKETS[:100],
+                              lambda *signal: None,
+                              authkey=AUTHKEY,
+                              log=logged.append,
+                              timeout=1).start()
+    coordinator.logged = logged
+    yield coordinator
+    coordinator.stop(timeout=1)
+
+
+def test_silent_worker_is_dropped_and_its_markets_moved(coordinator):
+    alive = FakeWorker(coordinator.address, 'alive', heartbeat=0.2)
+    silent = FakeWorker(coordinator.address, 'silent')
+    try:
+        assert wait_until(lambda: alive.markets is not None and silent.
+                          markets is not None and len(alive.markets) +
+                          len(silent.markets) == 100)
+        assert silent.markets
+        # No heartbeat within the timeout: the silent worker is dropped and
+        # the live one is given every market
+        assert wait_until(lambda: 'silent' not in coordinator.workers)
+        assert 'alive' in coordinator.workers
+        assert wait_until(lambda: len(alive.markets) == 100)
+        assert any('silent dropped (no heartbeat)' in message
+                   for message in coordinator.logged)
+    finally:
+        alive.close()
+        silent.close()
+
+
+class CrashedProcess:
+
+    returncode = 1
+
+    def poll(self):
+        return self.returncode
+
+
+def test_crashed_worker_is_restarted_with_backoff(monkeypatch):
+    started = []
+    monkeypatch.setattr(sharding.subprocess, 'Popen',
+                        lambda command, env: started.append(command) or
+                        CrashedProcess())
+    coordinator = Coordinator([], lambda *signal: None, log=lambda m: None)
+    try:
+        coordinator.spawn('local-0')
+        now = time.monotonic()
+        # Restarted after 1, then 2 seconds
+        coordinator._respawn(now)
+        assert len(started) == 1
+        coordinator._respawn(now + 1.1)
+        assert len(started) == 2
+        coordinator._respawn(now + 1.2)
+        coordinator._respawn(now + 3.0)
+        assert len(started) == 2
+        coordinator._respawn(now + 3.3)
+        assert len(started) == 3
+        # A worker that ran for RESPAWN_STABLE seconds is restarted after 1
+        later = now + 3.3 + sharding.RESPAWN_STABLE
+        coordinator._respawn(later)
+        coordinator._respawn(later + 1.1)
+        assert len(started) == 4
+    finally:
+        coordinator.listener.close()
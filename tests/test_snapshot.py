@@ -0,0 +1,132 @@
+import json
+import os
+import time
+
+import pytest
+
+import bot_code
+import snapshot
+from swings import SwingSeries
+from tracker import SignalTracker
+
+# State snapshots: what a restart restores, and which snapshots it ignores
+
+MARKETS = ['BTCUSDT', 'ETHUSDT', 'SOLUSDT']
+
+
+def swings(start):
+    highs = SwingSeries(10)
+    lows = SwingSeries(10)
+    for i in range(3):
+        highs.append_pivot(start + 3600 * i, 110.0 + i)
+        lows.append_pivot(start + 3600 * i + 1800, 90.0 - i)
+    return {'highs': highs, 'lows': lows}
+
+
+def fresh_state():
+    return {market: bot_code.new_market_state() for market in MARKETS}
+
+
+@pytest.fixture
+def bot(monkeypatch):
+    monkeypatch.setattr(bot_code, 'last_signal_time', {})
+    monkeypatch.setattr(bot_code, 'signal_tracker', SignalTracker())
+    return bot_code
+
+
+def saved(bot, path, signal_time=1000.0):
+    # Saves the state of a bot that dropped SOLUSDT after too many errors
+    state = fresh_state()
+    state['BTCUSDT']['swings_m15'] = swings(1700000000)
+    state['ETHUSDT']['swings_h1'] = swings(1700003600)
+    error_counts = {'BTCUSDT': 0, 'ETHUSDT': 2, 'SOLUSDT': 5}
+    bot.last_signal_time['BTCUSDT'] = signal_time
+    bot.signal_tracker.open('BTCUSDT', 'Long', 'Low', 100.0, 95.0,
+                            [101.0, 102.0, 103.0])
+    assert bot.save_state(state, error_counts, ['BTCUSDT', 'ETHUSDT'], path)
+    return state
+
+
+def restart(bot, monkeypatch, path):
+    # A fresh bot process restoring `path`
+    monkeypatch.setattr(bot, 'last_signal_time', {})
+    monkeypatch.setattr(bot, 'signal_tracker', SignalTracker())
+    state = fresh_state()
+    error_counts = dict.fromkeys(MARKETS, 0)
+    active_markets = list(MARKETS)
+    restored = bot.restore_state(state, error_counts, active_markets, path)
+    return restored, state, error_counts, active_markets
+
+
+def test_round_trip(bot, monkeypatch, tmp_path):
+    path = str(tmp_path / 'state.json')
+    state = saved(bot, path)
+    restored, new_state, error_counts, active_markets = restart(
+        bot, monkeypatch, path)
+    assert restored
+    assert new_state == state
+    assert error_counts == {'BTCUSDT': 0, 'ETHUSDT': 2, 'SOLUSDT': 5}
+    assert bot.last_signal_time == {'BTCUSDT': 1000.0}
+    assert bot.signal_tracker.has_open('BTCUSDT')
+    # Markets dropped before the snapshot stay dropped
+    assert active_markets == ['BTCUSDT', 'ETHUSDT']
+
+
+def test_version_mismatch_is_ignored(bot, monkeypatch, tmp_path):
+    path = str(tmp_path / 'state.json')
+    saved(bot, path)
+    with open(path) as f:
+        data = json.load(f)
+    data['version'] = snapshot.SNAPSHOT_VERSION + 1
+    with open(path, 'w') as f:
+        json.dump(data, f)
+    assert snapshot.load_snapshot(path) is None
+    restored, state, error_counts, active_markets = restart(
+        bot, monkeypatch, path)
+    assert not restored
+    assert state == fresh_state()
+    assert active_markets == MARKETS
+
+
+def test_missing_snapshot(bot, monkeypatch, tmp_path):
+    path = str(tmp_path / 'state.json')
+    assert snapshot.load_snapshot(path) is None
+    assert not restart(bot, monkeypatch, path)[0]
+
+
+def test_old_snapshot_keeps_cooldowns_only(bot, monkeypatch, tmp_path):
+    path = str(tmp_path / 'state.json')
+    saved(bot, path)
+    later = time.time() + snapshot.SNAPSHOT_MAX_AGE + 60
+    monkeypatch.setattr(time, 'time', lambda: later)
+    restored, state, error_counts, active_markets = restart(
+        bot, monkeypatch, path)
+    assert restored
+    # The swing lookbacks no longer cover the downtime
+    assert state == fresh_state()
+    assert error_counts['ETHUSDT'] == 2
+    assert bot.last_signal_time == {'BTCUSDT': 1000.0}
+    assert active_markets == ['BTCUSDT', 'ETHUSDT']
+
+
+def test_crash_mid_write_keeps_the_previous_snapshot(bot, monkeypatch,
+                                                     tmp_path):
+    path = str(tmp_path / 'state.json')
+    saved(bot, path)
+    with open(path) as f:
+        before = f.read()
+
+    def crash(fd):
+        raise OSError("disk full")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(os, 'fsync', crash)
+        assert not bot.save_state(fresh_state(), dict.fromkeys(MARKETS, 0),
+                                  MARKETS, path)
+    with open(path) as f:
+        assert f.read() == before
+    # No temporary file is left behind
+    assert os.listdir(tmp_path) == ['state.json']
+    assert snapshot.load_snapshot(path)['active_markets'] == [
+        'BTCUSDT', 'ETHUSDT'
+    ]
@@ -0,0 +1,73 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import bot_code
+from benchmark import REPO_DIR, STARTUP_PORT_BUDGET, launch_main
+from fake_servers import FakeCoinexServer, FakeTelegramServer
+
+# main.py has to answer on its web port quickly: importing it loads only
+# Flask, and the bot starts once the port is bound
+
+# Seconds a fresh interpreter may take to import main
+IMPORT_BUDGET = 1.0
+
+
+def run_python(code):
+    result = subprocess.run([sys.executable, '-c', code],
+                            cwd=REPO_DIR,
+                            capture_output=True,
+                            text=True,
+                            check=True)
+    return result.stdout.split()
+
+
+def test_import_main_is_fast_and_starts_nothing():
+    seconds, loaded, threads = run_python(
+        "import sys, threading, time\n"
+        "start = time.perf_counter()\n"
+        "import main\n"
+        "print(time.perf_counter() - start, 'bot_code' in sys.modules, "
+        "threading.active_count())")
+    assert float(seconds) < IMPORT_BUDGET
+    assert loaded == 'False'
+    assert threads == '1'
+
+
+def test_import_bot_code_skips_mode_modules():
+    # Modules of a scan mode are imported when that mode starts
+    loaded = run_python(
+        "import sys\n"
+        "import bot_code\n"
+        "print(*[m in sys.modules for m in "
+        "('streaming', 'batch', 'sharding', 'backtest', 'websocket')])")
+    assert loaded == ['False'] * 5
+
+
+@pytest.fixture
+def api():
+    server = FakeCoinexServer(bot_code.REQUESTED_MARKETS).start()
+    telegram = FakeTelegramServer(bot_code.TELEGRAM_TOKEN).start()
+    yield server, telegram
+    server.stop()
+    telegram.stop()
+
+
+def test_port_answers_before_the_bot_is_ready(api):
+    server, telegram = api
+    bound, ready = launch_main(server.rest_url, telegram.url)
+    assert bound is not None and bound < STARTUP_PORT_BUDGET
+    assert ready is not None and ready >= bound
+
+
+def test_help_exits_the_process():
+    result = subprocess.run(
+        [sys.executable, os.path.join(REPO_DIR, 'main.py'), '--help'],
+        env=dict(os.environ, PORT='0'),
+        capture_output=True,
+        text=True,
+        timeout=30)
+    assert result.returncode == 0
+    assert 'usage:' in result.stdout
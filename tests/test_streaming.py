@@ -0,0 +1,196 @@
+import threading
+import time
+
+import pytest
+
+import streaming
+from candle_store import CandleStore
+from fake_servers import FakeCoinexServer
+
+pytest.importorskip('websocket')
+
+# StreamManager against the fake CoinEx websocket: a connection per market,
+# updates routed to their market, reconnects and resyncs
+
+MARKETS = ['BTCUSDT', 'ETHUSDT', 'SOLUSDT', 'ADAUSDT', 'XRPUSDT']
+STEP = 180
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class Harness:
+    # A manager with its own candle store, resynced from the fake's rows
+
+    def __init__(self, server, markets):
+        self.server = server
+        self.store = CandleStore()
+        # Cleared to hold resyncs until it is set again
+        self.resyncing = threading.Event()
+        self.resyncing.set()
+        self.resyncs = []
+        self.closes = []
+        self.prices = []
+        self.errors = []
+        self._lock = threading.Lock()
+        self.manager = streaming.StreamManager(
+            markets,
+            self.store,
+            self.resync,
+            self.on_candle_close,
+            log=self.errors.append,
+            ws_url=server.ws_url,
+            on_price=lambda market, price: self.prices.append(
+                (market, price)))
+
+    def resync(self, market):
+        self.resyncing.wait(5)
+        rows = self.server.klines(market, '3min', 200)
+        self.store.seed(market, '3min',
+                        [streaming.parse_kline_row(row) for row in rows])
+        with self._lock:
+            self.resyncs.append(market)
+
+    def on_candle_close(self, market, timeframe):
+        with self._lock:
+            self.closes.append((market, timeframe))
+
+    def connected(self):
+        return all(c.connected for c in self.manager.connections)
+
+    def last_time(self, market):
+        return self.store.last_time(market, '3min')
+
+
+@pytest.fixture(autouse=True)
+def fast_reconnects(monkeypatch):
+    monkeypatch.setattr(streaming, 'RECONNECT_BASE', 0.05)
+
+
+@pytest.fixture
+def server():
+    fake = FakeCoinexServer(MARKETS, candles=300).start()
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture
+def harness(server):
+    started = Harness(server, MARKETS)
+    started.manager.start()
+    assert wait_until(lambda: started.connected() and all(
+        started.store.is_live(market, '3min') for market in MARKETS))
+    yield started
+    started.manager.stop()
+
+
+def push_next(server, market, close='123.5'):
+    # Streams the candle after the last one of `market`
+    last = server.rows[market][-1]
+    row = [last[0] + STEP, last[2], close, close, close, '1', '1']
+    server.push_kline(market, row)
+    return row
+
+
+def test_one_connection_per_market(server, harness):
+    manager = harness.manager
+    assert [c.market for c in manager.connections] == MARKETS
+    assert wait_until(lambda: len(server.connections) == len(MARKETS))
+    assert sorted(
+        market for c in server.connections
+        for market in c['markets']) == sorted(MARKETS)
+    assert sorted(harness.resyncs) == sorted(MARKETS)
+    for market in MARKETS:
+        assert manager.streams[market] in manager.connections
+        assert harness.store.is_live(market, '3min')
+        assert harness.store.is_live(market, '1hour')
+
+
+def test_updates_reach_only_their_market(server, harness):
+    before = harness.last_time('BTCUSDT')
+    row = push_next(server, 'ETHUSDT')
+    assert wait_until(lambda: harness.last_time('ETHUSDT') == row[0])
+    assert harness.store.get('ETHUSDT', '3min')[-1]['close'] == 123.5
+    assert harness.last_time('BTCUSDT') == before
+    assert wait_until(lambda: ('ETHUSDT', '3min') in harness.closes)
+    server.push_deal('ETHUSDT', 99.5)
+    assert wait_until(lambda: harness.prices)
+    assert harness.prices == [('ETHUSDT', 99.5)]
+    assert harness.manager.last_price('ETHUSDT') == 99.5
+    assert harness.manager.last_price('BTCUSDT') is None
+
+
+def test_every_market_streams(server, harness):
+    # The fake, like CoinEx, keeps one kline subscription per connection
+    rows = {market: push_next(server, market) for market in MARKETS}
+    assert wait_until(lambda: all(
+        harness.last_time(market) == row[0] for market, row in rows.items()))
+
+
+def test_reconnects_and_resyncs_missed_candles(server, harness):
+    resyncs = len(harness.resyncs)
+    # A candle closes while every connection is down
+    with server.lock:
+        for market in MARKETS:
+            last = server.rows[market][-1]
+            server.rows[market].append(
+                [last[0] + STEP, last[2], '7', '7', '7', '1', '1'])
+    server.drop_connections()
+    assert wait_until(lambda: all(c.reconnects for c in harness.manager.
+                                  connections) and harness.connected())
+    assert wait_until(lambda: len(harness.resyncs) == resyncs + len(MARKETS))
+    # Markets go live once their connection has subscribed them all
+    assert wait_until(lambda: all(
+        harness.store.is_live(market, '3min') for market in MARKETS))
+    for market in MARKETS:
+        assert harness.last_time(market) == server.rows[market][-1][0]
+    # Updates flow again after the reconnect
+    row = push_next(server, 'SOLUSDT')
+    assert wait_until(lambda: harness.last_time('SOLUSDT') == row[0])
+
+
+def test_gap_in_stream_resyncs_market(server, harness):
+    last = server.rows['BTCUSDT'][-1]
+    with server.lock:
+        # Two candles the stream never sent
+        for i in (1, 2):
+            server.rows['BTCUSDT'].append(
+                [last[0] + i * STEP, last[2], '8', '8', '8', '1', '1'])
+    resyncs = harness.resyncs.count('BTCUSDT')
+    harness.resyncing.clear()
+    row = push_next(server, 'BTCUSDT')
+    assert wait_until(lambda: not harness.store.is_live('BTCUSDT', '3min'))
+    # The resync runs off the socket's thread, which keeps reading
+    server.push_deal('BTCUSDT', 42.5)
+    assert wait_until(lambda: ('BTCUSDT', 42.5) in harness.prices)
+    assert harness.last_time('BTCUSDT') == last[0]
+    harness.resyncing.set()
+    assert wait_until(lambda: harness.last_time('BTCUSDT') == row[0])
+    assert wait_until(lambda: harness.store.is_live('BTCUSDT', '3min'))
+    assert harness.resyncs.count('BTCUSDT') == resyncs + 1
+    times = [c['time'] for c in harness.store.get('BTCUSDT', '3min', 4)]
+    assert times == [last[0] + i * STEP for i in range(4)]
+
+
+def test_add_and_remove_markets(server, harness):
+    manager = harness.manager
+    manager.remove('XRPUSDT')
+    assert len(manager.connections) == len(MARKETS) - 1
+    assert not harness.store.is_live('XRPUSDT', '3min')
+    manager.remove('ADAUSDT')
+    assert not harness.store.is_live('ADAUSDT', '3min')
+    assert wait_until(lambda: len(server.connections) == len(MARKETS) - 2)
+    before = harness.last_time('ADAUSDT')
+    push_next(server, 'ADAUSDT')
+    manager.add('XRPUSDT')
+    assert wait_until(lambda: harness.store.is_live('XRPUSDT', '3min'))
+    row = push_next(server, 'XRPUSDT')
+    assert wait_until(lambda: harness.last_time('XRPUSDT') == row[0])
+    assert harness.last_time('ADAUSDT') == before
+    assert harness.errors == []
@@ -0,0 +1,82 @@
+import csv
+
+import numpy as np
+import pytest
+
+import backtest
+import bot_code
+import sweep
+from sweep import parse_grid, run_sweep
+
+# parse_grid only takes the STRATEGY parameters the replay honors, and
+# run_sweep replays every grid point on every market in worker processes
+
+
+def test_grid_is_the_product_of_the_values():
+    grid = parse_grid(['swing_width=2,3', 'min_volume_z=0,1.5'])
+    assert grid == [{
+        'swing_width': 2,
+        'min_volume_z': 0.0
+    }, {
+        'swing_width': 2,
+        'min_volume_z': 1.5
+    }, {
+        'swing_width': 3,
+        'min_volume_z': 0.0
+    }, {
+        'swing_width': 3,
+        'min_volume_z': 1.5
+    }]
+
+
+@pytest.mark.parametrize('name', ['swing_lookback_fast', 'swing_lookback_slow'])
+def test_parameters_the_replay_ignores_are_rejected(name):
+    with pytest.raises(ValueError):
+        parse_grid([f'{name}=10,20'])
+
+
+def test_unknown_parameter_is_rejected():
+    with pytest.raises(ValueError):
+        parse_grid(['swing_span=2,3'])
+
+
+def test_replay_parameters_are_strategy_keys():
+    assert set(backtest.REPLAY_PARAMS) <= set(bot_code.STRATEGY)
+
+
+def mapped(column):
+    # Whether `column` is a view into a memory-mapped file
+    while column is not None and not isinstance(column, np.memmap):
+        column = column.base
+    return column is not None
+
+
+def test_sweep_over_workers(tmp_path):
+    data_dir = str(tmp_path / 'data')
+    output = str(tmp_path / 'results.csv')
+    markets = ['SYN0USDT', 'SYN1USDT']
+    grid = parse_grid(['swing_width=2,3'])
+    sweep.prepare_data(data_dir, markets, 3)
+    rows = run_sweep(grid, markets, data_dir, output, workers=2, horizon=100)
+    assert sorted((r['market'], r['swing_width']) for r in rows) == [
+        ('SYN0USDT', 2), ('SYN0USDT', 3), ('SYN1USDT', 2), ('SYN1USDT', 3)
+    ]
+    # Best first
+    assert rows == sweep.rank(rows)
+    assert [(r['target1_rate'], -r['stop_rate']) for r in rows] == sorted(
+        ((r['target1_rate'], -r['stop_rate']) for r in rows), reverse=True)
+    with open(output, newline='') as f:
+        assert len(list(csv.DictReader(f))) == len(rows)
+    # Workers replay memory-mapped history, with the results of an
+    # in-process run
+    sweep._init_worker(data_dir)
+    try:
+        assert all(
+            mapped(candles.close)
+            for candles in sweep._history('SYN0USDT').values())
+        for row in rows:
+            params = {'swing_width': row['swing_width']}
+            expected = sweep.run_task(params, row['market'], 100)
+            assert dict(row, seconds=0) == dict(expected, seconds=0)
+    finally:
+        sweep._init_worker(None)
@@ -0,0 +1,129 @@
+import copy
+import random
+from array import array
+
+import pytest
+
+import bot_code
+from candles import synthetic_candles
+from swings import SwingSeries, copy_swings, new_swings
+
+# The columnar detector must return exactly what the per-candle dict loop
+# returns, including when it continues from earlier swings
+
+SIZES = (5, 6, 7, 50, 200, 1000)
+SEEDS = range(20)
+# (lookback, width); None uses the STRATEGY defaults
+SETTINGS = ((None, None), ('all', 2), ('all', 3))
+
+
+@pytest.mark.parametrize('size', SIZES)
+@pytest.mark.parametrize('lookback, width', SETTINGS)
+def test_columnar_swings_match_dict_loop(size, lookback, width):
+    if lookback == 'all':
+        lookback = size
+    for seed in SEEDS:
+        candles = synthetic_candles(size, seed)
+        klines = candles.to_klines()
+        prev = None
+        if size > 20:
+            prev, _ = bot_code.detect_swings('TEST', '3min',
+                                             klines[:size // 2], None,
+                                             lookback, width)
+        expected = bot_code.detect_swings('TEST', '3min', klines,
+                                          copy.deepcopy(prev), lookback,
+                                          width)
+        actual = bot_code.detect_swings('TEST', '3min', candles,
+                                        copy.deepcopy(prev), lookback, width)
+        assert actual == expected, f"seed {seed}"
+
+
+# SwingSeries: the capped, time-sorted pivot arrays behind the swing state
+
+
+def test_indexing_returns_pivot_dicts():
+    series = SwingSeries.from_list([[60, 1.5], [120, 2.5], [180, 0.5]])
+    assert len(series) == 3
+    assert series[0] == {'time': 60, 'price': 1.5}
+    assert series[-1] == {'time': 180, 'price': 0.5}
+    assert series[1:] == [{'time': 120, 'price': 2.5}, {'time': 180,
+                                                        'price': 0.5}]
+    assert [pivot['time'] for pivot in series] == [60, 120, 180]
+    assert series == list(series)
+    assert series.pop() == {'time': 180, 'price': 0.5}
+    assert len(series) == 2
+    with pytest.raises(IndexError):
+        series[5]
+
+
+def test_cap_drops_the_oldest_pivot():
+    series = SwingSeries(maxlen=3)
+    for i in range(5):
+        series.append_pivot(i * 60, float(i))
+    assert len(series) == 3
+    assert [pivot['time'] for pivot in series] == [120, 180, 240]
+    assert series.to_list() == [[120, 2.0], [180, 3.0], [240, 4.0]]
+    assert SwingSeries.from_list(series.to_list(), 3) == series
+
+
+def test_default_cap_is_max_swings():
+    swings = new_swings()
+    for i in range(bot_code.MAX_SWINGS + 10):
+        swings['highs'].append_pivot(i, float(i))
+    assert len(swings['highs']) == bot_code.MAX_SWINGS
+    assert swings['highs'][0]['time'] == 10
+
+
+def test_has_between_matches_a_scan():
+    rng = random.Random(1)
+    times = sorted(rng.sample(range(10000), 200))
+    series = SwingSeries(maxlen=len(times))
+    for t in times:
+        series.append_pivot(t, 1.0)
+    for _ in range(2000):
+        start, end = sorted(rng.sample(range(-10, 10010), 2))
+        expected = any(start < t < end for t in times)
+        assert series.has_between(start, end) == expected, (start, end)
+    # Strictly between: pivots at either end do not count
+    assert not series.has_between(times[0], times[1])
+    assert series.has_between(times[0], times[2])
+    assert not SwingSeries().has_between(0, 100)
+
+
+class CountingTimes:
+    # Pivot times that count how many of them were read
+
+    def __init__(self, times):
+        self.times = times
+        self.reads = 0
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self, index):
+        self.reads += 1
+        return self.times[index]
+
+
+def test_has_between_is_logarithmic():
+    # Reads per call grow with log2(n): 20 more for a million pivots, where a
+    # linear scan would read up to all of them
+    for size in (1000, 1000000):
+        series = SwingSeries(maxlen=size)
+        series.times = CountingTimes(array('q', range(0, 2 * size, 2)))
+        series.prices = array('d', bytes(8 * size))
+        for i in range(0, size - 1, size // 100):
+            series.times.reads = 0
+            assert series.has_between(2 * i + 1, 2 * i + 3)
+            assert not series.has_between(2 * i + 1, 2 * i + 2)
+            assert series.times.reads <= 2 * (size.bit_length() + 1)
+
+
+def test_copies_are_independent():
+    swings = new_swings()
+    swings['highs'].append_pivot(60, 1.0)
+    copied = copy_swings(swings)
+    copied['highs'].append_pivot(120, 2.0)
+    copied['lows'].append_pivot(90, 0.5)
+    assert len(swings['highs']) == 1 and len(swings['lows']) == 0
+    assert copied['highs'].maxlen == swings['highs'].maxlen
@@ -0,0 +1,138 @@
+import json
+import random
+
+import pytest
+
+from tracker import SignalTracker, TARGET_LEVELS
+
+# The sorted-level index of SignalTracker against a brute-force check of
+# every open signal on every tick
+
+
+def open_random(tracker, rng, market, now=0):
+    signal = rng.choice(['Long', 'Short'])
+    entry = 100 + rng.uniform(-5, 5)
+    distance = rng.uniform(0.5, 3)
+    sign = 1 if signal == 'Long' else -1
+    targets = [entry + sign * distance * k for k in (0.5, 0.75, 1)]
+    return tracker.open(market, signal, rng.choice(['Low', 'Medium']), entry,
+                        entry - sign * distance, targets, now)
+
+
+def brute_force(signals, market, price):
+    # Every level each open signal of `market` reached: the stop first,
+    # which closes the signal, then the targets not reached yet
+    events = []
+    for signal_id, signal in list(signals.items()):
+        if signal['market'] != market:
+            continue
+        long = signal['signal'] == 'Long'
+        if price <= signal['stop'] if long else price >= signal['stop']:
+            events.append((signal_id, 'stop'))
+            del signals[signal_id]
+            continue
+        for level, target in zip(TARGET_LEVELS, signal['targets']):
+            reached = price >= target if long else price <= target
+            if reached and level not in signal['hit']:
+                signal['hit'].append(level)
+                events.append((signal_id, level))
+        if len(signal['hit']) == len(TARGET_LEVELS):
+            del signals[signal_id]
+    return events
+
+
+def test_matches_brute_force_over_random_ticks():
+    rng = random.Random(7)
+    tracker = SignalTracker()
+    markets = ['BTCUSDT', 'ETHUSDT']
+    for _ in range(1000):
+        open_random(tracker, rng, rng.choice(markets))
+    signals = {signal['id']: signal for signal in tracker.open_signals()}
+    prices = dict.fromkeys(markets, 100.0)
+    closed = 0
+    for _ in range(20000):
+        market = rng.choice(markets)
+        prices[market] += rng.gauss(0, 0.05)
+        events = tracker.update(market, prices[market])
+        expected = brute_force(signals, market, prices[market])
+        assert sorted((event['signal']['id'], event['level'])
+                      for event in events) == sorted(expected)
+        closed += sum(1 for event in events if event['outcome'])
+    assert closed > 100
+    assert len(tracker) == len(signals)
+    assert {s['id']: s['hit']
+            for s in tracker.open_signals()} == {i: s['hit']
+                                                 for i, s in signals.items()}
+
+
+def test_stop_wins_over_a_target_on_the_same_tick():
+    tracker = SignalTracker()
+    # Levels on the wrong side of the entry: the tick reaches both
+    tracker.open('BTCUSDT', 'Long', 'Low', 100, 101, (99, 102, 103), now=0)
+    events = tracker.update('BTCUSDT', 100)
+    assert [(e['level'], e['outcome']) for e in events] == [('stop', 'stop')]
+    assert events[0]['signal']['hit'] == []
+    assert not tracker.has_open('BTCUSDT')
+    assert tracker.stats()['risks']['Low']['stops'] == 1
+    assert tracker.stats()['risks']['Low']['target1'] == 0
+
+
+def test_one_tick_can_reach_every_target():
+    tracker = SignalTracker()
+    tracker.open('BTCUSDT', 'Short', 'Low', 100, 102, (99, 98, 97), now=0)
+    assert tracker.update('BTCUSDT', 100.5) == []
+    events = tracker.update('BTCUSDT', 96)
+    # Only the event of the last target reached closes the signal
+    assert [(e['level'], e['outcome']) for e in events] == [
+        ('target3', None), ('target2', None), ('target1', 'target')
+    ]
+    assert len(tracker) == 0
+    assert tracker.stats()['risks']['Low']['wins'] == 1
+
+
+def test_signals_expire_after_max_age():
+    tracker = SignalTracker(max_age=100)
+    first = tracker.open('BTCUSDT', 'Long', 'Low', 100, 99, (101, 102, 103),
+                         now=0)
+    tracker.open('ETHUSDT', 'Long', 'Low', 100, 99, (101, 102, 103), now=50)
+    tracker.update('BTCUSDT', 101.5)
+    assert tracker.expire(now=99) == []
+    events = tracker.expire(now=100)
+    assert [(e['signal']['id'], e['outcome']) for e in events] == [(first,
+                                                                   'expired')]
+    assert events[0]['signal']['hit'] == ['target1']
+    assert not tracker.has_open('BTCUSDT')
+    assert tracker.has_open('ETHUSDT')
+    stats = tracker.stats()['markets']['BTCUSDT']
+    assert (stats['expired'], stats['wins'], stats['win_rate']) == (1, 1, 1.0)
+    # An expired signal's levels no longer trigger
+    assert tracker.update('BTCUSDT', 90) == []
+
+
+def test_round_trip_through_a_snapshot():
+    rng = random.Random(3)
+    tracker = SignalTracker()
+    for _ in range(50):
+        open_random(tracker, rng, 'BTCUSDT')
+    for price in (99, 101, 98.5, 102):
+        tracker.update('BTCUSDT', price)
+    restored = SignalTracker()
+    restored.restore(json.loads(json.dumps(tracker.to_dict())))
+    assert restored.open_signals() == tracker.open_signals()
+    assert restored.stats() == tracker.stats()
+    # Restored signals keep being followed, and new ids do not collide
+    for price in (97, 103, 100):
+        assert restored.update('BTCUSDT', price) == tracker.update(
+            'BTCUSDT', price)
+    assert restored.open('BTCUSDT', 'Long', 'Low', 100, 99,
+                         (101, 102, 103)) == tracker.open(
+                             'BTCUSDT', 'Long', 'Low', 100, 99,
+                             (101, 102, 103))
+
+
+@pytest.mark.parametrize('data', [None, {}])
+def test_restoring_nothing_keeps_the_tracker_empty(data):
+    tracker = SignalTracker()
+    tracker.restore(data)
+    assert len(tracker) == 0
+    assert tracker.stats() == {'open': 0, 'markets': {}, 'risks': {}}
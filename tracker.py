@@ -0,0 +1,237 @@
+import bisect
+import threading
+import time
+
+# Follows the signals the bot sent until their stop loss or last profit
+# target is reached, or they expire. The trigger levels of each market are
+# kept in two price-sorted lists, so a price tick finds every level it
+# crossed with a binary search instead of checking each open signal:
+#   rising   reached when the price rises to them: Long targets, Short stops
+#   falling  reached when the price falls to them: Long stops, Short targets
+# Entries are (price, signal id, level name).
+
+# ================== Settings ==================
+# Open signals are closed as expired after this many seconds
+SIGNAL_MAX_AGE = 24 * 60 * 60
+TARGET_LEVELS = ('target1', 'target2', 'target3')
+
+# ================== Tracker ==================
+
+
+def new_stats():
+    return {
+        'signals': 0,
+        'open': 0,
+        'target1': 0,
+        'target2': 0,
+        'target3': 0,
+        'stops': 0,
+        'expired': 0,
+        'closed': 0,
+        # Closed signals that reached at least one target
+        'wins': 0
+    }
+
+
+class SignalTracker:
+
+    def __init__(self, max_age=SIGNAL_MAX_AGE):
+        self.max_age = max_age
+        # Open signals by id, oldest first
+        self._signals = {}
+        self._rising = {}
+        self._falling = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+        self.markets = {}
+        self.risks = {}
+
+    def __len__(self):
+        return len(self._signals)
+
+    def has_open(self, market):
+        return bool(self._rising.get(market) or self._falling.get(market))
+
+    def open(self, market, signal, risk, entry, stop, targets, now=None):
+        # Starts following a 'Long' or 'Short' signal; returns its id
+        now = time.time() if now is None else now
+        with self._lock:
+            signal_id = self._next_id
+            self._next_id += 1
+            self._add({
+                'id': signal_id,
+                'market': market,
+                'signal': signal,
+                'risk': risk,
+                'entry': entry,
+                'stop': stop,
+                'targets': list(targets),
+                'hit': [],
+                'opened_at': now
+            })
+            for stats in self._stats(market, risk):
+                stats['signals'] += 1
+                stats['open'] += 1
+        return signal_id
+
+    def update(self, market, price):
+        # Applies a price tick; returns an event per level it reached:
+        # {'signal', 'level', 'price', 'outcome'}, the outcome ('target',
+        # 'stop') being set on the event that closed the signal
+        events = []
+        with self._lock:
+            rising = self._rising.get(market)
+            reached = []
+            if rising and rising[0][0] <= price:
+                end = bisect.bisect_right(rising, (price, float('inf')))
+                reached += rising[:end]
+                del rising[:end]
+            falling = self._falling.get(market)
+            if falling and falling[-1][0] >= price:
+                start = bisect.bisect_left(falling, (price, ))
+                reached += falling[start:]
+                del falling[start:]
+            # A stop and a target on the same tick only happen with levels
+            # on the wrong side of the entry; the stop counts
+            reached.sort(key=lambda entry: entry[2] != 'stop')
+            for _, signal_id, level in reached:
+                signal = self._signals.get(signal_id)
+                if signal is None:
+                    continue
+                outcome = None
+                if level == 'stop':
+                    outcome = 'stop'
+                else:
+                    signal['hit'].append(level)
+                    for stats in self._stats(market, signal['risk']):
+                        stats[level] += 1
+                    if len(signal['hit']) == len(signal['targets']):
+                        outcome = 'target'
+                if outcome:
+                    self._close(signal, outcome)
+                events.append({
+                    'signal': dict(signal, hit=list(signal['hit'])),
+                    'level': level,
+                    'price': price,
+                    'outcome': outcome
+                })
+        return events
+
+    def expire(self, now=None):
+        # Closes the signals older than max_age; returns their events
+        now = time.time() if now is None else now
+        events = []
+        with self._lock:
+            for signal in list(self._signals.values()):
+                if now - signal['opened_at'] < self.max_age:
+                    break
+                self._close(signal, 'expired')
+                events.append({
+                    'signal': dict(signal, hit=list(signal['hit'])),
+                    'level': None,
+                    'price': None,
+                    'outcome': 'expired'
+                })
+        return events
+
+    def open_signals(self, market=None):
+        with self._lock:
+            return [
+                dict(signal, hit=list(signal['hit']))
+                for signal in self._signals.values()
+                if market is None or signal['market'] == market
+            ]
+
+    def stats(self):
+        # Counts per market and per risk tier
+        with self._lock:
+            return {
+                'open': len(self._signals),
+                'markets': _with_rates(self.markets),
+                'risks': _with_rates(self.risks)
+            }
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'signals': [
+                    dict(s, hit=list(s['hit'])) for s in self._signals.values()
+                ],
+                'markets': {m: dict(s) for m, s in self.markets.items()},
+                'risks': {r: dict(s) for r, s in self.risks.items()},
+                'next_id': self._next_id
+            }
+
+    def restore(self, data):
+        # Loads to_dict() output; open signals are followed again
+        if not data:
+            return
+        with self._lock:
+            # Ids of closed signals are not given out again either
+            self._next_id = max(self._next_id, data.get('next_id', 1))
+            for signal in data.get('signals', []):
+                if signal['id'] not in self._signals:
+                    self._add(signal)
+                self._next_id = max(self._next_id, signal['id'] + 1)
+            for name, saved in (('markets', self.markets), ('risks',
+                                                             self.risks)):
+                for key, stats in data.get(name, {}).items():
+                    saved[key] = dict(new_stats(), **stats)
+
+    def _add(self, signal):
+        # Indexes the stop and the targets not reached yet
+        self._signals[signal['id']] = signal
+        rising = self._rising.setdefault(signal['market'], [])
+        falling = self._falling.setdefault(signal['market'], [])
+        targets, stops = ((rising, falling) if signal['signal'] == 'Long' else
+                          (falling, rising))
+        for level, price in zip(TARGET_LEVELS, signal['targets']):
+            if level not in signal['hit']:
+                bisect.insort(targets, (price, signal['id'], level))
+        if signal['stop'] is not None:
+            bisect.insort(stops, (signal['stop'], signal['id'], 'stop'))
+
+    def _close(self, signal, outcome):
+        # Drops the signal and its remaining levels from the index
+        del self._signals[signal['id']]
+        for levels in (self._rising, self._falling):
+            entries = levels.get(signal['market'])
+            if entries is None:
+                continue
+            for entry in self._levels(signal):
+                index = bisect.bisect_left(entries, entry)
+                if index < len(entries) and entries[index] == entry:
+                    del entries[index]
+            if not entries:
+                del levels[signal['market']]
+        for stats in self._stats(signal['market'], signal['risk']):
+            stats['open'] -= 1
+            stats['closed'] += 1
+            if outcome == 'stop':
+                stats['stops'] += 1
+            elif outcome == 'expired':
+                stats['expired'] += 1
+            if signal['hit']:
+                stats['wins'] += 1
+
+    def _levels(self, signal):
+        entries = [(price, signal['id'], level)
+                   for level, price in zip(TARGET_LEVELS, signal['targets'])
+                   if level not in signal['hit']]
+        if signal['stop'] is not None:
+            entries.append((signal['stop'], signal['id'], 'stop'))
+        return entries
+
+    def _stats(self, market, risk):
+        return (self.markets.setdefault(market, new_stats()),
+                self.risks.setdefault(risk, new_stats()))
+
+
+def _with_rates(groups):
+    # Adds the win rate of the closed signals to every group
+    return {
+        key: dict(stats,
+                  win_rate=stats['wins'] / stats['closed']
+                  if stats['closed'] else None)
+        for key, stats in groups.items()
+    }